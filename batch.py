@@ -0,0 +1,316 @@
+""" Batch pricing of many receipts at once for the Receipt Total Generation
+    Kata.
+
+    Requires numpy.  This is meant for back office work (end of day
+    re-pricing, promotion simulation, order import) and is not part of what
+    is delivered on the POS terminal.
+"""
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from .receipts import (POS, StockType, SaleType, Money, MILLI, CENT,
+                       Standard, CentsOff, ConditionalPercentOff,
+                       FixedStandard, FixedCentsOff,
+                       FixedConditionalPercentOff)
+
+# kinds of pricing rule, the order the rows are grouped in
+STANDARD, CENTS_OFF, PERCENT_OFF = range(3)
+_KINDS = {Standard: STANDARD, CentsOff: CENTS_OFF,
+          ConditionalPercentOff: PERCENT_OFF,
+          FixedStandard: STANDARD, FixedCentsOff: CENTS_OFF,
+          FixedConditionalPercentOff: PERCENT_OFF}
+
+_SPLITTER = 134217729.0  # 2**27 + 1, splits a double into two halves
+
+
+def _split(a: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    "split doubles into high and low halves that multiply exactly"
+    t = _SPLITTER * a
+    hi = t - (t - a)
+    return (hi, a - hi)
+
+
+def _to_cents(x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Return x * 100 as a double and the exact error of that double, so
+        that the two add up to the exact value of the binary float x times
+        100.  (Dekker's product.)
+    """
+    p = x * 100.0
+    x_hi, x_lo = _split(x)
+    err = (x_hi * 100.0 - p) + x_lo * 100.0
+    return (p, err)
+
+
+def _round_up(x: np.ndarray) -> np.ndarray:
+    """ Whole cents of the dollar amounts x rounded up, as quantize with
+        ROUND_UP does to the exact value of each float.
+    """
+    p, err = _to_cents(x)
+    cents = np.ceil(p)
+    return np.where((cents == p) & (err > 0), cents + 1, cents)
+
+
+def _round_half_even(x: np.ndarray) -> np.ndarray:
+    """ Whole cents of the dollar amounts x rounded half to even, as
+        quantize does by default to the exact value of each float.
+    """
+    p, err = _to_cents(x)
+    low = np.floor(p)
+    tie = (p - low) == 0.5
+    cents = np.rint(p)
+    cents = np.where(tie & (err > 0), low + 1, cents)
+    return np.where(tie & (err < 0), low, cents)
+
+
+def _round_fixed(amount: np.ndarray, divisor: int) -> np.ndarray:
+    """ Round the Millicents amount/divisor to whole cents, half to even,
+        returned in Millicents.
+    """
+    whole = divisor * MILLI
+    cents, rest = np.divmod(amount, whole)
+    cents += ((2 * rest > whole) |
+              ((2 * rest == whole) & (cents % 2 == 1)))
+    return cents * MILLI
+
+
+def _handle_limit(disc_limit: np.ndarray, cur_disc: np.ndarray,
+                  cur_full: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    "StockType.handle_limit over arrays, a disc_limit of 0 is no limit"
+    over = (disc_limit != 0) & (cur_disc > disc_limit)
+    return (np.where(over, disc_limit, cur_disc),
+            np.where(over, (cur_disc + cur_full) - disc_limit, cur_full))
+
+
+def _typed_rows(quantities: Sequence) -> Tuple[np.ndarray, np.ndarray]:
+    """ Which quantities are floats and which are ints, as
+        StockType.check_qty tells them apart.
+    """
+    if isinstance(quantities, np.ndarray):
+        kind = quantities.dtype.kind
+        return (np.full(quantities.shape, kind == 'f'),
+                np.full(quantities.shape, kind in 'biu'))
+    return (np.fromiter((isinstance(qty, float) for qty in quantities),
+                        dtype=bool, count=len(quantities)),
+            np.fromiter((isinstance(qty, int) for qty in quantities),
+                        dtype=bool, count=len(quantities)))
+
+
+def _param(rule: Any, name: str) -> Any:
+    "a rule parameter, 0 for rules without it or when it is None"
+    return getattr(rule, name, None) or 0
+
+
+class BatchPricer:
+    """ Prices many receipts at once from columns of (receipt id, item,
+        quantity) rows.  The catalog of the POS is turned into arrays when
+        the pricer is made.  Rows are summed into one quantity per item on
+        each receipt, grouped by the kind of pricing rule and priced with
+        array arithmetic, and the prices are summed into a total for each
+        receipt.
+
+        The totals are the same, to the cent, as Receipt.total() on a
+        receipt with the same scans opened on the version of the catalog
+        that was current when the pricer was made.  The floating point
+        arithmetic of the pricing rules is repeated operation for operation
+        and the roundings are made on the exact value of each float, as
+        Decimal does.  Every item in the catalog must be priced by
+        Standard, CentsOff or ConditionalPercentOff (or their fixed-point
+        versions).
+    """
+
+    def __init__(self, pos: POS) -> None:
+        self.fixed_point = pos.fixed_point
+        catalog = pos.snapshot()
+        # item codes in catalog order, and the reverse look-up
+        self.items: List[str] = list(catalog)
+        self.index: Dict[str, int] = {item: pos_in_catalog for
+                                      pos_in_catalog, item in
+                                      enumerate(self.items)}
+        stocks: List[StockType] = [catalog[item]
+                                   for item in self.items]
+        for item, stock in zip(self.items, stocks):
+            if type(stock.pricing) not in _KINDS:
+                raise NotImplementedError(f"Batch pricing needs a pricing "
+                    f"rule, {item} is priced by {stock.pricing!r}")
+        num = np.int64 if self.fixed_point else np.float64
+        self.unit_price = np.array([stock.price for stock in stocks],
+                                   dtype=num)
+        self.by_wt = np.array([stock.how_sold == SaleType.BY_WT
+                               for stock in stocks], dtype=bool)
+        self.kind = np.array([_KINDS[type(stock.pricing)]
+                              for stock in stocks], dtype=np.int8)
+        rules = [stock.pricing for stock in stocks]
+        self.amount_off = np.array([_param(rule, 'amount_off')
+                                    for rule in rules], dtype=num)
+        self.limit = np.array([_param(rule, 'limit') for rule in rules],
+                              dtype=np.int64)
+        self.min_items = np.array([_param(rule, 'min_items')
+                                   for rule in rules], dtype=np.int64)
+        self.disc_items = np.array([_param(rule, 'disc_items')
+                                    for rule in rules], dtype=np.int64)
+        self.pct_off = np.array([_param(rule, 'pct_off') for rule in rules],
+                                dtype=num)
+
+    def item_index(self, item_descs: Sequence[str]) -> np.ndarray:
+        """ Convert item codes to positions in the catalog.  Raises a
+            KeyError for an item that is not stocked.
+        """
+        return np.fromiter((self.index[item] for item in item_descs),
+                           dtype=np.int64, count=len(item_descs))
+
+    def price(self, receipt_ids: Sequence, item_ids: Sequence,
+              quantities: Sequence) -> Tuple[np.ndarray, np.ndarray]:
+        """ Total the receipts described by the three columns.  item_ids
+            are item codes or positions in the catalog (see item_index)
+            and quantities are counts or weights as they would be passed to
+            Receipt.add_scan.  Returns the sorted unique receipt ids and
+            the total of each in integer cents.  Raises NotImplementedError
+            if a quantity is a float for an item sold by count or an int
+            for an item sold by weight, as StockType.check_qty does.
+        """
+        receipt_ids = np.asarray(receipt_ids)
+        item_ids = np.asarray(item_ids)
+        if item_ids.dtype.kind not in 'iu':
+            item_ids = self.item_index(item_ids.tolist())
+        is_float, is_int = _typed_rows(quantities)
+        qty = np.asarray(quantities, dtype=np.float64)
+        by_wt = self.by_wt[item_ids]
+        if np.any(~by_wt & is_float):
+            raise NotImplementedError("Quantity sold must be an int "
+                "when the item is sold by count.")
+        if np.any(by_wt & is_int):
+            raise NotImplementedError("Quantity sold must be a real "
+                "when the item is sold by weight.")
+        if self.fixed_point:
+            qty = np.where(by_wt, np.rint(qty * MILLI), qty).astype(np.int64)
+
+        # one line for each item on each receipt, quantities summed in
+        # scan order as the receipt sums them
+        receipts, receipt_of_row = np.unique(receipt_ids, return_inverse=True)
+        receipt_of_row = receipt_of_row.reshape(-1)
+        line_key = receipt_of_row * len(self.items) + item_ids
+        lines, line_of_row = np.unique(line_key, return_inverse=True)
+        line_of_row = line_of_row.reshape(-1)
+        line_qty = np.bincount(line_of_row, weights=qty,
+                               minlength=len(lines))
+        if self.fixed_point:
+            line_qty = np.rint(line_qty).astype(np.int64)
+        line_item = lines % len(self.items)
+        line_receipt = lines // len(self.items)
+
+        if self.fixed_point:
+            cents = self._price_fixed(line_item, line_qty, line_receipt,
+                                      len(receipts))
+        else:
+            cents = self._price_float(line_item, line_qty, line_receipt,
+                                      len(receipts))
+        return (receipts, cents)
+
+    def totals(self, receipt_ids: Sequence, item_ids: Sequence,
+               quantities: Sequence) -> Dict[Any, Money]:
+        "price() as a dictionary of receipt id to Money total"
+        receipts, cents = self.price(receipt_ids, item_ids, quantities)
+        return {receipt: (Money(int(amount)) / 100).quantize(CENT)
+                for receipt, amount in zip(receipts.tolist(), cents.tolist())}
+
+    def _price_float(self, item: np.ndarray, qty: np.ndarray,
+                     receipt: np.ndarray, num_receipts: int) -> np.ndarray:
+        """ Price lines in floating point.  Each line's price is split into
+            whole cents and, for the discounted part of cents off specials
+            that is not rounded, a fraction of a cent held as a double and
+            its exact error.  These are summed for each receipt and the sum
+            rounded half even as Receipt.total() rounds it.
+        """
+        whole = np.zeros(len(item))
+        frac = np.zeros(len(item))
+        err = np.zeros(len(item))
+        price = self.unit_price[item]
+        kind = self.kind[item]
+
+        rows = kind == STANDARD
+        whole[rows] = _round_up(price[rows] * qty[rows])
+
+        rows = kind == CENTS_OFF
+        p, q = price[rows], qty[rows]
+        off = self.amount_off[item[rows]]
+        disc, full = _handle_limit(self.limit[item[rows]].astype(np.float64),
+                                   q, np.zeros(len(q)))
+        full_cents = _round_half_even(p * full)
+        on = off <= p
+        disc_p, disc_err = _to_cents((p - off) * disc)
+        disc_whole = np.rint(disc_p)
+        whole[rows] = full_cents + np.where(on, disc_whole, 0)
+        frac[rows] = np.where(on, disc_p - disc_whole, 0)
+        err[rows] = np.where(on, disc_err, 0)
+
+        rows = kind == PERCENT_OFF
+        p, q = price[rows], qty[rows]
+        min_items = self.min_items[item[rows]]
+        disc_items = self.disc_items[item[rows]]
+        pct_off = self.pct_off[item[rows]]
+        limit = self.limit[item[rows]]
+        grp = min_items + disc_items
+        disc_qty = ((np.floor_divide(q, grp) * disc_items) +
+                    np.maximum(np.remainder(q, grp) - min_items, 0))
+        full_qty = q - disc_qty
+        disc_qty, full_qty = _handle_limit((limit // grp).astype(np.float64),
+                                           disc_qty, full_qty)
+        whole[rows] = (_round_half_even(p * full_qty) +
+                       _round_half_even((p * (1.0 - pct_off / 100.0)) *
+                                        disc_qty))
+
+        # sum each receipt and round the fractions of a cent half to even
+        total = np.bincount(receipt, weights=whole, minlength=num_receipts)
+        frac = np.bincount(receipt, weights=frac, minlength=num_receipts)
+        err = np.bincount(receipt, weights=err, minlength=num_receipts)
+        carry = np.rint(frac)
+        total += carry
+        frac -= carry
+        above = (frac - 0.5) + err
+        below = (frac + 0.5) + err
+        odd = np.remainder(total, 2) == 1
+        total += np.where((above > 0) | ((above == 0) & odd), 1, 0)
+        total -= np.where((below < 0) | ((below == 0) & odd), 1, 0)
+        return total.astype(np.int64)
+
+    def _price_fixed(self, item: np.ndarray, qty: np.ndarray,
+                     receipt: np.ndarray, num_receipts: int) -> np.ndarray:
+        """ Price lines in integer Millicents with the fixed-point rules,
+            sum them for each receipt and round half even to cents.
+        """
+        amount = np.zeros(len(item), dtype=np.int64)
+        price = self.unit_price[item]
+        kind = self.kind[item]
+        unit = np.where(self.by_wt[item], MILLI, 1)
+        scale = MILLI // unit
+
+        rows = kind == STANDARD
+        exact = price[rows] * qty[rows] * scale[rows]
+        amount[rows] = -(-exact // MILLI) * MILLI
+
+        rows = kind == CENTS_OFF
+        p, q, u, s = price[rows], qty[rows], unit[rows], scale[rows]
+        off = self.amount_off[item[rows]]
+        disc, full = _handle_limit(self.limit[item[rows]] * u, q,
+                                   np.zeros(len(q), dtype=np.int64))
+        amount[rows] = (_round_fixed(p * full * s, 1) +
+                        np.where(off <= p, (p - off) * disc * s, 0))
+
+        rows = kind == PERCENT_OFF
+        p, q, u, s = price[rows], qty[rows], unit[rows], scale[rows]
+        min_items = self.min_items[item[rows]]
+        disc_items = self.disc_items[item[rows]]
+        pct_off = self.pct_off[item[rows]]
+        grp = min_items + disc_items
+        disc_qty = (((q // (grp * u)) * disc_items * u) +
+                    np.maximum((q % (grp * u)) - min_items * u, 0))
+        full_qty = q - disc_qty
+        disc_qty, full_qty = _handle_limit(
+            (self.limit[item[rows]] // grp) * u, disc_qty, full_qty)
+        amount[rows] = (_round_fixed(p * full_qty * s, 1) +
+                        _round_fixed(p * (100 - pct_off) * disc_qty * s, 100))
+
+        total = np.zeros(num_receipts, dtype=np.int64)
+        np.add.at(total, receipt, amount)
+        return _round_fixed(total, 1) // MILLI
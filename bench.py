@@ -0,0 +1,285 @@
+""" Benchmarks of the checkout hot paths of the Receipt Total Generation
+    Kata.
+
+    Synthetic catalogs and baskets are generated from a seed, so a run can
+    be repeated exactly.  Catalogs have a chosen number of items, mix of
+    pricing rules, share of rules with limits and share of items sold by
+    weight.  Baskets pick items with a skew towards popular ones, mostly in
+    quantities of one to three, and void some of their scans.
+
+    Each Receipt operation (add_scan, +=, total, remove_last and remove)
+    and POS construction is timed one call at a time.  Throughput and
+    p50/p90/p99 latency are reported for each, and the peak memory of a
+    separate run under tracemalloc.  Results are saved as JSON and can be
+    compared against a saved baseline, failing if any benchmark is slower
+    by more than a threshold.
+
+    Usage:  python -m <package>.bench [--skus N ...] [--out FILE]
+                                      [--baseline FILE] [--threshold PCT]
+
+    This is a development tool and is not part of what is delivered on the
+    POS terminal.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .receipts import POS, Receipt, StockType, SaleType, PriceCache
+
+Op = Tuple[Any, ...]  # an operation on a receipt, its name first
+Latencies = Dict[str, List[int]]  # operation -> nanoseconds per call
+
+PERCENTILES = (50, 90, 99)
+
+
+def make_catalog(skus: int, rule_mix: Tuple[float, float, float] = (
+                     0.7, 0.2, 0.1),
+                 limit_share: float = 0.2, by_wt_share: float = 0.1,
+                 seed: int = 0) -> Dict[str, StockType]:
+    """ A catalog of skus items.  rule_mix is the share of standard,
+        cents_off and conditional_percent_off items, limit_share the share
+        of specials that have a limit and by_wt_share the share of items
+        sold by weight.
+    """
+    rand = random.Random(seed)
+    catalog = {}
+    for num in range(skus):
+        cents = rand.randint(25, 2000)
+        how_sold = (SaleType.BY_WT if rand.random() < by_wt_share
+                    else SaleType.EACH)
+        limit = rand.choice((4, 6, 10)) if rand.random() < limit_share \
+            else None
+        kind = rand.choices((0, 1, 2), rule_mix)[0]
+        if kind == 1:
+            pricing = StockType.cents_off(
+                rand.randint(1, max(1, cents // 4)) / 100, limit)
+        elif kind == 2:
+            min_items = rand.randint(1, 3)
+            pricing = StockType.conditional_percent_off(
+                min_items, 1, rand.choice((25, 50, 100)),
+                limit and max(limit, min_items + 1))
+        else:
+            pricing = StockType.standard
+        catalog[f"SKU{num:07d}"] = StockType(cents / 100, how_sold, pricing)
+    return catalog
+
+
+def make_baskets(catalog: Dict[str, StockType], baskets: int,
+                 lines: int = 20, skew: float = 1.1,
+                 void_share: float = 0.05, remove_share: float = 0.02,
+                 seed: int = 0) -> List[List[Op]]:
+    """ Baskets of about lines scans each.  Items are picked with a Zipf
+        skew, counted items mostly in ones (by +=), twos and threes and
+        weighed items from 0.1 to 3 pounds.  void_share of the scans are
+        voided with remove_last and remove_share of them have part of their
+        quantity removed.  The total is asked for after every scan, as a
+        customer display does.
+    """
+    rand = random.Random(seed)
+    codes = list(catalog)
+    rand.shuffle(codes)
+    weights = [1 / (rank ** skew) for rank in range(1, len(codes) + 1)]
+    cum_weights = []
+    running = 0.0
+    for weight in weights:
+        running += weight
+        cum_weights.append(running)
+    result = []
+    for _ in range(baskets):
+        ops: List[Op] = []
+        count = max(1, int(rand.expovariate(1 / lines)))
+        for item in rand.choices(codes, cum_weights=cum_weights, k=count):
+            if catalog[item].how_sold == SaleType.BY_WT:
+                qty = round(rand.uniform(0.1, 3.0), 3)
+                ops.append(('add_scan', item, qty))
+            else:
+                qty = rand.choices((1, 2, 3), (0.8, 0.15, 0.05))[0]
+                ops.append(('+=', item) if qty == 1
+                           else ('add_scan', item, qty))
+            ops.append(('total',))
+            chance = rand.random()
+            if chance < void_share:
+                ops.append(('remove_last', item))
+            elif chance < void_share + remove_share:
+                ops.append(('remove', item,
+                            qty / 2 if isinstance(qty, float) else 1))
+        ops.append(('total',))
+        result.append(ops)
+    return result
+
+
+def run_baskets(pos: POS, baskets: Sequence[Sequence[Op]],
+                latencies: Latencies = None) -> Latencies:
+    "run the baskets on new receipts, timing each operation"
+    latencies = {} if latencies is None else latencies
+    clock = time.perf_counter_ns
+    for ops in baskets:
+        receipt = Receipt(pos)
+        for op in ops:
+            name = op[0]
+            start = clock()
+            if name == '+=':
+                receipt += op[1]
+            elif name == 'add_scan':
+                receipt.add_scan(op[1], op[2])
+            elif name == 'total':
+                receipt.total()
+            elif name == 'remove_last':
+                receipt.remove_last(op[1])
+            else:
+                receipt.remove(op[1], op[2])
+            latencies.setdefault(name, []).append(clock() - start)
+    return latencies
+
+
+def time_pos(catalog: Dict[str, StockType], repeat: int = 5,
+             fixed_point: bool = False) -> List[int]:
+    "nanoseconds to construct a POS, once per repeat"
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        POS(catalog, fixed_point)
+        times.append(time.perf_counter_ns() - start)
+    return times
+
+
+def summarize(times: Sequence[int]) -> Dict[str, float]:
+    "the count, calls per second and percentile latencies in microseconds"
+    times = sorted(times)
+    summary = {'count': len(times),
+               'per_second': len(times) / (sum(times) / 1e9 or 1e-9)}
+    for percentile in PERCENTILES:
+        rank = min(len(times) - 1, len(times) * percentile // 100)
+        summary[f'p{percentile}_us'] = times[rank] / 1e3
+    return summary
+
+
+def peak_memory(catalog: Dict[str, StockType],
+                baskets: Sequence[Sequence[Op]], fixed_point: bool = False,
+                cache_size: int = 0) -> int:
+    "peak bytes allocated building a POS and running the baskets"
+    tracemalloc.start()
+    try:
+        pos = POS(catalog, fixed_point,
+                  PriceCache(cache_size) if cache_size else None)
+        run_baskets(pos, baskets)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(skus: int, baskets: int = 1000, seed: int = 0,
+              fixed_point: bool = False, cache_size: int = 0,
+              **catalog_options: Any) -> Dict[str, Any]:
+    """ Benchmark a catalog of skus items, returning the summary of each
+        operation and of POS construction and the peak memory.
+    """
+    catalog = make_catalog(skus, seed=seed, **catalog_options)
+    basket_ops = make_baskets(catalog, baskets, seed=seed)
+    results: Dict[str, Any] = {
+        'POS': summarize(time_pos(catalog, fixed_point=fixed_point))}
+    pos = POS(catalog, fixed_point,
+              PriceCache(cache_size) if cache_size else None)
+    for name, times in sorted(run_baskets(pos, basket_ops).items()):
+        results[name] = summarize(times)
+    results['peak_memory_bytes'] = peak_memory(catalog, basket_ops,
+                                               fixed_point, cache_size)
+    return results
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any],
+            threshold: float = 0.1) -> List[str]:
+    """ The benchmarks in both results whose throughput fell, or whose p99
+        latency or peak memory grew, by more than threshold (a fraction)
+        of the baseline.
+    """
+    regressions = []
+    for size, base_run in baseline.get('runs', {}).items():
+        run = results.get('runs', {}).get(size)
+        if run is None:
+            continue
+        for name, base in base_run.items():
+            if name not in run:
+                continue
+            if name == 'peak_memory_bytes':
+                if run[name] > base * (1 + threshold):
+                    regressions.append(f"{size} {name}: {base} -> "
+                                       f"{run[name]}")
+                continue
+            if run[name]['per_second'] < base['per_second'] * (1 - threshold):
+                regressions.append(f"{size} {name} per_second: "
+                                   f"{base['per_second']:.0f} -> "
+                                   f"{run[name]['per_second']:.0f}")
+            if run[name]['p99_us'] > base['p99_us'] * (1 + threshold):
+                regressions.append(f"{size} {name} p99_us: "
+                                   f"{base['p99_us']:.1f} -> "
+                                   f"{run[name]['p99_us']:.1f}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """ run the benchmarks, print and save the results and return 1 if
+        they regressed from the baseline
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--skus', type=int, nargs='+', default=[1000, 100000],
+                        help='catalog sizes to benchmark')
+    parser.add_argument('--baskets', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fixed-point', action='store_true')
+    parser.add_argument('--price-cache', type=int, default=0,
+                        help='size of a PriceCache, none if 0')
+    parser.add_argument('--by-wt', type=float, default=0.1,
+                        help='share of items sold by weight')
+    parser.add_argument('--limits', type=float, default=0.2,
+                        help='share of items whose special has a limit')
+    parser.add_argument('--rule-mix', type=float, nargs=3,
+                        default=[0.7, 0.2, 0.1],
+                        help='shares of standard, cents_off and '
+                             'conditional_percent_off items')
+    parser.add_argument('--out', help='file to save the results in')
+    parser.add_argument('--baseline', help='results to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent worse than the baseline that fails')
+    args = parser.parse_args(argv)
+    results = {
+        'config': {'baskets': args.baskets, 'seed': args.seed,
+                   'fixed_point': args.fixed_point,
+                   'price_cache': args.price_cache, 'by_wt': args.by_wt,
+                   'limits': args.limits, 'rule_mix': args.rule_mix,
+                   'python': sys.version.split()[0]},
+        'runs': {},
+    }
+    for skus in args.skus:
+        run = benchmark(skus, args.baskets, args.seed, args.fixed_point,
+                        args.price_cache, rule_mix=tuple(args.rule_mix),
+                        limit_share=args.limits, by_wt_share=args.by_wt)
+        results['runs'][str(skus)] = run
+        print(f"{skus} SKUs, peak memory "
+              f"{run['peak_memory_bytes'] / 2 ** 20:.1f} MiB")
+        for name, summary in run.items():
+            if name != 'peak_memory_bytes':
+                print(f"  {name:12} {summary['count']:8} "
+                      f"{summary['per_second']:12.0f}/s "
+                      + " ".join(f"p{percentile} "
+                                 f"{summary[f'p{percentile}_us']:9.1f}us"
+                                 for percentile in PERCENTILES))
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump(results, out, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file),
+                                  args.threshold / 100)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+""" Compiled, memory-mapped catalogs for the Receipt Total Generation Kata.
+
+    compile_catalog() writes a stock_items dictionary to a binary file and
+    MappedCatalog reads it through mmap, so a POS can start without
+    building the catalog in Python and every lane process on a terminal
+    shares the one copy in the page cache.
+
+    The file is a header, a table of fixed-width records sorted by item
+    code and a table of the item codes themselves:
+
+        header   magic, format version, flags, record count
+        records  item code offset and length, how sold, rule kind, price,
+                 amount off, limit, min items, disc items, percent off
+        codes    UTF-8 item codes, back to back
+"""
+import mmap
+import struct
+from collections import OrderedDict
+from threading import Lock
+from typing import Iterator, Mapping, Tuple
+
+from .receipts import (StockType, SaleType, PricingRule, Standard, CentsOff,
+                       ConditionalPercentOff, FixedStandard, FixedCentsOff,
+                       FixedConditionalPercentOff)
+
+MAGIC = b'GSKCATLG'
+VERSION = 1
+FIXED_POINT = 1  # flag set when every record is priced in fixed point
+
+HEADER = struct.Struct('<8sIIQ')
+RECORD = struct.Struct('<IHBBddqiid')
+
+# rule kinds as stored in a record, the position is the stored value
+RULES: Tuple[type, ...] = (Standard, CentsOff, ConditionalPercentOff,
+                           FixedStandard, FixedCentsOff,
+                           FixedConditionalPercentOff)
+
+
+def _encode(code: bytes, code_offset: int, stock: StockType) -> bytes:
+    "pack one catalog entry into a record"
+    rule = stock.pricing
+    if type(rule) not in RULES:
+        raise NotImplementedError(f"Only pricing rules can be compiled, "
+            f"got {rule!r}")
+    return RECORD.pack(code_offset, len(code), stock.how_sold.value,
+                       RULES.index(type(rule)), stock.price,
+                       getattr(rule, 'amount_off', 0),
+                       getattr(rule, 'limit', None) or 0,
+                       getattr(rule, 'min_items', 0),
+                       getattr(rule, 'disc_items', 0),
+                       getattr(rule, 'pct_off', 0))
+
+
+def compile_catalog(stock_items: Mapping[str, StockType], path: str) -> None:
+    """ Write a catalog file from a stock_items dictionary.  Raises
+        NotImplementedError if an item is priced by something other than a
+        PricingRule.
+    """
+    codes = sorted(item.encode('utf-8') for item in stock_items)
+    fixed_point = all(stock.pricing.fixed_point
+                      for stock in stock_items.values()
+                      if isinstance(stock.pricing, PricingRule))
+    records = []
+    offset = 0
+    for code in codes:
+        records.append(_encode(code, offset,
+                               stock_items[code.decode('utf-8')]))
+        offset += len(code)
+    with open(path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, VERSION,
+                              FIXED_POINT if fixed_point and codes else 0,
+                              len(codes)))
+        out.write(b''.join(records))
+        out.write(b''.join(codes))
+
+
+class MappedCatalog(Mapping):
+    """ A read-only mapping of item code to StockType backed by a compiled
+        catalog file.  Look-ups binary search the sorted records in the
+        mapped file and decode the StockType.  The last cache_size items
+        looked up are kept decoded, and lanes on threads may share the
+        cache.  Decoded items compare equal to the items that were
+        compiled.
+    """
+
+    def __init__(self, path: str, cache_size: int = 1024) -> None:
+        self.path = path
+        self.cache_size = cache_size
+        with open(path, 'rb') as catalog_file:
+            self._map = mmap.mmap(catalog_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        magic, version, flags, self._count = \
+            HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise NotImplementedError(f"{path} is not a version {VERSION} "
+                f"catalog")
+        self.fixed_point = bool(flags & FIXED_POINT)
+        self._codes_start = HEADER.size + self._count * RECORD.size
+        self._cache: 'OrderedDict[str, StockType]' = OrderedDict()
+        self._lock = Lock()
+
+    def __reduce__(self):
+        # a copy sent to another process maps the same file
+        return (type(self), (self.path, self.cache_size))
+
+    def close(self) -> None:
+        "unmap the file"
+        self._map.close()
+
+    def __enter__(self) -> 'MappedCatalog':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _record(self, num: int) -> tuple:
+        return RECORD.unpack_from(self._map, HEADER.size + num * RECORD.size)
+
+    def _code(self, record: tuple) -> bytes:
+        start = self._codes_start + record[0]
+        return self._map[start:start + record[1]]
+
+    def _find(self, code: bytes) -> tuple:
+        "binary search for the record of an item code"
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            record = self._record(mid)
+            found = self._code(record)
+            if found < code:
+                low = mid + 1
+            elif found > code:
+                high = mid
+            else:
+                return record
+        raise KeyError(code.decode('utf-8'))
+
+    @staticmethod
+    def _decode(record: tuple) -> StockType:
+        (_, _, how_sold, kind, price, amount_off, limit, min_items,
+         disc_items, pct_off) = record
+        rule = RULES[kind]
+        fixed_point = rule.fixed_point
+        if fixed_point:
+            price = int(price)
+        if rule in (Standard, FixedStandard):
+            pricing = rule()
+        elif rule in (CentsOff, FixedCentsOff):
+            pricing = rule(int(amount_off) if fixed_point else amount_off,
+                           limit or None)
+        else:
+            pricing = rule(min_items, disc_items,
+                           int(pct_off) if fixed_point else pct_off,
+                           limit or None)
+        return StockType(price, SaleType(how_sold), pricing)
+
+    def __getitem__(self, item: str) -> StockType:
+        with self._lock:
+            stock = self._cache.get(item)
+            if stock is not None:
+                self._cache.move_to_end(item)
+                return stock
+        stock = self._decode(self._find(item.encode('utf-8')))
+        with self._lock:
+            self._cache[item] = stock
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return stock
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[str]:
+        for num in range(self._count):
+            yield self._code(self._record(num)).decode('utf-8')
@@ -0,0 +1,171 @@
+""" Line-item change events of a receipt for the Receipt Total Generation
+    Kata.
+
+    Customer displays, e-receipts and the loss-prevention feed want to know
+    what each scan changed rather than re-read the whole receipt.  A
+    Receipt with a ReceiptEvents publishes, after every change made to it,
+    an event for each line the change touched, one for each promotion whose
+    discount it applied, changed or revoked, and the receipt's new total:
+
+        LineAdded          the first scan of an item
+        QtyChanged         more or less of an item already on the receipt
+        LineVoided         the last of an item taken off
+        PromotionApplied   a promotion's discount is new or changed
+        PromotionRevoked   a promotion no longer applies
+        Subtotal           the receipt's total after the change
+
+    Only the lines touched are re-priced, and only the promotions of the
+    items touched are re-evaluated, so the work of publishing a scan does
+    not grow with the size of the receipt.  Events are delivered to
+    subscriber callbacks, kept in a bounded backlog that drain() yields,
+    and streamed to async iterators.
+"""
+import asyncio
+from collections import deque
+from typing import (AsyncIterator, Callable, Deque, Dict, Iterator, List,
+                    NamedTuple, Union)
+
+from .receipts import Receipt, Money, SaleQuantity
+
+
+class LineAdded(NamedTuple):
+    item: str  # item code
+    qty: SaleQuantity  # quantity on the receipt, a count or a weight
+    subtotal: Money  # amount owed for the line
+
+
+class QtyChanged(NamedTuple):
+    item: str
+    qty: SaleQuantity  # new quantity on the receipt
+    change: SaleQuantity  # quantity added, negative if taken off
+    subtotal: Money
+
+
+class LineVoided(NamedTuple):
+    item: str
+    qty: SaleQuantity  # quantity taken off, all that was on the receipt
+
+
+class PromotionApplied(NamedTuple):
+    name: str
+    discount: Money  # the promotion's discount now
+
+
+class PromotionRevoked(NamedTuple):
+    name: str
+    discount: Money  # the discount taken back
+
+
+class Subtotal(NamedTuple):
+    total: Money  # the receipt's total after the change
+
+
+Event = Union[LineAdded, QtyChanged, LineVoided, PromotionApplied,
+              PromotionRevoked, Subtotal]
+Subscriber = Callable[[Event], None]
+
+
+class ReceiptEvents:
+    """ The publisher of a receipt's changes, attached to the receipt when
+        it is made.  A receipt has one publisher at a time, which any number
+        of subscribers and streams may listen to; making a second raises a
+        RuntimeError until the first is closed.  The last backlog events
+        are kept for drain().  Events are published in the thread that
+        changes the receipt, and streams must be read on the event loop
+        that thread runs.
+    """
+
+    def __init__(self, receipt: Receipt, backlog: int = 1024) -> None:
+        if receipt.events is not None:
+            raise RuntimeError("The receipt already publishes its changes "
+                               "to a ReceiptEvents")
+        self.receipt = receipt
+        self._subscribers: List[Subscriber] = []
+        self._streams: List[asyncio.Queue] = []
+        self._backlog: Deque[Event] = deque(maxlen=backlog)
+        # quantity of each line, by item code, as last published
+        self._lines: Dict[str, SaleQuantity] = {
+            item_desc: receipt.line(item_desc)[0]
+            for item_desc in receipt.purchases}
+        # discount of each promotion that applies, as last published
+        self._discounts: Dict[str, Money] = {}
+        if hasattr(receipt, 'changed_discounts'):
+            self._discounts = receipt.discounts()
+            receipt.changed_discounts()
+        receipt.events = self
+
+    def subscribe(self, callback: Subscriber) -> Subscriber:
+        "call callback with every event from now on, and return it"
+        self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback: Subscriber) -> None:
+        self._subscribers.remove(callback)
+
+    def _publish(self, event: Event) -> None:
+        self._backlog.append(event)
+        for callback in self._subscribers:
+            callback(event)
+        for queue in self._streams:
+            queue.put_nowait(event)
+
+    def changed(self, receipt: Receipt, items: List[str]) -> None:
+        """ Publish the events of a change to the lines of some items, by
+            item code, of the receipt.  Called by the receipt.
+        """
+        for item_desc in items:
+            old = self._lines.get(item_desc, 0)
+            qty, subtotal = receipt.line(item_desc)
+            if qty:
+                self._lines[item_desc] = qty
+            else:
+                self._lines.pop(item_desc, None)
+            if not old and qty:
+                self._publish(LineAdded(item_desc, qty, subtotal))
+            elif old and not qty:
+                self._publish(LineVoided(item_desc, old))
+            elif qty != old:
+                self._publish(QtyChanged(item_desc, qty, qty - old,
+                                         subtotal))
+        if hasattr(receipt, 'changed_discounts'):
+            # only the promotions the change may have touched are compared
+            for name, discount in sorted(
+                    receipt.changed_discounts().items()):
+                old = self._discounts.get(name)
+                if discount == old:
+                    continue
+                if discount is None:
+                    del self._discounts[name]
+                    self._publish(PromotionRevoked(name, old))
+                else:
+                    self._discounts[name] = discount
+                    self._publish(PromotionApplied(name, discount))
+        self._publish(Subtotal(receipt.total()))
+
+    def drain(self) -> Iterator[Event]:
+        "yield the events in the backlog, oldest first, taking them out"
+        backlog = self._backlog
+        while backlog:
+            yield backlog.popleft()
+
+    async def stream(self) -> AsyncIterator[Event]:
+        "the events published from now until close()"
+        queue: asyncio.Queue = asyncio.Queue()
+        self._streams.append(queue)
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            self._streams.remove(queue)
+
+    def __aiter__(self) -> AsyncIterator[Event]:
+        return self.stream()
+
+    def close(self) -> None:
+        "detach from the receipt and end the streams"
+        self.receipt.events = None
+        for queue in self._streams:
+            queue.put_nowait(None)
@@ -0,0 +1,277 @@
+""" An append-only binary journal of receipts for the Receipt Total
+    Generation Kata.
+
+    A Receipt attached to a ReceiptJournal writes every change made to it
+    (a scan added, the last scan removed, a quantity removed, a void
+    restored) and its close with the total.  If the lane process dies, the
+    receipts that were open are rebuilt from the journal when it restarts.
+
+    The file is a header followed by fixed-size records:
+
+        header   magic, format version
+        record   operation, flags, item id, receipt id, count, weight
+
+    Item codes are interned: the first time a code is written it is given
+    an id by an item record, followed by the UTF-8 code padded to a whole
+    number of records, and later records carry only the id.  Records are
+    buffered and written and fsynced in batches of sync_every, so a crash
+    loses at most the last batch.  A record torn by a crash is dropped
+    when the journal is opened again.
+"""
+import mmap
+import os
+import struct
+import threading
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from .receipts import POS, Receipt, Money, SaleQuantity
+
+MAGIC = b'GSKJRNL\0'
+VERSION = 1
+
+HEADER = struct.Struct('<8sI20x')
+RECORD = struct.Struct('<BBHIQqd')
+
+# operations, as stored in a record
+OPEN, ADD, REMOVE_LAST, REMOVE, RESTORE, CLOSE, ITEM = range(1, 8)
+WEIGHT = 1  # flag set when the quantity is a weight, held in the weight
+
+Op = Tuple[int, int, SaleQuantity]  # operation, item id, quantity
+
+
+def _padded(length: int) -> int:
+    "the length of an item code padded to a whole number of records"
+    return -(-length // RECORD.size) * RECORD.size
+
+
+def _walk(data: mmap.mmap) -> Iterator[Tuple[int, int, int, int]]:
+    """ The start, end, operation and receipt id of each record of a
+        journal whose records are all whole, an item record taking in its
+        code.
+    """
+    pos = HEADER.size
+    while pos < len(data):
+        op, _, _, _, txn, count, _ = RECORD.unpack_from(data, pos)
+        end = pos + RECORD.size
+        if op == ITEM:
+            end += _padded(count)
+        yield pos, end, op, txn
+        pos = end
+
+
+class ReceiptJournal:
+    """ The journal kept in the file at path.  Opening an existing journal
+        reads it, through mmap, to find the item ids already given out and
+        the operations of the receipts that were never closed, which
+        recover() then rebuilds.
+    """
+
+    def __init__(self, path: str, sync_every: int = 64) -> None:
+        self.path = path
+        self.sync_every = sync_every
+        self.skipped = 0  # operations recover() could not apply
+        self._items: Dict[str, int] = {}  # item code -> id
+        self._codes: List[str] = []  # item code of each id
+        self._next_txn = 1
+        # operations of each receipt not closed when the journal was read
+        self._open: Dict[int, List[Op]] = {}
+        self._buffer = bytearray()
+        self._pending = 0  # records in the buffer
+        self._lock = threading.Lock()
+        length = self._read()
+        if os.path.exists(path):
+            # drop a torn last record, or a header torn while it was made
+            os.truncate(path, length)
+        self._file = open(path, 'ab')
+        if not length:
+            self._file.write(HEADER.pack(MAGIC, VERSION))
+            self._sync()
+
+    def _read(self) -> int:
+        "read the journal's records and return the length of the good ones"
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+        if size < HEADER.size:
+            return 0
+        with open(self.path, 'rb') as journal_file:
+            with mmap.mmap(journal_file.fileno(), 0,
+                           access=mmap.ACCESS_READ) as data:
+                magic, version = HEADER.unpack_from(data, 0)
+                if magic != MAGIC or version != VERSION:
+                    raise NotImplementedError(f"{self.path} is not a "
+                        f"version {VERSION} receipt journal")
+                return self._records(data, size)
+
+    def _records(self, data: mmap.mmap, size: int) -> int:
+        open_txns = self._open
+        codes = self._codes
+        end = HEADER.size + (size - HEADER.size) // RECORD.size * RECORD.size
+        pos = HEADER.size
+        skip = 0  # records of an item code still to pass over
+        for op, flags, _, item, txn, count, weight in RECORD.iter_unpack(
+                memoryview(data)[HEADER.size:end]):
+            if skip:
+                skip -= 1
+                continue
+            if op == ADD or op == REMOVE_LAST or op == REMOVE:
+                ops = open_txns.get(txn)
+                if ops is None:
+                    ops = open_txns[txn] = []
+                ops.append((op, item, weight if flags & WEIGHT else count))
+            elif op == OPEN:
+                open_txns[txn] = []
+                if txn >= self._next_txn:
+                    self._next_txn = txn + 1
+            elif op == CLOSE:
+                open_txns.pop(txn, None)
+            elif op == RESTORE:
+                open_txns.setdefault(txn, []).append((op, item, 0))
+            elif op == ITEM:
+                start = pos + RECORD.size
+                skip = _padded(count) // RECORD.size
+                if start + skip * RECORD.size > end or item != len(codes):
+                    break
+                code = data[start:start + count].decode('utf-8')
+                codes.append(code)
+                self._items[code] = item
+                pos += skip * RECORD.size
+            else:
+                break
+            pos += RECORD.size
+        return pos
+
+    def _sync(self) -> None:
+        "write the buffered records and fsync"
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._buffer.clear()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def _intern(self, item_desc: str) -> int:
+        "the id of an item code, writing an item record for a new one"
+        item = self._items.get(item_desc)
+        if item is None:
+            item = self._items[item_desc] = len(self._codes)
+            self._codes.append(item_desc)
+            code = item_desc.encode('utf-8')
+            self._buffer += RECORD.pack(ITEM, 0, 0, item, 0, len(code), 0.0)
+            self._buffer += code.ljust(_padded(len(code)), b'\0')
+        return item
+
+    def _write(self, op: int, txn: int, item_desc: str = None,
+               qty: SaleQuantity = 0) -> None:
+        with self._lock:
+            item = 0 if item_desc is None else self._intern(item_desc)
+            if isinstance(qty, float):
+                record = RECORD.pack(op, WEIGHT, 0, item, txn, 0, qty)
+            else:
+                record = RECORD.pack(op, 0, 0, item, txn, qty, 0.0)
+            self._buffer += record
+            self._pending += 1
+            if self._pending >= self.sync_every:
+                self._sync()
+
+    def attach(self, receipt: Receipt) -> int:
+        "start journaling a new receipt and return its id in the journal"
+        with self._lock:
+            txn = self._next_txn
+            self._next_txn += 1
+        self._write(OPEN, txn)
+        receipt.journal = self
+        receipt.txn = txn
+        return txn
+
+    def add(self, txn: int, item_desc: str, qty: SaleQuantity) -> None:
+        self._write(ADD, txn, item_desc, qty)
+
+    def remove_last(self, txn: int, item_desc: str) -> None:
+        self._write(REMOVE_LAST, txn, item_desc)
+
+    def remove(self, txn: int, item_desc: str, qty: SaleQuantity) -> None:
+        self._write(REMOVE, txn, item_desc, qty)
+
+    def restore_void(self, txn: int) -> None:
+        self._write(RESTORE, txn)
+
+    def close_receipt(self, receipt: Receipt) -> Money:
+        "write the close of a receipt with its total, and return the total"
+        total = receipt.total()
+        self._write(CLOSE, receipt.txn, qty=int(total.scaleb(2)))
+        receipt.journal = None
+        return total
+
+    def recover(self, pos: POS,
+                factory: Callable[[POS], Receipt] = Receipt
+                ) -> Dict[int, Receipt]:
+        """ Rebuild the receipts that were open when the journal was read,
+            by id, and attach them to the journal.  factory makes each
+            receipt, a PromotionReceipt for example.  An operation that can
+            no longer be applied, such as a scan of an item since removed
+            from the catalog, is skipped and counted in skipped.
+        """
+        receipts: Dict[int, Receipt] = {}
+        codes = self._codes
+        for txn, ops in self._open.items():
+            receipt = factory(pos)
+            for op, item, qty in ops:
+                try:
+                    if op == ADD:
+                        receipt.add_scan(codes[item], qty)
+                    elif op == REMOVE_LAST:
+                        receipt.remove_last(codes[item])
+                    elif op == REMOVE:
+                        receipt.remove(codes[item], qty)
+                    else:
+                        receipt.restore_void()
+                except (KeyError, NotImplementedError):
+                    self.skipped += 1
+            receipt.journal = self
+            receipt.txn = txn
+            receipts[txn] = receipt
+        self._open = {}
+        return receipts
+
+    def compact(self) -> None:
+        """ Rewrite the journal without the receipts that have been closed.
+            The new file is written beside the old one, fsynced and renamed
+            over it, so a crash leaves one or the other.
+        """
+        with self._lock:
+            self._sync()
+            temp = f'{self.path}.compact'
+            with open(self.path, 'rb') as journal_file, \
+                    mmap.mmap(journal_file.fileno(), 0,
+                              access=mmap.ACCESS_READ) as data, \
+                    open(temp, 'wb') as out:
+                closed = {txn for _, _, op, txn in _walk(data)
+                          if op == CLOSE}
+                out.write(data[:HEADER.size])
+                for start, end, op, txn in _walk(data):
+                    if op == ITEM or txn not in closed:
+                        out.write(data[start:end])
+                out.flush()
+                os.fsync(out.fileno())
+            self._file.close()
+            os.replace(temp, self.path)
+            self._file = open(self.path, 'ab')
+
+    def sync(self) -> None:
+        "write and fsync the records not yet written"
+        with self._lock:
+            self._sync()
+
+    def close(self) -> None:
+        "sync and close the file"
+        with self._lock:
+            self._sync()
+            self._file.close()
+
+    def __enter__(self) -> 'ReceiptJournal':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,137 @@
+""" Load generator for the lane server of the Receipt Total Generation
+    Kata.
+
+    Opens a number of connections to a lane server and on each runs
+    receipts one after another: open, scan items (by count or by weight
+    as the catalog sells them), void some of them, total and close.  The
+    latency of every request is recorded and the count, p50 and p99 of
+    each kind of request is reported.
+
+    Usage:  python -m <package>.loadgen CATALOG [--port N | --unix PATH]
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .receipts import SaleType
+from .catalog import MappedCatalog
+
+Latencies = Dict[str, List[float]]  # request kind -> seconds per request
+
+
+class LaneClient:
+    "a connection to a lane server that sends one request at a time"
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter,
+                 latencies: Latencies) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.latencies = latencies
+
+    @classmethod
+    async def connect(cls, port: int = None, host: str = '127.0.0.1',
+                      unix: str = None,
+                      latencies: Latencies = None) -> 'LaneClient':
+        "connect to a Unix socket path if given, else TCP"
+        if unix:
+            reader, writer = await asyncio.open_unix_connection(unix)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer, {} if latencies is None else latencies)
+
+    async def request(self, line: str) -> str:
+        """ Send a request and return the response, raising RuntimeError
+            if it is an error.
+        """
+        start = time.perf_counter()
+        self.writer.write(line.encode() + b'\n')
+        response = (await self.reader.readline()).decode().rstrip('\n')
+        self.latencies.setdefault(line.split(None, 1)[0], []).append(
+            time.perf_counter() - start)
+        if not response.startswith('OK'):
+            raise RuntimeError(f"{line!r} got {response!r}")
+        return response[3:]
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def run_receipts(client: LaneClient, items: Sequence[Tuple[str, bool]],
+                       receipts: int, scans: int, rand: random.Random) -> None:
+    """ Run receipts on one connection.  items are (item code, sold by
+        weight) pairs.
+    """
+    for _ in range(receipts):
+        receipt_id = await client.request('OPEN')
+        for _ in range(scans):
+            item, by_wt = rand.choice(items)
+            if by_wt:
+                weight = round(rand.uniform(0.1, 3.0), 3)
+                await client.request(f'ADD {receipt_id} {weight:.3f} {item}')
+            else:
+                await client.request(f'SCAN {receipt_id} {item}')
+            if rand.random() < 0.05:
+                await client.request(f'VOID {receipt_id} {item}')
+        await client.request(f'TOTAL {receipt_id}')
+        await client.request(f'CLOSE {receipt_id}')
+
+
+async def load(items: Sequence[Tuple[str, bool]], connections: int = 100,
+               receipts: int = 10, scans: int = 30, port: int = None,
+               host: str = '127.0.0.1', unix: str = None,
+               seed: int = 0) -> Latencies:
+    "run receipts on many connections at once and return the latencies"
+    latencies: Latencies = {}
+    clients = [await LaneClient.connect(port, host, unix, latencies)
+               for _ in range(connections)]
+    await asyncio.gather(*(run_receipts(client, items, receipts, scans,
+                                        random.Random(seed + num))
+                           for num, client in enumerate(clients)))
+    for client in clients:
+        await client.close()
+    return latencies
+
+
+def summarize(latencies: Latencies) -> Dict[str, Tuple[int, float, float]]:
+    "the count, p50 and p99 in seconds of each kind of request"
+    summary = {}
+    for kind, times in latencies.items():
+        times = sorted(times)
+        summary[kind] = (len(times), times[len(times) // 2],
+                         times[min(len(times) - 1, len(times) * 99 // 100)])
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    "run a load against a lane server and print the latencies"
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('catalog', help='compiled catalog file')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='Unix socket path instead of TCP')
+    parser.add_argument('--connections', type=int, default=100)
+    parser.add_argument('--receipts', type=int, default=10)
+    parser.add_argument('--scans', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    with MappedCatalog(args.catalog) as catalog:
+        items = [(item, catalog[item].how_sold == SaleType.BY_WT)
+                 for item in catalog]
+    start = time.perf_counter()
+    latencies = asyncio.run(load(items, args.connections, args.receipts,
+                                 args.scans, args.port, args.host,
+                                 args.unix, args.seed))
+    elapsed = time.perf_counter() - start
+    total = sum(len(times) for times in latencies.values())
+    print(f"{total} requests in {elapsed:.2f}s, {total / elapsed:.0f}/s")
+    for kind, (count, p50, p99) in sorted(summarize(latencies).items()):
+        print(f"{kind:8} {count:8} p50 {p50 * 1e6:8.0f}us "
+              f"p99 {p99 * 1e6:8.0f}us")
+
+
+if __name__ == '__main__':
+    main()
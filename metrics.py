@@ -0,0 +1,265 @@
+""" Opt-in instrumentation of the Receipt Total Generation Kata.
+
+    enable() wraps POS.scan, StockType.check_qty, the __call__ of every
+    PricingRule class and Receipt.total, remove and remove_last so that
+    each call is timed into a Metrics object.  disable() puts the original
+    methods back, so when instrumentation is off the hot paths run exactly
+    the code they run without this module.
+
+    Metrics keeps a call count, cumulative time and latency histogram for
+    each operation and for each kind of pricing rule, and the calls and
+    time spent on each item code so the heaviest items can be reported.
+    Receipt._reprice is wrapped as well, so a pricing call is put down to
+    the item code the receipt is re-pricing.  check_qty calls, which are
+    given only a StockType, are not put down to an item.
+    prometheus() renders a snapshot in the Prometheus text format, which
+    dump() writes to a file (for a node exporter's textfile collector) and
+    publish() passes to a callback.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .receipts import POS, Receipt, StockType, PricingRule
+
+# upper bounds in seconds of the latency histogram buckets
+BUCKETS: Tuple[float, ...] = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4,
+                              2.5e-4, 5e-4, 1e-3, 2.5e-3, 1e-2)
+
+
+class Histogram:
+    "A count of observations in each latency bucket, and their sum"
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds: Sequence[float] = BUCKETS) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last is above them all
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+
+def _escape(value: str) -> str:
+    "a label value escaped for the Prometheus text format"
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+class Metrics:
+    """ Timings of the instrumented calls.  Calls are broken down by
+        operation, by kind of pricing rule and by item code, and the top_n
+        item codes with the most time are exported.
+    """
+
+    def __init__(self, top_n: int = 20,
+                 buckets: Sequence[float] = BUCKETS) -> None:
+        self.top_n = top_n
+        self.buckets = buckets
+        self.ops: Dict[str, Histogram] = {}  # operation -> latencies
+        self.rules: Dict[str, Histogram] = {}  # rule class name -> latencies
+        self.skus: Dict[str, List] = {}  # item code -> [calls, seconds]
+        self._lock = threading.Lock()
+
+    def observe(self, op: str, seconds: float, sku: str = None,
+                rule: str = None) -> None:
+        "record one call of an operation"
+        with self._lock:
+            histogram = self.ops.get(op)
+            if histogram is None:
+                histogram = self.ops[op] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            if rule is not None:
+                histogram = self.rules.get(rule)
+                if histogram is None:
+                    histogram = self.rules[rule] = Histogram(self.buckets)
+                histogram.observe(seconds)
+            if sku is not None:
+                totals = self.skus.get(sku)
+                if totals is None:
+                    self.skus[sku] = [1, seconds]
+                else:
+                    totals[0] += 1
+                    totals[1] += seconds
+
+    def heaviest(self) -> List[Tuple[str, int, float]]:
+        "the top_n item codes by time, as (code, calls, seconds)"
+        with self._lock:
+            ranked = sorted(self.skus.items(), key=lambda entry: entry[1][1],
+                            reverse=True)[:self.top_n]
+        return [(sku, calls, seconds) for sku, (calls, seconds) in ranked]
+
+    def reset(self) -> None:
+        "forget every timing"
+        with self._lock:
+            self.ops.clear()
+            self.rules.clear()
+            self.skus.clear()
+
+    @staticmethod
+    def _histogram(lines: List[str], name: str, label: str, value: str,
+                   histogram: Histogram) -> None:
+        cumulative = 0
+        for bound, count in zip(histogram.bounds, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{label}="{value}",le="{bound!r}"}} '
+                         f'{cumulative}')
+        lines.append(f'{name}_bucket{{{label}="{value}",le="+Inf"}} '
+                     f'{histogram.count}')
+        lines.append(f'{name}_sum{{{label}="{value}"}} {histogram.sum!r}')
+        lines.append(f'{name}_count{{{label}="{value}"}} {histogram.count}')
+
+    def prometheus(self) -> str:
+        "a snapshot of the metrics in the Prometheus text format"
+        heaviest = self.heaviest()
+        lines: List[str] = []
+        with self._lock:
+            lines.append('# HELP receipt_op_seconds Latency of POS and '
+                         'Receipt operations.')
+            lines.append('# TYPE receipt_op_seconds histogram')
+            for op, histogram in sorted(self.ops.items()):
+                self._histogram(lines, 'receipt_op_seconds', 'op', op,
+                                histogram)
+            lines.append('# HELP receipt_rule_seconds Latency of pricing '
+                         'rules by kind.')
+            lines.append('# TYPE receipt_rule_seconds histogram')
+            for rule, histogram in sorted(self.rules.items()):
+                self._histogram(lines, 'receipt_rule_seconds', 'rule', rule,
+                                histogram)
+        lines.append('# HELP receipt_sku_calls_total Calls for the items '
+                     'with the most time.')
+        lines.append('# TYPE receipt_sku_calls_total counter')
+        for sku, calls, _ in heaviest:
+            lines.append(f'receipt_sku_calls_total{{sku="{_escape(sku)}"}} '
+                         f'{calls}')
+        lines.append('# HELP receipt_sku_seconds_total Time spent on the '
+                     'items with the most time.')
+        lines.append('# TYPE receipt_sku_seconds_total counter')
+        for sku, _, seconds in heaviest:
+            lines.append(f'receipt_sku_seconds_total{{sku="{_escape(sku)}"}} '
+                         f'{seconds!r}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str) -> None:
+        """ Write a snapshot to a file.  It is written to a temporary file
+            and renamed so a reader never sees half of it.
+        """
+        temp = f'{path}.{os.getpid()}.tmp'
+        with open(temp, 'w') as out:
+            out.write(self.prometheus())
+        os.replace(temp, path)
+
+    def publish(self, callback: Callable[[str], None]) -> None:
+        "pass a snapshot to a callback"
+        callback(self.prometheus())
+
+
+# the methods replaced by enable(), to be put back by disable()
+_originals: List[Tuple[type, str, Callable]] = []
+
+
+def _rule_classes() -> Iterator[type]:
+    "PricingRule and every subclass that defines its own __call__"
+    todo = [PricingRule]
+    while todo:
+        cls = todo.pop()
+        todo.extend(cls.__subclasses__())
+        if '__call__' in cls.__dict__:
+            yield cls
+
+
+def _patch(cls: type, name: str, wrapper: Callable) -> None:
+    _originals.append((cls, name, cls.__dict__[name]))
+    setattr(cls, name, wrapper)
+
+
+def enable(metrics: Metrics) -> None:
+    """ Start timing calls into metrics.  Raises RuntimeError if
+        instrumentation is already enabled.
+    """
+    if _originals:
+        raise RuntimeError("Instrumentation is already enabled")
+    clock = time.perf_counter
+    observe = metrics.observe
+    # the item code each thread's receipt is re-pricing, if any
+    pricing = threading.local()
+
+    scan = POS.scan
+
+    def timed_scan(self: POS, item: str, snapshot=None) -> StockType:
+        start = clock()
+        try:
+            return scan(self, item, snapshot)
+        finally:
+            observe('pos_scan', clock() - start, item)
+
+    check_qty = StockType.check_qty
+
+    def timed_check_qty(self: StockType, qty) -> None:
+        start = clock()
+        try:
+            check_qty(self, qty)
+        finally:
+            observe('check_qty', clock() - start)
+
+    def timed_receipt(op: str, method: Callable) -> Callable:
+        def timed(self: Receipt, *args):
+            start = clock()
+            try:
+                return method(self, *args)
+            finally:
+                observe(op, clock() - start, args[0] if args else None)
+        return timed
+
+    def timed_rule(method: Callable) -> Callable:
+        def timed(self: PricingRule, stock: StockType, qty):
+            start = clock()
+            try:
+                return method(self, stock, qty)
+            finally:
+                observe('price', clock() - start,
+                        getattr(pricing, 'item', None), type(self).__name__)
+        return timed
+
+    reprice = Receipt._reprice
+
+    def attributed_reprice(self: Receipt, item_desc: str) -> None:
+        pricing.item = item_desc
+        try:
+            reprice(self, item_desc)
+        finally:
+            pricing.item = None
+
+    _patch(POS, 'scan', timed_scan)
+    # StockType is a NamedTuple, the method is set on the class as usual
+    _patch(StockType, 'check_qty', timed_check_qty)
+    for op in ('total', 'remove', 'remove_last'):
+        _patch(Receipt, op, timed_receipt(f'receipt_{op}',
+                                          Receipt.__dict__[op]))
+    _patch(Receipt, '_reprice', attributed_reprice)
+    for cls in list(_rule_classes()):
+        _patch(cls, '__call__', timed_rule(cls.__dict__['__call__']))
+
+
+def disable() -> None:
+    "stop timing calls and put back the original methods"
+    while _originals:
+        cls, name, method = _originals.pop()
+        setattr(cls, name, method)
+
+
+@contextmanager
+def instrumented(metrics: Optional[Metrics] = None) -> Iterator[Metrics]:
+    "time calls into metrics, or a new Metrics, inside a with block"
+    metrics = Metrics() if metrics is None else metrics
+    enable(metrics)
+    try:
+        yield metrics
+    finally:
+        disable()
@@ -0,0 +1,94 @@
+""" Per-store price overlays for the Receipt Total Generation Kata.
+
+    A chain runs many stores from one catalog, and each store's prices and
+    specials differ on only a few percent of the items.  A StoreOverlay is
+    a store's catalog: the chain's base catalog, shared by every store,
+    and the store's own overrides of an item's price, how it is sold or
+    its pricing rule, and items only the store carries.  It is a read-only
+    mapping of item code to StockType that a POS takes in place of a
+    stock_items dictionary, so the memory a store needs grows with its
+    overrides and not with the size of the catalog.
+
+    An overridden item is resolved the first time it is looked up, from
+    the store's overrides and then the base, and kept.  Resolved items are
+    interned in a pool that the stores of a chain can share, so stores
+    with the same override hold one StockType between them.
+"""
+from typing import Any, Dict, Iterator, Mapping
+
+from .receipts import StockType, SaleType, PricingRule, to_cents
+
+
+class StoreOverlay(Mapping):
+    """ A store's catalog over a shared base catalog.  prices, how_sold and
+        pricing override those parts of base items, and items adds items
+        (or replaces base items whole).  Overrides are in dollars and
+        pricing rules as made by StockType; when the base is fixed point
+        they are converted to match as they are resolved.
+    """
+
+    def __init__(self, base: Mapping[str, StockType],
+                 prices: Mapping[str, float] = None,
+                 how_sold: Mapping[str, SaleType] = None,
+                 pricing: Mapping[str, PricingRule] = None,
+                 items: Mapping[str, StockType] = None,
+                 pool: Dict[StockType, StockType] = None) -> None:
+        self.base = base
+        self.fixed_point = getattr(base, 'fixed_point', False)
+        self.prices = dict(prices or {})
+        self.how_sold = dict(how_sold or {})
+        self.pricing = dict(pricing or {})
+        self.items = dict(items or {})
+        # resolved StockTypes, shared by the stores given the same pool
+        self.pool: Dict[StockType, StockType] = {} if pool is None else pool
+        self._overridden = (self.prices.keys() | self.how_sold.keys() |
+                            self.pricing.keys() | self.items.keys())
+        self._resolved: Dict[str, StockType] = {}
+        self._added = sum(1 for item in self.items if item not in base)
+
+    def __reduce__(self):
+        # a copy sent to another process has its own pool
+        return (type(self), (self.base, self.prices, self.how_sold,
+                             self.pricing, self.items))
+
+    def _resolve(self, item: str) -> StockType:
+        "the store's StockType for an overridden item"
+        stock = self.items.get(item)
+        if stock is None:
+            stock = self.base[item]
+        elif self.fixed_point:
+            stock = stock.to_fixed_point()
+        changes: Dict[str, Any] = {}
+        if item in self.prices:
+            changes['price'] = (to_cents(self.prices[item])
+                                if self.fixed_point else self.prices[item])
+        if item in self.how_sold:
+            changes['how_sold'] = self.how_sold[item]
+        if item in self.pricing:
+            changes['pricing'] = (self.pricing[item].fixed()
+                                  if self.fixed_point else self.pricing[item])
+        if changes:
+            stock = stock._replace(**changes)
+        return self.pool.setdefault(stock, stock)
+
+    def __getitem__(self, item: str) -> StockType:
+        stock = self._resolved.get(item)
+        if stock is not None:
+            return stock
+        if item not in self._overridden:
+            return self.base[item]
+        stock = self._resolved[item] = self._resolve(item)
+        return stock
+
+    def __len__(self) -> int:
+        return len(self.base) + self._added
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.base
+        for item in self.items:
+            if item not in self.base:
+                yield item
+
+    def overrides(self) -> int:
+        "the number of items the store overrides or adds"
+        return len(self._overridden)
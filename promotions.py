@@ -0,0 +1,736 @@
+""" Promotions across several items for the Receipt Total Generation Kata.
+
+    The specials in receipts.py price each item on its own.  The
+    promotions here take in several items ("any 3 of these yogurts for
+    $5", "buy chips get salsa 50% off").  A PromotionIndex maps each item
+    code to the promotions it takes part in, and a PromotionReceipt uses it
+    to re-evaluate only the promotions whose items changed since the last
+    total, so the work per scan does not grow with the number of
+    promotions.
+
+    Only items sold by count take part.  A promotion is worked out from
+    what is charged for each unit after the item's own special and its
+    discount is taken off the receipt's total.  Limits work as they do for
+    StockType.conditional_percent_off: the limit is divided by the number
+    of items in a deal and StockType.handle_limit caps the number of deals.
+"""
+import time
+from typing import (Callable, Dict, FrozenSet, Iterable, Iterator, List,
+                    NamedTuple, Optional, Sequence, Set, Tuple, Union)
+
+from .receipts import (POS, Receipt, StockType, SaleType, Scan, Money, CENT,
+                       SaleQuantity, FixedStandard)
+
+Units = Dict[str, Tuple[Money, int]]  # item code -> (unit price, count)
+
+
+class Promotion:
+    """ A deal across several items.  items are the codes of every item
+        that takes part.
+    """
+    __slots__ = ('name', 'items', 'limit')
+
+    def __init__(self, name: str, items: Iterable[str],
+                 limit: int = None) -> None:
+        self.name = name
+        self.items: FrozenSet[str] = frozenset(items)
+        self.limit = limit
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.name!r})"
+
+    def discount(self, units: Units) -> Money:
+        """ The discount for the items of this promotion on a receipt,
+            given the price and count of each of them that is on it.
+        """
+        raise NotImplementedError
+
+    def take(self, units: Units) -> Dict[str, int]:
+        "the count of each item that discount() puts into deals"
+        raise NotImplementedError
+
+    def allocations(self, units: Units) -> Iterator[Dict[str, int]]:
+        """ Every count of each item worth giving to this promotion, most
+            units first.  Used by AssignmentSolver.
+        """
+        raise NotImplementedError
+
+
+def _ranked(units: Units, items: FrozenSet[str]) -> List[Tuple[Money, str]]:
+    "the price and code of each unit of some items, highest priced first"
+    ranked = sorted(((price, item, count) for item, (price, count) in
+                     units.items() if item in items and count), reverse=True)
+    return [(price, item) for price, item, count in ranked
+            for _ in range(count)]
+
+
+def _counted(ranked: List[Tuple[Money, str]]) -> Dict[str, int]:
+    "the count of each item in a list of units"
+    counts: Dict[str, int] = {}
+    for _, item in ranked:
+        counts[item] = counts.get(item, 0) + 1
+    return counts
+
+
+def _compositions(counts: Sequence[Tuple[str, int]],
+                  total: int) -> Iterator[Dict[str, int]]:
+    """ Every way to take total units from items with the given counts,
+        the most of the earlier items first.
+    """
+    if not counts:
+        if not total:
+            yield {}
+        return
+    (item, count), rest = counts[0], counts[1:]
+    rest_count = sum(num for _, num in rest)
+    for num in range(min(count, total), max(total - rest_count, 0) - 1, -1):
+        for taken in _compositions(rest, total - num):
+            if num:
+                taken[item] = num
+            yield taken
+
+
+def _by_price(units: Units, items: FrozenSet[str]) -> List[Tuple[str, int]]:
+    "the code and count of some items, highest priced first"
+    return [(item, count) for _, item, count in
+            sorted(((price, item, count) for item, (price, count) in
+                    units.items() if item in items and count),
+                   reverse=True)]
+
+
+class MixAndMatch(Promotion):
+    """ 'Any qty of these items for price'.  The highest priced units are
+        put into deals first, and a deal that would cost more than the
+        regular prices of its units is not used.
+    """
+    __slots__ = ('qty', 'price')
+
+    def __init__(self, name: str, items: Iterable[str], qty: int,
+                 price: float, limit: int = None) -> None:
+        # ask customer if they want these common sense constraints. Not in
+        # the Use Cases but calculations may not be valid outside them.
+        if qty < 1:
+            raise NotImplementedError(f"Cannot have a deal on less than "
+                f"one item, got {qty}")
+        if price < 0:
+            raise NotImplementedError(f"Cannot have a deal price below "
+                f"zero, got {price}")
+        if limit and limit < qty:
+            raise NotImplementedError(f"Cannot have a purchase limit less "
+                f"than the number of items in the deal. Got limit={limit}, "
+                f"deal count={qty}")
+        super().__init__(name, items, limit)
+        self.qty = qty
+        self.price = Money(repr(price))
+
+    def _deals(self, count: int) -> int:
+        "the number of deals count units make, within the limit"
+        deals, _ = StockType.handle_limit(self.limit and
+                                          self.limit // self.qty,
+                                          count // self.qty,
+                                          count % self.qty)
+        return deals
+
+    def discount(self, units: Units) -> Money:
+        prices = [price for price, _ in _ranked(units, self.items)]
+        discount = Money(0)
+        for deal in range(self._deals(len(prices))):
+            regular = sum(prices[deal * self.qty:(deal + 1) * self.qty])
+            discount += max(regular - self.price, Money(0))
+        return discount.quantize(CENT)
+
+    def take(self, units: Units) -> Dict[str, int]:
+        ranked = _ranked(units, self.items)
+        return _counted(ranked[:self._deals(len(ranked)) * self.qty])
+
+    def allocations(self, units: Units) -> Iterator[Dict[str, int]]:
+        counts = _by_price(units, self.items)
+        for deals in range(self._deals(sum(num for _, num in counts)), 0, -1):
+            yield from _compositions(counts, deals * self.qty)
+
+
+class BuyGetPercentOff(Promotion):
+    """ 'Buy buy_qty of these items, get get_qty of those items pct_off%
+        off'.  The highest priced of the get items are discounted first.
+    """
+    __slots__ = ('buy_items', 'get_items', 'buy_qty', 'get_qty', 'pct_off')
+
+    def __init__(self, name: str, buy_items: Iterable[str],
+                 get_items: Iterable[str], pct_off: float,
+                 buy_qty: int = 1, get_qty: int = 1,
+                 limit: int = None) -> None:
+        buy_items = frozenset(buy_items)
+        get_items = frozenset(get_items)
+        # ask customer if they want these common sense constraints. Not in
+        # the Use Cases but calculations may not be valid outside them.
+        if buy_items & get_items:
+            raise NotImplementedError(f"Cannot have an item that is both "
+                f"bought and discounted, got {sorted(buy_items & get_items)}")
+        if pct_off <= 0 or pct_off > 100:
+            raise NotImplementedError(f"Cannot have a discount percentage "
+                f"that is 0% or less or more than 100%, got {pct_off}")
+        if buy_qty < 1 or get_qty < 1:
+            raise NotImplementedError(f"Cannot have a deal on less than "
+                f"one item, got buy {buy_qty} get {get_qty}")
+        if limit and limit < (buy_qty + get_qty):
+            raise NotImplementedError(f"Cannot have a purchase limit less "
+                f"than the number of items in the deal. Got limit={limit}, "
+                f"buy count={buy_qty}, get count={get_qty}")
+        super().__init__(name, buy_items | get_items, limit)
+        self.buy_items = buy_items
+        self.get_items = get_items
+        self.buy_qty = buy_qty
+        self.get_qty = get_qty
+        self.pct_off = Money(repr(pct_off))
+
+    def _discounted(self, bought: int, got: int) -> int:
+        "the number of get units discounted, within the limit"
+        disc = min((bought // self.buy_qty) * self.get_qty, got)
+        disc, _ = StockType.handle_limit(
+            self.limit and (self.limit // (self.buy_qty + self.get_qty)) *
+            self.get_qty, disc, got - disc)
+        return disc
+
+    def discount(self, units: Units) -> Money:
+        bought = sum(count for item, (_, count) in units.items()
+                     if item in self.buy_items)
+        prices = [price for price, _ in _ranked(units, self.get_items)]
+        disc = self._discounted(bought, len(prices))
+        return (sum(prices[:disc], Money(0)) * self.pct_off /
+                100).quantize(CENT)
+
+    def take(self, units: Units) -> Dict[str, int]:
+        bought = _ranked(units, self.buy_items)
+        got = _ranked(units, self.get_items)
+        disc = self._discounted(len(bought), len(got))
+        needed = -(-disc // self.get_qty) * self.buy_qty
+        return _counted(bought[:needed] + got[:disc])
+
+    def allocations(self, units: Units) -> Iterator[Dict[str, int]]:
+        buy = _by_price(units, self.buy_items)
+        get = _by_price(units, self.get_items)
+        bought = sum(num for _, num in buy)
+        most = self._discounted(bought, sum(num for _, num in get))
+        for deals in range(-(-most // self.get_qty), 0, -1):
+            # fewer get units than this are discounted with one deal less
+            for disc in range(min(most, deals * self.get_qty),
+                              (deals - 1) * self.get_qty, -1):
+                for taken in _compositions(buy, deals * self.buy_qty):
+                    for got in _compositions(get, disc):
+                        got.update(taken)
+                        yield got
+
+
+class PromotionIndex:
+    "The live promotions, indexed by the item codes that take part in them"
+
+    def __init__(self, promotions: Iterable[Promotion] = ()) -> None:
+        self.by_item: Dict[str, List[Promotion]] = {}
+        for promotion in promotions:
+            self.add(promotion)
+
+    def add(self, promotion: Promotion) -> None:
+        "index a promotion under each of its items"
+        for item in promotion.items:
+            self.by_item.setdefault(item, []).append(promotion)
+
+    def __contains__(self, item: str) -> bool:
+        return item in self.by_item
+
+    def __getitem__(self, item: str) -> Sequence[Promotion]:
+        "the promotions an item takes part in, empty if none"
+        return self.by_item.get(item, ())
+
+
+class Line(NamedTuple):
+    "An item on a receipt as the AssignmentSolver sees it"
+    price: Money  # regular price of one unit
+    count: int  # units on the receipt
+    cost: Callable[[int], Money]  # price of a number of units under the
+        # item's own special
+
+
+class Assignment(NamedTuple):
+    "The units given to each of a group of promotions and what that costs"
+    cost: Money  # price of all the lines
+    savings: Money  # how much less that is than every unit under its own
+        # special
+    units: Dict[Promotion, Dict[str, int]]  # units given to each promotion
+    discounts: Dict[Promotion, Money]  # what each promotion used saves
+        # against its units' own specials
+    optimal: bool  # False if the time budget ran out and this is greedy
+    gap: Money  # most that cost can be above the best, zero if optimal
+
+
+class _OutOfTime(Exception):
+    "the time budget of a solve ran out"
+
+
+class AssignmentSolver:
+    """ Finds the cheapest way for the customer to give the units on a
+        receipt to promotions that compete for them.  A unit given to a
+        promotion is charged its regular price less the promotion's
+        discount, and the units left over are priced by their items' own
+        specials.
+
+        The search goes through the promotions in turn, trying every
+        allocation of the units that remain to each, and remembers the
+        cheapest cost of the rest of the promotions for each remaining
+        count of the items they can take, so a state reached again is not
+        searched again.  An item no later promotion takes is priced by its
+        own special as soon as it is passed, and the promotions are taken
+        in the order that keeps the counts remembered fewest.  If the
+        search takes longer than time_budget seconds, promotions are
+        instead given units greedily, the one with the largest discount
+        first, and the result reports how far it may be from the best.
+
+        The discount of each promotion is what its units would cost under
+        their own specials less what they cost in its deals, so the
+        discounts add up to the assignment's savings.
+    """
+
+    def __init__(self, time_budget: float = 0.05) -> None:
+        self.time_budget = time_budget
+
+    def solve(self, lines: Dict[str, Line],
+              promotions: Sequence[Promotion]) -> Assignment:
+        "the best assignment found for the lines"
+        own: Dict[Tuple[str, int], Money] = {}
+
+        def own_cost(item: str, count: int) -> Money:
+            cost = own.get((item, count))
+            if cost is None:
+                cost = own[item, count] = lines[item].cost(count)
+            return cost
+
+        full = sum((own_cost(item, line.count)
+                    for item, line in lines.items()), Money(0))
+        try:
+            units = self._search(lines, promotions, own_cost)
+            optimal = True
+        except _OutOfTime:
+            units = self._greedy(lines, promotions, own_cost)
+            optimal = False
+        discounts: Dict[Promotion, Money] = {}
+        cost = Money(0)
+        left = {item: line.count for item, line in lines.items()}
+        for promotion, taken in units.items():
+            deal = self._deal_cost(lines, promotion, taken)
+            cost += deal
+            # a promotion saves what its units would cost under their own
+            # specials, taken from what is left in turn, less the deal, so
+            # the discounts add up to the savings
+            saved = -deal
+            for item, num in taken.items():
+                saved += (own_cost(item, left[item]) -
+                          own_cost(item, left[item] - num))
+                left[item] -= num
+            discounts[promotion] = saved
+        cost += sum((own_cost(item, num) for item, num in left.items()),
+                    Money(0))
+        gap = Money(0)
+        if not optimal:
+            # no unit costs less in a deal than its regular price less the
+            # discount the promotion would give with every unit
+            regular = {item: (line.price, line.count)
+                       for item, line in lines.items()}
+            best = full - sum((promotion.discount(regular)
+                               for promotion in promotions), Money(0))
+            gap = max(cost - best, Money(0))
+        return Assignment(cost, full - cost,
+                          {promotion: taken for promotion, taken in
+                           units.items() if taken},
+                          {promotion: discount for promotion, discount in
+                           discounts.items() if discount},
+                          optimal, gap)
+
+    @staticmethod
+    def _deal_cost(lines: Dict[str, Line], promotion: Promotion,
+                   taken: Dict[str, int]) -> Money:
+        "the cost of units given to a promotion"
+        return (sum((lines[item].price * num for item, num in taken.items()),
+                    Money(0)) -
+                promotion.discount({item: (lines[item].price, num)
+                                    for item, num in taken.items()}))
+
+    def _search(self, lines: Dict[str, Line],
+                promotions: Sequence[Promotion],
+                own_cost: Callable[[str, int], Money]
+                ) -> Dict[Promotion, Dict[str, int]]:
+        "the best allocation, raises _OutOfTime if the budget runs out"
+        items = sorted(lines)
+        position = {item: num for num, item in enumerate(items)}
+        promotions = self._ordered(promotions,
+                                   {item: line.count
+                                    for item, line in lines.items()})
+        # the items each promotion from a number on can still take, and
+        # those no promotion after a number takes, whose count left is
+        # priced by their own specials once that promotion is passed
+        live: List[Tuple[int, ...]] = [()]
+        for promotion in reversed(promotions):
+            live.append(tuple(sorted(
+                set(live[-1]) | {position[item] for item in promotion.items
+                                 if item in position})))
+        live.reverse()
+        done = [tuple(sorted(set(live[index]) - set(live[index + 1])))
+                for index in range(len(promotions))]
+        deadline = time.perf_counter() + self.time_budget
+        # (promotion number, count left of each item it or a later one can
+        # take) -> (cheapest cost of those promotions and items, units
+        # given to that one)
+        memo: Dict[Tuple[int, Tuple[int, ...]],
+                   Tuple[Money, Optional[Dict[str, int]]]] = {}
+
+        def best(index: int, left: Tuple[int, ...]) -> Money:
+            key = (index, tuple(left[num] for num in live[index]))
+            known = memo.get(key)
+            if known is not None:
+                return known[0]
+            if time.perf_counter() > deadline:
+                raise _OutOfTime
+            if index == len(promotions):
+                memo[key] = (Money(0), None)
+                return Money(0)
+            promotion = promotions[index]
+
+            def rest_cost(rest: Tuple[int, ...]) -> Money:
+                return (sum((own_cost(items[num], rest[num])
+                             for num in done[index]), Money(0)) +
+                        best(index + 1, rest))
+
+            cost, choice = rest_cost(left), None
+            available = {item: (lines[item].price, left[position[item]])
+                         for item in promotion.items if item in position}
+            for taken in promotion.allocations(available):
+                rest = list(left)
+                for item, num in taken.items():
+                    rest[position[item]] -= num
+                option = (self._deal_cost(lines, promotion, taken) +
+                          rest_cost(tuple(rest)))
+                if option < cost:
+                    cost, choice = option, taken
+            memo[key] = (cost, choice)
+            return cost
+
+        left = tuple(lines[item].count for item in items)
+        best(0, left)
+        units: Dict[Promotion, Dict[str, int]] = {}
+        for index, promotion in enumerate(promotions):
+            taken = memo[index, tuple(left[num] for num in live[index])][1]
+            if taken:
+                units[promotion] = taken
+                rest = list(left)
+                for item, num in taken.items():
+                    rest[position[item]] -= num
+                left = tuple(rest)
+        return units
+
+    @staticmethod
+    def _ordered(promotions: Sequence[Promotion],
+                 counts: Dict[str, int]) -> List[Promotion]:
+        """ The promotions in the order to search them.  Each one next is
+            the one after which the fewest counts are possible of the items
+            that both it or an earlier one and a later one can take, since
+            those counts are the states the search remembers.
+        """
+        left = sorted(promotions, key=lambda promotion: promotion.name)
+        taken: Set[str] = set()
+        order: List[Promotion] = []
+
+        def states(promotion: Promotion) -> int:
+            later = {item for other in left if other is not promotion
+                     for item in other.items}
+            number = 1
+            for item in (taken | promotion.items) & later:
+                number *= counts.get(item, 0) + 1
+            return number
+
+        while left:
+            promotion = min(left, key=states)
+            left.remove(promotion)
+            order.append(promotion)
+            taken.update(promotion.items)
+        return order
+
+    def _greedy(self, lines: Dict[str, Line],
+                promotions: Sequence[Promotion],
+                own_cost: Callable[[str, int], Money]
+                ) -> Dict[Promotion, Dict[str, int]]:
+        """ Give each promotion, largest discount first, the units it would
+            use of those left if that is cheaper than their own specials.
+        """
+        left = {item: line.count for item, line in lines.items()}
+
+        def available() -> Units:
+            return {item: (lines[item].price, num)
+                    for item, num in left.items()}
+
+        units: Dict[Promotion, Dict[str, int]] = {}
+        for promotion in sorted(promotions, reverse=True,
+                                key=lambda promotion:
+                                promotion.discount(available())):
+            taken = promotion.take(available())
+            saved = sum((own_cost(item, left[item]) -
+                         own_cost(item, left[item] - num)
+                         for item, num in taken.items()), Money(0))
+            if taken and saved > self._deal_cost(lines, promotion, taken):
+                units[promotion] = taken
+                for item, num in taken.items():
+                    left[item] -= num
+        return units
+
+
+class PromotionReceipt(Receipt):
+    """ A Receipt that also applies promotions across items.  It keeps the
+        count of each promoted item by code and the discount of each
+        promotion as of the last total.  Scans and removals note the
+        promoted items they change and a total re-evaluates only the
+        promotions those items take part in.
+
+        Without a solver promotions are worked out from what is charged
+        for each unit after the item's own special, and each unit counts
+        toward at most one promotion: the promotions that share items on
+        the receipt take their units in turn, the largest discount first.
+        With a solver a unit is either priced by its own special or given
+        to one promotion, and the solver picks the cheapest assignment for
+        each group of promotions that share items on the receipt.
+    """
+
+    def __init__(self, pos: POS, promotions: PromotionIndex,
+                 solver: AssignmentSolver = None) -> None:
+        super().__init__(pos)
+        self.promotions = promotions
+        self.solver = solver
+        # count of each promoted item on the receipt
+        self._item_qty: Dict[str, int] = {}
+        # promoted items changed since the last evaluation
+        self._changed: Set[str] = set()
+        # discount of each promotion that applies
+        self._discounts: Dict[Promotion, Money] = {}
+        # promotions whose discount may have changed since changed_discounts()
+        self._revised: Set[Promotion] = set()
+        self._discount_total = Money(0)
+        # with a solver, the group of promotions each promotion was solved
+        # in and the assignment of each group
+        self._group_of: Dict[Promotion, FrozenSet[Promotion]] = {}
+        self._groups: Dict[FrozenSet[Promotion], Assignment] = {}
+        # items changed whose change is published once the counts of the
+        # promoted items are up to date
+        self._unpublished: List[str] = []
+
+    def _publish(self, items: List[str]) -> None:
+        self._unpublished.extend(items)
+
+    def _published(self) -> None:
+        "publish the items changed, now the promotions can be evaluated"
+        if self._unpublished:
+            items = self._unpublished
+            self._unpublished = []
+            super()._publish(items)
+
+    def _count(self, item_desc: str, change: SaleQuantity) -> None:
+        "adjust the count of an item if it is promoted"
+        if item_desc not in self.promotions:
+            return
+        qty = max(self._item_qty.get(item_desc, 0) + change, 0)
+        if qty:
+            self._item_qty[item_desc] = qty
+        else:
+            self._item_qty.pop(item_desc, None)
+        self._changed.add(item_desc)
+
+    def add_scan(self, item_desc: str, qty: SaleQuantity) -> None:
+        super().add_scan(item_desc, qty)
+        if isinstance(qty, int):  # only items sold by count take part
+            self._count(item_desc, qty)
+        self._published()
+
+    def add_scans(self, scans: Iterable[Union[Scan,
+                                              Tuple[str, SaleQuantity]]]
+                  ) -> None:
+        scans = list(scans)
+        super().add_scans(scans)
+        for scan in scans:
+            item_desc, qtys = ((scan.item_desc, scan.qty)
+                               if isinstance(scan, Scan)
+                               else (scan[0], [scan[1]]))
+            for qty in qtys:
+                if isinstance(qty, int):
+                    self._count(item_desc, qty)
+        self._published()
+
+    def _voided(self, item_desc: str, num_voids: int) -> None:
+        "count the items of a void if one was made"
+        if len(self.purchases.voids) > num_voids:
+            void = self.purchases.voids[-1]
+            if self._stock[item_desc].how_sold == SaleType.EACH:
+                self._count(item_desc, -(sum(void.scans) + void.partial))
+
+    def remove_last(self, item_desc: str) -> None:
+        num_voids = len(self.purchases.voids)
+        super().remove_last(item_desc)
+        self._voided(item_desc, num_voids)
+        self._published()
+
+    def remove(self, item_desc: str, num2remove: SaleQuantity) -> None:
+        num_voids = len(self.purchases.voids)
+        super().remove(item_desc, num2remove)
+        self._voided(item_desc, num_voids)
+        self._published()
+
+    def restore_void(self) -> Optional[StockType]:
+        void = self.purchases.voids[-1] if self.purchases.voids else None
+        stock_type = super().restore_void()
+        if stock_type is not None:
+            if stock_type.how_sold == SaleType.EACH:
+                self._count(void.item_desc, sum(void.scans) + void.partial)
+            self._published()
+        return stock_type
+
+    def _units(self, items: Iterable[str]) -> Units:
+        "what is charged per unit and the count of each of the items"
+        units: Units = {}
+        for item in items:
+            qty = self._qty.get(item)
+            if qty:
+                units[item] = (self.subtotal(item) / qty,
+                               self._item_qty[item])
+        return units
+
+    def _on_receipt(self, promotion: Promotion) -> List[str]:
+        "the items of a promotion that are on the receipt"
+        if len(promotion.items) < len(self._item_qty):
+            return [item for item in promotion.items
+                    if item in self._item_qty]
+        return [item for item in self._item_qty if item in promotion.items]
+
+    def _evaluate(self) -> None:
+        "re-evaluate the promotions of the items changed since last time"
+        touched: Set[Promotion] = set()
+        for item in self._changed:
+            touched.update(self.promotions[item])
+        self._changed.clear()
+        if self.solver is not None:
+            self._solve(touched)
+            return
+        for group in self._grouped(touched):
+            self._allocate(group)
+
+    def _allocate(self, group: List[Promotion]) -> None:
+        """ Work out the discounts of a group of promotions that share
+            items, giving each unit to at most one of them.  The promotion
+            with the largest discount takes its units first and the others
+            work from what it leaves, as AssignmentSolver does when its
+            time runs out.
+        """
+        left = self._units({item for promotion in group
+                            for item in self._on_receipt(promotion)})
+
+        def available(promotion: Promotion) -> Units:
+            return {item: (price, count)
+                    for item, (price, count) in left.items()
+                    if count and item in promotion.items}
+
+        if len(group) > 1:
+            group = sorted(group, reverse=True,
+                           key=lambda promotion: (
+                               promotion.discount(available(promotion)),
+                               promotion.name))
+        for promotion in group:
+            units = available(promotion)
+            new = promotion.discount(units) if units else Money(0)
+            if new and len(group) > 1:
+                for item, num in promotion.take(units).items():
+                    price, count = left[item]
+                    left[item] = (price, count - num)
+            old = self._discounts.pop(promotion, Money(0))
+            if new:
+                self._discounts[promotion] = new
+            if new != old:
+                self._revised.add(promotion)
+            self._discount_total += new - old
+
+    def _line(self, item_desc: str) -> Line:
+        "an item on the receipt as the solver sees it"
+        stock_type = self._stock[item_desc]
+        count = self._item_qty[item_desc]
+        regular = (FixedStandard() if self.pos.fixed_point
+                   else StockType.standard)
+
+        def cost(num: int) -> Money:
+            return (self._money(stock_type.pricing(stock_type, num)) if num
+                    else Money('0.00'))
+
+        return Line(self._money(regular(stock_type, 1)), count, cost)
+
+    def _grouped(self, touched: Set[Promotion]) -> Iterator[List[Promotion]]:
+        "the touched promotions and those sharing items on the receipt"
+        seen: Set[Promotion] = set()
+        for start in touched:
+            if start in seen:
+                continue
+            seen.add(start)
+            group: List[Promotion] = []
+            todo = [start]
+            while todo:
+                promotion = todo.pop()
+                group.append(promotion)
+                for item in self._on_receipt(promotion):
+                    for other in self.promotions[item]:
+                        if other not in seen:
+                            seen.add(other)
+                            todo.append(other)
+            yield group
+
+    def _solve(self, touched: Set[Promotion]) -> None:
+        "solve again every group with a touched promotion in it"
+        # groups may have split or joined, so drop all the old ones
+        for promotion in list(touched):
+            touched.update(self._group_of.get(promotion, ()))
+        for promotion in touched:
+            members = self._group_of.pop(promotion, None)
+            assignment = self._groups.pop(members, None)
+            if assignment is not None:
+                self._discount_total -= assignment.savings
+            self._discounts.pop(promotion, None)
+        self._revised.update(touched)
+        for group in self._grouped(touched):
+            members = frozenset(group)
+            self._revised.update(group)
+            for promotion in group:
+                self._group_of[promotion] = members
+            lines = {item: self._line(item) for promotion in group
+                     for item in self._on_receipt(promotion)}
+            if lines:
+                assignment = self.solver.solve(lines, group)
+                self._groups[members] = assignment
+                self._discount_total += assignment.savings
+                self._discounts.update(assignment.discounts)
+
+    def assignments(self) -> List[Assignment]:
+        "with a solver, the assignment of each group of promotions"
+        self._evaluate()
+        return list(self._groups.values())
+
+    def discounts(self) -> Dict[str, Money]:
+        "the discount of each promotion that applies, by promotion name"
+        self._evaluate()
+        return {promotion.name: discount
+                for promotion, discount in self._discounts.items()}
+
+    def changed_discounts(self) -> Dict[str, Optional[Money]]:
+        """ The promotions whose discount may have changed since the last
+            call, by name, with their discount now or None if they no
+            longer apply.  Used to publish changes without comparing every
+            promotion.
+        """
+        self._evaluate()
+        revised, self._revised = self._revised, set()
+        return {promotion.name: self._discounts.get(promotion)
+                for promotion in revised}
+
+    def total(self) -> Money:
+        "total up the order less the promotion discounts"
+        items_total = super().total()
+        self._evaluate()
+        return max(items_total - self._discount_total, Money('0.00'))
@@ -3,12 +3,14 @@
 
     Requires Python 3.7 to run
 """
-from collections import defaultdict
-from typing import Callable, Union, List, Dict, Any, NamedTuple, Type, Tuple
+from typing import (Callable, Union, List, Dict, Any, NamedTuple, Type,
+                    Tuple, Set, Mapping, Iterator, Optional, Iterable)
+from collections import OrderedDict
+from threading import Lock
 from enum import Enum
 from dataclasses import dataclass, field
+from decimal import Decimal, Context, MAX_PREC, ROUND_UP
 from functools import partial
-from decimal import Decimal, ROUND_UP
 
 class SaleType(Enum):
     """ Ways to measure how much product is sold """
@@ -19,6 +21,300 @@ class SaleType(Enum):
 SaleQuantity = Union[int, float]
 Sales = List[SaleQuantity]
 Money = Decimal
+Millicents = int  # fixed-point amount in thousandths of a cent
+
+CENT = Decimal('.01')  # precision of amounts owed
+# sums of unrounded amounts owed are kept exact, however many digits the
+# floats they came from have
+EXACT = Context(prec=MAX_PREC)
+
+# Fixed-point pricing holds prices and discounts as integer cents, weights
+# as integer thousandths of a unit and amounts owed as integer thousandths
+# of a cent so that a cent price times a weight is exact.
+MILLI = 1000
+MILLICENTS_PER_DOLLAR = 100 * MILLI
+
+
+def to_cents(amount: float) -> int:
+    """ Convert a dollar amount to integer cents.  Raises
+        NotImplementedError if the amount is not a whole number of cents.
+    """
+    cents = Decimal(repr(amount)) * 100
+    if cents != cents.to_integral_value():
+        raise NotImplementedError(f"Fixed-point prices must be a whole "
+            f"number of cents, got {amount}")
+    return int(cents)
+
+
+def to_money(amount: Millicents) -> Money:
+    "convert a fixed-point amount to Money, rounding half even to the cent"
+    return (Money(amount) / MILLICENTS_PER_DOLLAR).quantize(CENT)
+
+
+def _round_up_cent(amount: Millicents) -> Millicents:
+    "round a fixed-point amount up to a whole cent, as ROUND_UP does"
+    return -(-amount // MILLI) * MILLI
+
+
+def _round_cent(amount: int, divisor: int = 1) -> Millicents:
+    """ Round the fixed-point amount amount/divisor to a whole cent, half
+        to even, as quantize does by default.
+    """
+    whole = divisor * MILLI
+    cents, rest = divmod(amount, whole)
+    if 2 * rest > whole or (2 * rest == whole and cents % 2):
+        cents += 1
+    return cents * MILLI
+
+
+def _fixed_units(stock: 'StockType') -> Tuple[int, int]:
+    """ Return the number of fixed-point quantity units in one unit sold
+        and the multiplier that turns cents times quantity units into
+        Millicents.
+    """
+    if stock.how_sold == SaleType.BY_WT:
+        return (MILLI, 1)
+    return (1, MILLI)
+
+class PricingRule:
+    """ Base of the ways of calculating a price.  A rule is called with the
+        StockType being priced and a quantity, in the same way as a
+        StockType's pricing function, and returns the price for that
+        quantity of the item.
+
+        A rule holds only the parameters of a special, and the parameters
+        may not be changed once it is made.  Rules with the same parameters
+        compare equal and hash alike, and pickle as just their parameters.
+        The hash is worked out once, when the rule is made, since rules
+        are hashed on every lookup in a PriceCache.
+    """
+    __slots__ = ('_hash',)
+    _fields: Tuple[str, ...] = ()  # names of the parameters, in order
+    fixed_point = False  # True for rules that work in integer cents
+    cached = True  # False for rules quicker to work out than to look up
+
+    def __init__(self, *params: Any) -> None:
+        for name, value in zip(self._fields, params):
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, '_hash',
+                           hash((type(self).__name__, self.params())))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} cannot be changed")
+
+    def params(self) -> Tuple:
+        "the parameters of the rule, in the order they are passed to init"
+        return tuple(getattr(self, name) for name in self._fields)
+
+    def __eq__(self, other: Any) -> bool:
+        return (type(self) is type(other) and
+                self.params() == other.params())
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __reduce__(self):
+        return (type(self), self.params())
+
+    def __repr__(self) -> str:
+        return (f"{type(self).__name__}(" +
+                ", ".join(f"{name}={getattr(self, name)!r}"
+                          for name in self._fields) + ")")
+
+    def __call__(self, stock: 'StockType', qty: SaleQuantity) -> Money:
+        raise NotImplementedError
+
+    def split(self, stock: 'StockType',
+              qty: SaleQuantity) -> Tuple[SaleQuantity, SaleQuantity]:
+        """ Return how much of qty is sold at the discount and how much at
+            full price, in the units the rule is called with.
+        """
+        return (0, qty)
+
+    def fixed(self) -> 'PricingRule':
+        "the fixed-point version of this rule"
+        raise NotImplementedError
+
+
+class Standard(PricingRule):
+    """ A standard, non-special price.  As StockType.standard it is also a
+        method of a StockType, so stock.standard(qty) prices a quantity of
+        that item.
+    """
+    __slots__ = ()
+
+    def __get__(self, stock: Optional['StockType'],
+                owner: type = None) -> Callable:
+        if stock is None:
+            return self
+        return partial(self, stock)
+
+    def __call__(self, stock: 'StockType', qty: SaleQuantity) -> Money:
+        """ Calculate a standard, non-special price """
+        return (Money(stock.price * qty).quantize(CENT,
+                                                  rounding=ROUND_UP))
+
+    def fixed(self) -> PricingRule:
+        return FixedStandard()
+
+
+class CentsOff(PricingRule):
+    "A per-item price-off reduction, optionally limited to a number of items"
+    __slots__ = _fields = ('amount_off', 'limit')
+
+    def __init__(self, amount_off: float, limit: int = None) -> None:
+        # ask customer if they want this common sense constraint. Not in the
+        # Use Cases but calculations may not be valid with a negative reduction.
+        if amount_off <= 0.0:
+            raise NotImplementedError(f"Cannot have discount of zero or less")
+        super().__init__(amount_off, limit)
+
+    def split(self, stock: 'StockType',
+              qty: SaleQuantity) -> Tuple[SaleQuantity, SaleQuantity]:
+        return stock.handle_limit(self.limit, qty, 0)
+
+    def __call__(self, stock: 'StockType', qty: SaleQuantity) -> Money:
+        (disc, full) = self.split(stock, qty)
+        if self.amount_off <= stock.price:
+            return ((Money((stock.price - self.amount_off) * disc)) +
+                    (Money(stock.price * full)).
+                          quantize(CENT))
+        else:
+            return (Money(stock.price * full).
+                          quantize(CENT))
+
+    def fixed(self) -> PricingRule:
+        return FixedCentsOff(to_cents(self.amount_off), self.limit)
+
+
+class ConditionalPercentOff(PricingRule):
+    """ 'Buy N items get M at %X off' specials, optionally limited to a
+        number of items
+    """
+    __slots__ = _fields = ('min_items', 'disc_items', 'pct_off', 'limit')
+
+    def __init__(self, min_items: int, disc_items: int, pct_off: float,
+                 limit: int = None) -> None:
+        # ask customer if they want these common sense constraints. Not in the
+        # Use Cases but calculations may not be valid outside these ranges.
+        if pct_off <= 0 or pct_off > 100:
+            raise NotImplementedError(f"Cannot have a discount percentage "
+                f"that is 0% or less or more than 100%, got {pct_off}")
+        if min_items < 1:
+            raise NotImplementedError(f"Cannot have a discount where one "
+                f"must buy less than one item, got {min_items}")
+        if disc_items < 1:
+            raise NotImplementedError(f"Cannot have a discount where the "
+                f"number of items discounted is less than one, "
+                f"got {disc_items}")
+        if limit and limit < (min_items + disc_items):
+            raise NotImplementedError(f"Cannot have a purchase limit where the "
+                "number of items needed to be purchased is less than the "
+                "purchase limit.  (e.g. 'buy 3 get 1 half off, limit 1' is "
+                "wrong, it should be limit 4 to limit to one discounted item. "
+                f"Got limit={limit}, full price count={min_items}, discounted "
+                f"count={disc_items}")
+        super().__init__(min_items, disc_items, pct_off, limit)
+
+    def split(self, stock: 'StockType',
+              qty: SaleQuantity) -> Tuple[SaleQuantity, SaleQuantity]:
+        # max number of items in a dsct group
+        grp = self.min_items + self.disc_items
+        disc_qty = (((qty//grp) * self.disc_items) +
+                    max((qty % grp) - self.min_items, 0))
+        full_qty = qty - disc_qty
+        # calculate max number of discounted items (pythonic ternary)
+        disc_limit = self.limit and self.limit // grp
+        # adjust discounted count when there is a limit
+        return stock.handle_limit(disc_limit, disc_qty, full_qty)
+
+    def __call__(self, stock: 'StockType', qty: SaleQuantity) -> Money:
+        disc_qty, full_qty = self.split(stock, qty)
+        return (Money(stock.price * full_qty).  # items with no discount
+                      quantize(CENT) +
+                # plus items that are discounted
+                Money((stock.price * (1.0 - self.pct_off/100.0)) * disc_qty).
+                      quantize(CENT))
+
+    def fixed(self) -> PricingRule:
+        return FixedConditionalPercentOff(self.min_items, self.disc_items,
+                                          self.pct_off, self.limit)
+
+
+class FixedStandard(Standard):
+    """ A standard price in fixed point.  The price is in cents, the
+        quantity in units of how_sold (thousandths for weights) and the
+        amount owed, in Millicents, is rounded up to a whole cent.
+    """
+    __slots__ = ()
+    fixed_point = True
+    cached = False
+
+    def __call__(self, stock: 'StockType', qty: int) -> Millicents:
+        return _round_up_cent(stock.price * qty * _fixed_units(stock)[1])
+
+    def fixed(self) -> PricingRule:
+        return self
+
+
+class FixedCentsOff(CentsOff):
+    """ A per-item price-off reduction in fixed point.  The amount off is
+        in cents.  The full price items are rounded half even to a whole
+        cent and the discounted items are left exact.
+    """
+    __slots__ = ()
+    fixed_point = True
+
+    def split(self, stock: 'StockType', qty: int) -> Tuple[int, int]:
+        unit = _fixed_units(stock)[0]
+        return stock.handle_limit(self.limit and self.limit * unit, qty, 0)
+
+    def __call__(self, stock: 'StockType', qty: int) -> Millicents:
+        scale = _fixed_units(stock)[1]
+        (disc, full) = self.split(stock, qty)
+        full_amount = _round_cent(stock.price * full * scale)
+        if self.amount_off <= stock.price:
+            return (stock.price - self.amount_off) * disc * scale + full_amount
+        return full_amount
+
+    def fixed(self) -> PricingRule:
+        return self
+
+
+class FixedConditionalPercentOff(ConditionalPercentOff):
+    """ 'Buy N items get M at %X off' specials in fixed point.  The
+        percentage must be a whole number.  The full price and the
+        discounted items are each rounded half even to a whole cent.
+    """
+    __slots__ = ()
+    fixed_point = True
+
+    def __init__(self, min_items: int, disc_items: int, pct_off: int,
+                 limit: int = None) -> None:
+        if pct_off != int(pct_off):
+            raise NotImplementedError(f"Fixed-point discount percentages "
+                f"must be a whole number, got {pct_off}")
+        super().__init__(min_items, disc_items, int(pct_off), limit)
+
+    def split(self, stock: 'StockType', qty: int) -> Tuple[int, int]:
+        unit = _fixed_units(stock)[0]
+        grp = self.min_items + self.disc_items
+        disc_qty = (((qty // (grp * unit)) * self.disc_items * unit) +
+                    max((qty % (grp * unit)) - self.min_items * unit, 0))
+        full_qty = qty - disc_qty
+        disc_limit = self.limit and (self.limit // grp) * unit
+        return stock.handle_limit(disc_limit, disc_qty, full_qty)
+
+    def __call__(self, stock: 'StockType', qty: int) -> Millicents:
+        scale = _fixed_units(stock)[1]
+        disc_qty, full_qty = self.split(stock, qty)
+        return (_round_cent(stock.price * full_qty * scale) +
+                _round_cent(stock.price * (100 - self.pct_off) *
+                            disc_qty * scale, 100))
+
+    def fixed(self) -> PricingRule:
+        return self
+
 
 class StockType(NamedTuple):
     "Information about a stocked item"
@@ -38,8 +334,8 @@ class StockType(NamedTuple):
             raise NotImplementedError("Quantity sold must be a real "
                 "when the item is sold by weight.")
 
-    def handle_limit(self,
-                     disc_limit: int, # max number of products to be discounted
+    @staticmethod
+    def handle_limit(disc_limit: int, # max number of products to be discounted
                      cur_disc: int,  # number currently discounted
                      cur_full: int  # number currently full price
                     ) -> Tuple[int,int]:
@@ -68,39 +364,40 @@ class StockType(NamedTuple):
         return (disc, full)
 
 
+    def to_fixed_point(self) -> 'StockType':
+        """ Return this item with its price in integer cents and its
+            pricing rule replaced by the fixed-point version.  Items that
+            are already fixed point are returned unchanged.  Raises
+            NotImplementedError if the price or a discount is not a whole
+            number of cents or the pricing is not a PricingRule.
+        """
+        if getattr(self.pricing, 'fixed_point', False):
+            return self
+        if not isinstance(self.pricing, PricingRule):
+            raise NotImplementedError(f"Only PricingRule pricing can be "
+                f"converted to fixed point, got {self.pricing!r}")
+        return StockType(to_cents(self.price), self.how_sold,
+                         self.pricing.fixed())
+
+    def to_fixed_qty(self, qty: SaleQuantity) -> int:
+        "convert a quantity sold to fixed-point quantity units"
+        if self.how_sold == SaleType.BY_WT:
+            return int(round(qty * MILLI))
+        return qty
+
     ###############################
     # ways of calculating a price #
     ###############################
-    def standard(self, qty: SaleQuantity) -> Money:
-        """ Calculate a standard, non-special price """
-        return (Money(self.price * qty).quantize(Decimal('.01'),
-                                                 rounding=ROUND_UP))
+    standard = Standard()
 
     @classmethod
     def cents_off(cls: Type['StockType'], amount_off: float,
                   limit:int=None) -> \
                   Callable[[Any, SaleQuantity], Money]:
-        """ Returns a function that takes a quantity and returns the
+        """ Returns a pricing rule that takes a quantity and returns the
             price with a per-item price-off reduction.
         """
-        def cents_off_calc(self, qty: int, discount: Money, limit:int):
-            "inline function that actually does the calculation"
-            (disc, full) = self.handle_limit(limit, qty, 0)
-            if discount <= self.price:
-                return ((Money((self.price - discount) * disc)) +
-                        (Money(self.price * full)).
-                              quantize(Decimal('.01')))
-            else:
-                return (Money(self.price * full).
-                              quantize(Decimal('.01')))
-
-        # ask customer if they want this common sense constraint. Not in the
-        # Use Cases but calculations may not be valid with a negative reduction.
-        if amount_off <= 0.0:
-            raise NotImplementedError(f"Cannot have discount of zero or less")
-
-        # return function with items set in store's stock definition bound
-        return partial(cents_off_calc, discount=amount_off, limit=limit)
+        return CentsOff(amount_off, limit)
 
 
     @classmethod
@@ -108,51 +405,10 @@ class StockType(NamedTuple):
                                 disc_items: int, pct_off: float,
                                 limit: int=None) -> \
                                 Callable[[Any, SaleQuantity], Money]:
-        """ Returns a function that implements 'Buy N items get M at %X off'
-            pricing specials.
-        """
-        def conditional_percent_off_calc(self, qty: int, min_items: int,
-                                         disc_items: int, pct_off: int,
-                                         limit: int):
-            "inline function that actually does the calculation"
-            grp = min_items + disc_items # max number of items in a dsct group
-            disc_qty = (((qty//grp) * disc_items) +
-                        max((qty % grp) - min_items, 0))
-            full_qty = qty - disc_qty
-            # calculate max number of discounted items (pythonic ternary)
-            disc_limit = limit and limit // grp
-            # adjust discounted count when there is a limit
-            disc_qty, full_qty = self.handle_limit(disc_limit,
-                                                   disc_qty, full_qty)
-
-            return (Money(self.price * full_qty).  # items with no discount
-                          quantize(Decimal('.01')) +
-                    # plus items that are discounted
-                    Money((self.price * (1.0 - pct_off/100.0)) * disc_qty).
-                          quantize(Decimal('.01')))
-
-        # ask customer if they want these common sense constraints. Not in the
-        # Use Cases but calculations may not be valid outside these ranges.
-        if pct_off <= 0 or pct_off > 100:
-            raise NotImplementedError(f"Cannot have a discount percentage "
-                "that is 0% or less or more than 100%, got {pct_off}")
-        if min_items < 1:
-            raise NotImplementedError(f"Cannot have a discount where one "
-                "must buy less than one item, got {min_items}")
-        if disc_items < 1:
-            raise NotImplementedError(f"Cannot have a discount where the "
-                "number of items discounted is less than one, got {min_items}")
-        if limit and limit < (min_items + disc_items):
-            raise NotImplementedError(f"Cannot have a purchase limit where the "
-                "number of items needed to be purchased is less than the "
-                "purchase limit.  (e.g. 'buy 3 get 1 half off, limit 1' is "
-                "wrong, it should be limit 4 to limit to one discounted item. "
-                "Got limit={limit}, full price count={min_items}, discounted "
-                "count={disc_items}")
-
-        # return function with items set in store's stock definition bound
-        return partial(conditional_percent_off_calc, min_items=min_items,
-                       disc_items=disc_items, pct_off=pct_off, limit=limit)
+        """ Returns a pricing rule that implements 'Buy N items get M at %X
+            off' pricing specials.
+        """
+        return ConditionalPercentOff(min_items, disc_items, pct_off, limit)
 
 
 @dataclass
@@ -165,36 +421,412 @@ class Scan:
                     # sold by weight
 
 
+class ScansRejected(KeyError, NotImplementedError):
+    """ Raised by Receipt.add_scans when scans in a batch are rejected.
+        It is both a KeyError and a NotImplementedError so that code
+        written for add_scan catches it.  errors lists every rejected scan
+        as (position in the batch, the KeyError or NotImplementedError).
+    """
+    def __init__(self, errors: List[Tuple[int, Exception]]) -> None:
+        super().__init__(errors)
+        self.errors = errors
+
+    def __str__(self) -> str:
+        return "; ".join(f"scan {position}: {err!r}"
+                         for position, err in self.errors)
+
+
+_MISSING = object()  # marks an item a snapshot's changes do not mention
+
+
+class CatalogSnapshot(Mapping):
+    """ One immutable version of a POS's catalog, a mapping of item code to
+        StockType.  Every version shares the catalog the POS was created
+        with (the base) and holds the changes made since then in shards, a
+        tuple of small dictionaries indexed by the hash of the item code.
+        An item changed to None has been removed.
+
+        updated() makes the next version.  It copies the tuple of shards and
+        only the shards that the changes touch, so unchanged items are not
+        copied and the new version shares every other shard with the old
+        one.  A version that nothing references any more is reclaimed like
+        any other object.
+    """
+    __slots__ = ('base', 'version', '_shards', '_len', '__weakref__')
+    SHARDS = 64  # number of shards of changes
+
+    def __init__(self, base: Mapping[str, StockType], version: int = 0,
+                 shards: Tuple[Dict[str, Optional[StockType]], ...] = (),
+                 length: int = None) -> None:
+        self.base = base
+        self.version = version
+        self._shards = shards
+        self._len = len(base) if length is None else length
+
+    def __reduce__(self):
+        # shards are placed by hash, which differs between processes
+        return (_rebuild_snapshot, (self.base, self.version,
+                                    self.changes()))
+
+    def __getitem__(self, item: str) -> StockType:
+        if self._shards:
+            stock = self._shards[hash(item) % self.SHARDS].get(item,
+                                                               _MISSING)
+            if stock is None:
+                raise KeyError(item)
+            if stock is not _MISSING:
+                return stock
+        return self.base[item]
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[str]:
+        changes = self.changes()
+        for item in self.base:
+            if changes.get(item, _MISSING) is not None:
+                yield item
+        for item, stock in changes.items():
+            if stock is not None and item not in self.base:
+                yield item
+
+    def changes(self) -> Dict[str, Optional[StockType]]:
+        "every change made to the base, None for removed items"
+        changes: Dict[str, Optional[StockType]] = {}
+        for shard in self._shards:
+            changes.update(shard)
+        return changes
+
+    def updated(self, changes: Mapping[str, Optional[StockType]]
+                ) -> 'CatalogSnapshot':
+        """ Return the next version with the changes applied.  A change to
+            None removes the item.
+        """
+        shards = list(self._shards) or [{} for _ in range(self.SHARDS)]
+        copied: Set[int] = set()
+        length = self._len
+        for item, stock in changes.items():
+            length += (stock is not None) - (item in self)
+            num = hash(item) % self.SHARDS
+            if num not in copied:
+                shards[num] = dict(shards[num])
+                copied.add(num)
+            if stock is None and item not in self.base:
+                shards[num].pop(item, None)
+            else:
+                shards[num][item] = stock
+        return CatalogSnapshot(self.base, self.version + 1, tuple(shards),
+                               length)
+
+
+def _rebuild_snapshot(base: Mapping[str, StockType], version: int,
+                      changes: Dict[str, Optional[StockType]]
+                      ) -> CatalogSnapshot:
+    snapshot = CatalogSnapshot(base).updated(changes)
+    snapshot.version = version
+    return snapshot
+
+
+class PriceCache:
+    """ The prices of recently priced quantities of items, shared by the
+        receipts of a POS.  Most lines on a receipt are 1, 2 or 3 of the
+        same few thousand items, so a receipt usually finds the price of
+        an item's quantity already worked out by another receipt.
+
+        Prices are keyed on the item's price and pricing rule, which holds
+        the rule's parameters and its hash, and the quantity.  When more
+        than max_size prices are held the least recently used is evicted.
+        Only items sold by count are cached since weights seldom repeat,
+        and not those whose rule is quicker to work out than to look up.
+    """
+
+    def __init__(self, max_size: int = 4096) -> None:
+        self.max_size = max_size
+        self.hits = 0  # prices found in the cache
+        self.misses = 0  # prices worked out and added
+        self.evictions = 0  # prices evicted to stay within max_size
+        # (price, pricing, quantity) -> price, least recently used first
+        self._prices: 'OrderedDict[Tuple[Any, Callable, int], Any]' = \
+            OrderedDict()
+        # quantities cached for each (price, pricing), so an item can be
+        # invalidated
+        self._qtys: Dict[Tuple[Any, Callable], Set[int]] = {}
+        self._lock = Lock()
+
+    def __reduce__(self):
+        # a copy sent to another process starts empty
+        return (type(self), (self.max_size,))
+
+    def __len__(self) -> int:
+        return len(self._prices)
+
+    def price(self, stock_type: StockType,
+              qty: SaleQuantity) -> Union[Money, Millicents]:
+        "the price of a quantity of an item, from the cache if it is there"
+        pricing = stock_type.pricing
+        if (stock_type.how_sold is not SaleType.EACH or
+                not getattr(pricing, 'cached', True)):
+            return pricing(stock_type, qty)
+        # the StockType itself is not the key: hashing it hashes how_sold,
+        # an Enum, in Python, which costs more than a hit saves
+        key = (stock_type.price, pricing, qty)
+        with self._lock:
+            price = self._prices.get(key)
+            if price is not None:
+                self._prices.move_to_end(key)
+                self.hits += 1
+                return price
+            # pricing is quick, so a miss is priced under the lock too
+            price = pricing(stock_type, qty)
+            self.misses += 1
+            self._prices[key] = price
+            self._qtys.setdefault(key[:2], set()).add(qty)
+            while len(self._prices) > self.max_size:
+                (old_price, old_pricing, old_qty), _ = \
+                    self._prices.popitem(last=False)
+                self._forget((old_price, old_pricing), old_qty)
+                self.evictions += 1
+        return price
+
+    def _forget(self, item: Tuple[Any, Callable], qty: int) -> None:
+        qtys = self._qtys[item]
+        qtys.discard(qty)
+        if not qtys:
+            del self._qtys[item]
+
+    def invalidate(self, stock_types: Iterable[StockType]) -> None:
+        "drop the prices of some items"
+        with self._lock:
+            for stock_type in stock_types:
+                item = (stock_type.price, stock_type.pricing)
+                for qty in self._qtys.pop(item, ()):
+                    del self._prices[item + (qty,)]
+
+    def clear(self) -> None:
+        "drop every price, the counters are kept"
+        with self._lock:
+            self._prices.clear()
+            self._qtys.clear()
+
+
 class POS:
     """ A class representing the outside environment that the receipt
         calculation runs within.  Creates the universe of items upon
         initialization.  Scans items and returns information about the
         item.
+
+        The catalog is published as immutable, versioned CatalogSnapshots.
+        update() makes a new version and swaps it in with one assignment,
+        so readers never need a lock and never see a partial update.
     """
 
     def __init__(self,
-                 stock_items: Dict[str, StockType]) -> None:
-        """ Initializes the database of items that are stocked. """
-        self.stock_items = stock_items
+                 stock_items: Mapping[str, StockType],
+                 fixed_point: bool = False,
+                 price_cache: PriceCache = None) -> None:
+        """ Initializes the database of items that are stocked.  When
+            fixed_point is set the items are converted to fixed-point
+            pricing and receipts total them in integer arithmetic.  A
+            mapping with a true fixed_point attribute is already fixed
+            point and is used as it is.  Receipts share the price_cache,
+            if one is given, and an update invalidates the prices of the
+            items it changes.
+        """
+        self.fixed_point = fixed_point
+        self.price_cache = price_cache
+        if fixed_point and not getattr(stock_items, 'fixed_point', False):
+            stock_items = {item: stock.to_fixed_point()
+                           for item, stock in stock_items.items()}
+        self._snapshot = CatalogSnapshot(stock_items)
+        # only writers take the lock
+        self._update_lock = Lock()
 
-    def scan(self, item: str) -> StockType:
-        """ Look up the item and return its StockType data.
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        del state['_update_lock']
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._update_lock = Lock()
+
+    @property
+    def stock_items(self) -> CatalogSnapshot:
+        "the current version of the catalog"
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        "the number of the current version of the catalog"
+        return self._snapshot.version
+
+    def snapshot(self) -> CatalogSnapshot:
+        "the current version of the catalog, which will never change"
+        return self._snapshot
+
+    def update(self, changes: Mapping[str, Optional[StockType]]
+               ) -> CatalogSnapshot:
+        """ Publish a new version of the catalog with the changes (new
+            or changed items, or None to remove an item) applied and return
+            it.  Receipts already open keep the version they opened with.
+        """
+        if self.fixed_point:
+            changes = {item: stock and stock.to_fixed_point()
+                       for item, stock in changes.items()}
+        with self._update_lock:
+            old = self._snapshot
+            self._snapshot = old.updated(changes)
+            if self.price_cache is not None:
+                self.price_cache.invalidate(old[item] for item in changes
+                                            if item in old)
+            return self._snapshot
+
+    def scan(self, item: str,
+             snapshot: CatalogSnapshot = None) -> StockType:
+        """ Look up the item and return its StockType data, in the given
+            version of the catalog or the current one.
             May throw a KeyError (dictionary look-up exception) if item
             is not in the stock_items dictionary.
         """
-        return self.stock_items[item]
+        if snapshot is None:
+            snapshot = self._snapshot
+        return snapshot[item]
+
+class Void(NamedTuple):
+    "Scans taken off a receipt, kept so that they can be put back"
+    item_desc: str  # code of the item the scans were for
+    scans: Sales  # whole scans removed, most recent scan first
+    partial: SaleQuantity  # amount taken from a scan that was left on
+
+
+class ScanLedger(dict):
+    """ The scans on a receipt.  A dictionary indexed by the item code with
+        the value being a list of item quantities, most recent scan last.
+        Items are dropped from the dictionary when their last scan is
+        removed.
+
+        Every removal is recorded in the voids list, most recent last, so
+        that it can be put back by restore() without scanning the items
+        again.
+    """
+    __slots__ = ('voids',)
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.voids: List[Void] = []
+
+    def add(self, item_desc: str, qty: SaleQuantity) -> None:
+        "add a scan of an item"
+        scans = self.get(item_desc)
+        if scans is None:
+            self[item_desc] = [qty]
+        else:
+            scans.append(qty)
+
+    def void_last(self, item_desc: str) -> SaleQuantity:
+        """ Remove the most recent scan of an item and return its quantity,
+            zero if the item has no scans.
+        """
+        scans = self.get(item_desc)
+        if not scans:
+            return 0
+        qty = scans.pop()
+        if not scans:
+            del self[item_desc]
+        self.voids.append(Void(item_desc, [qty], 0))
+        return qty
+
+    def void(self, item_desc: str,
+             num2remove: SaleQuantity) -> SaleQuantity:
+        """ Remove up to num2remove of an item, most recent scans first,
+            and return the quantity removed.  A scan larger than what is
+            left to remove is reduced rather than removed.  Only the scans
+            touched are visited.
+        """
+        scans = self.get(item_desc)
+        if not scans or num2remove <= 0:
+            return 0
+        removed: Sales = []
+        partial: SaleQuantity = 0
+        num_remaining = num2remove
+        while scans and num_remaining > 0:
+            if scans[-1] > num_remaining:
+                scans[-1] -= num_remaining
+                partial = num_remaining
+                break
+            qty = scans.pop()
+            removed.append(qty)
+            num_remaining -= qty
+        if not scans:
+            del self[item_desc]
+        self.voids.append(Void(item_desc, removed, partial))
+        return sum(removed) + partial
+
+    def restore(self) -> Union[Void, None]:
+        """ Put back the scans taken off by the most recent void and
+            return the void, or None if nothing has been voided.  A partial
+            amount is added back to the item's most recent scan.
+        """
+        if not self.voids:
+            return None
+        void = self.voids.pop()
+        scans = self.get(void.item_desc)
+        if void.partial:
+            if scans:
+                scans[-1] += void.partial
+            else:
+                self.add(void.item_desc, void.partial)
+        for qty in reversed(void.scans):
+            self.add(void.item_desc, qty)
+        return void
+
 
 class Receipt:
     """ This object manages items that are on the receipt. It adds items
         (purchases list) to the receipt and calculates the total spent.  The
-        items are held in a dictionary indexed by the item with the value being
-        a list of item quantities.
+        items are held in a ScanLedger, a dictionary indexed by the item
+        code with the value being a list of item quantities.
+
+        A running quantity and the last calculated price are kept for each
+        item.  Adding or removing scans only marks the item touched as
+        needing a new price so that a total only re-prices those items.
+        Items are kept apart by their code, so two items with the same
+        price and special are still priced as separate lines.
+
+        Items are looked up in the version of the POS's catalog that was
+        current when the receipt was opened, so price changes published
+        while the receipt is open do not apply to it.
+
+        When the POS is fixed point, weights are held as integer thousandths
+        and prices as integer Millicents until they are returned as Money.
+
+        A receipt attached to a journal (see journal.py) writes each change
+        to it after the change is made, and one with events (see events.py)
+        publishes the lines each change touched.
     """
     def __init__(self, pos: POS) -> None:
         # what can be purchased
         self.pos = pos
+        # the version of the catalog the receipt was opened with
+        self.catalog: CatalogSnapshot = pos.snapshot()
         # what has been purchased
-        self.purchases: Dict[StockType, Sales] = defaultdict(list)
+        self.purchases: ScanLedger = ScanLedger()
+        # StockType of each item code scanned
+        self._stock: Dict[str, StockType] = {}
+        # running quantity of each item purchased
+        self._qty: Dict[str, SaleQuantity] = {}
+        # price of each item purchased as of the last pricing
+        self._subtotals: Dict[str, Union[Money, Millicents]] = {}
+        # items whose quantity changed since they were last priced
+        self._dirty: Set[str] = set()
+        # sum of self._subtotals
+        self._total: Union[Money, Millicents] = (0 if pos.fixed_point
+                                                 else Money(0))
+        # journal the changes are written to and the receipt's id in it
+        self.journal = None
+        self.txn = 0
+        # publisher of the changes made to the receipt
+        self.events = None
 
     def __iadd__(self, item_desc: str):
         """ Define the += operator to add a scan of an item
@@ -203,40 +835,218 @@ class Receipt:
         self.add_scan(item_desc, 1)
         return self
 
+    def _scan(self, item_desc: str) -> StockType:
+        "look up an item in the receipt's version of the catalog"
+        stock_type = self._stock.get(item_desc)
+        if stock_type is None:
+            stock_type = self.pos.scan(item_desc, self.catalog)
+        return stock_type
+
     def add_scan(self, item_desc: str, qty: SaleQuantity) -> None:
         """ Add a quantity of an item to the receipt. Will raise a
             KeyError if the item_desc is not in the inventory or
             NotImplementedError if the quantity does not match how the
             item is sold (e.g. a weight for a product sold by item count).
         """
-        stock_type: StockType = self.pos.scan(item_desc)
+        stock_type: StockType = self.pos.scan(item_desc, self.catalog)
         stock_type.check_qty(qty)
-        self.purchases[stock_type].append(qty)
+        self._add(item_desc, stock_type, qty)
+        if self.journal is not None:
+            self.journal.add(self.txn, item_desc, qty)
+        if self.events is not None:
+            self._publish([item_desc])
+
+    def add_scans(self, scans: Iterable[Union[Scan,
+                                              Tuple[str, SaleQuantity]]]
+                  ) -> None:
+        """ Add a batch of scans, each an (item_desc, qty) pair or a Scan
+            with a list of quantities.  Every item code is looked up and
+            then every quantity is checked, an item's quantities together,
+            before anything is added.  If any scan is rejected nothing is
+            added and ScansRejected is raised listing every rejected scan.
+        """
+        stock_types: Dict[str, StockType] = {}
+        by_item: Dict[str, List[Tuple[int, SaleQuantity]]] = {}
+        # every scan in the order of the batch, for the journal
+        batch: List[Tuple[str, SaleQuantity]] = []
+        errors: List[Tuple[int, Exception]] = []
+        for position, scan in enumerate(scans):
+            if isinstance(scan, Scan):
+                item_desc, qtys = scan.item_desc, scan.qty
+            else:
+                item_desc, qty = scan
+                qtys = (qty,)
+            if item_desc not in stock_types:
+                try:
+                    stock_types[item_desc] = self.pos.scan(item_desc,
+                                                           self.catalog)
+                except KeyError as err:
+                    errors.append((position, err))
+                    continue
+            by_item.setdefault(item_desc, []).extend(
+                (position, qty) for qty in qtys)
+            batch.extend((item_desc, qty) for qty in qtys)
+        for item_desc, entries in by_item.items():
+            stock_type = stock_types[item_desc]
+            for position, qty in entries:
+                try:
+                    stock_type.check_qty(qty)
+                except NotImplementedError as err:
+                    errors.append((position, err))
+        if errors:
+            raise ScansRejected(sorted(errors, key=lambda error: error[0]))
+        for item_desc, entries in by_item.items():
+            for _, qty in entries:
+                self._add(item_desc, stock_types[item_desc], qty)
+        if self.journal is not None:
+            for item_desc, qty in batch:
+                self.journal.add(self.txn, item_desc, qty)
+        if self.events is not None and by_item:
+            self._publish(list(by_item))
+
+    def _add(self, item_desc: str, stock_type: StockType,
+             qty: SaleQuantity) -> None:
+        "add a checked quantity of an item"
+        self._stock[item_desc] = stock_type
+        if self.pos.fixed_point:
+            qty = stock_type.to_fixed_qty(qty)
+        self.purchases.add(item_desc, qty)
+        self._qty[item_desc] = self._qty.get(item_desc, 0) + qty
+        self._dirty.add(item_desc)
+
+    def _recount(self, item_desc: str, change: SaleQuantity) -> None:
+        """ Adjust the running quantity of an item by the amount removed or
+            restored and mark the item as needing a new price.  An item with
+            no scans left has no quantity, so a weight left over from float
+            rounding is not priced.
+        """
+        if item_desc in self.purchases:
+            self._qty[item_desc] = self._qty.get(item_desc, 0) + change
+        else:
+            self._qty[item_desc] = 0
+        self._dirty.add(item_desc)
+
+    def _reprice(self, item_desc: str) -> None:
+        """ Price one changed item and fold the change into the running
+            total.  The item stays changed if pricing it raises, so it is
+            priced again on the next total.
+        """
+        qty = self._qty.get(item_desc, 0)
+        old = self._subtotals.get(item_desc, 0)
+        if qty:
+            stock_type = self._stock[item_desc]
+            if self.pos.price_cache is None:
+                new = stock_type.pricing(stock_type, qty)
+            else:
+                new = self.pos.price_cache.price(stock_type, qty)
+            self._subtotals[item_desc] = new
+        else:
+            new = 0
+            self._subtotals.pop(item_desc, None)
+            self._qty.pop(item_desc, None)
+        if self.pos.fixed_point:
+            self._total += new - old
+        else:
+            self._total = EXACT.add(self._total, EXACT.subtract(new, old))
+        self._dirty.discard(item_desc)
+
+    def _publish(self, items: List[str]) -> None:
+        "publish the change of the lines of some items to the events"
+        self.events.changed(self, items)
+
+    def _money(self, amount: Union[Money, Millicents]) -> Money:
+        "round an amount owed to the cent"
+        if self.pos.fixed_point:
+            return to_money(amount)
+        return Money(amount).quantize(CENT)
+
+    def subtotal(self, item_desc: str) -> Money:
+        """ Return the amount owed for all the scans of one item.  Only
+            that item is re-priced, and only if it changed.
+        """
+        self._scan(item_desc)
+        if item_desc in self._dirty:
+            self._reprice(item_desc)
+        return self._money(self._subtotals.get(item_desc, 0))
+
+    def line(self, item_desc: str) -> Tuple[SaleQuantity, Money]:
+        """ Return the quantity of an item on the receipt, a count or a
+            weight as it is sold, and the amount owed for it.  Only that
+            item is re-priced, and only if it changed.
+        """
+        stock_type = self._scan(item_desc)
+        if item_desc in self._dirty:
+            self._reprice(item_desc)
+        qty = self._qty.get(item_desc, 0)
+        if self.pos.fixed_point and stock_type.how_sold == SaleType.BY_WT:
+            qty /= MILLI
+        return qty, self._money(self._subtotals.get(item_desc, 0))
+
+    def owed(self, item_desc: str) -> Millicents:
+        """ Return the amount owed for an item in Millicents, not rounded
+            to the cent, so the lines of a receipt add up to its total.
+            Floating point amounts are rounded half even to the Millicent.
+        """
+        self._scan(item_desc)
+        if item_desc in self._dirty:
+            self._reprice(item_desc)
+        amount = self._subtotals.get(item_desc, 0)
+        if self.pos.fixed_point:
+            return amount
+        return int((Money(amount) * MILLICENTS_PER_DOLLAR).quantize(
+            Decimal(1)))
+
+    def stock_type(self, item_desc: str) -> StockType:
+        """ Return the StockType an item is priced by on this receipt.  May
+            raise a KeyError if the item is not stocked.
+        """
+        return self._scan(item_desc)
 
     def total(self) -> Money:
         "total up the order, returning the price"
-        rcp_total = Money(0.00)
-        for purchased_item in self.purchases:
-            rcp_total += purchased_item.pricing(
-                purchased_item,
-                sum(self.purchases[purchased_item]))
-        return rcp_total.quantize(Decimal('.01'))
+        while self._dirty:
+            self._reprice(next(iter(self._dirty)))
+        return self._money(self._total)
 
 
     def remove_last(self, item_desc: str) -> None:
         """ Remove the last scan of the item named by item_desc. """
-        stock_type: StockType = self.pos.scan(item_desc)
-        self.purchases[stock_type] = self.purchases[stock_type][:-1]
+        self._scan(item_desc)
+        removed = self.purchases.void_last(item_desc)
+        if removed:
+            self._recount(item_desc, -removed)
+            if self.journal is not None:
+                self.journal.remove_last(self.txn, item_desc)
+            if self.events is not None:
+                self._publish([item_desc])
 
 
     def remove(self, item_desc: str, num2remove: SaleQuantity) -> None:
         """ Remove up to num2remove items from the scans of item_desc. """
-        num_remaining: SaleQuantity = num2remove
-        stock_type: StockType = self.pos.scan(item_desc)
-        while len(self.purchases[stock_type]) > 0 and num_remaining > 0:
-            if self.purchases[stock_type][-1] > num_remaining:
-                self.purchases[stock_type][-1] -= num_remaining
-            else:
-                num_remaining -=  self.purchases[stock_type][-1]
-                self.remove_last(item_desc)
+        stock_type = self._scan(item_desc)
+        qty = num2remove
+        if self.pos.fixed_point:
+            qty = stock_type.to_fixed_qty(num2remove)
+        removed = self.purchases.void(item_desc, qty)
+        if removed:
+            self._recount(item_desc, -removed)
+            if self.journal is not None:
+                self.journal.remove(self.txn, item_desc, num2remove)
+            if self.events is not None:
+                self._publish([item_desc])
+
 
+    def restore_void(self) -> Union[StockType, None]:
+        """ Put back the scans taken off by the most recent remove or
+            remove_last that removed anything.  Returns the item restored,
+            or None if there was nothing to restore.
+        """
+        void = self.purchases.restore()
+        if void is None:
+            return None
+        self._recount(void.item_desc, sum(void.scans) + void.partial)
+        if self.journal is not None:
+            self.journal.restore_void(self.txn)
+        if self.events is not None:
+            self._publish([void.item_desc])
+        return self._stock[void.item_desc]
@@ -0,0 +1,176 @@
+""" Replay of lane scan journals for the Receipt Total Generation Kata.
+
+    A journal is a file of JSON lines, one per receipt operation, with the
+    operations of many transactions interleaved:
+
+        {"txn": "L3-0042", "op": "scan", "item": "BANANAS", "qty": 3.5}
+        {"txn": "L3-0042", "op": "add", "item": "CAMP SOUP"}
+        {"txn": "L3-0042", "op": "remove_last", "item": "BANANAS"}
+        {"txn": "L3-0042", "op": "remove", "item": "CAMP SOUP", "qty": 1}
+        {"txn": "L3-0042", "op": "close", "total": "1.99"}
+
+    "scan" is Receipt.add_scan, "add" is the += operator, "remove_last" and
+    "remove" are the Receipt methods of those names and "close" ends the
+    transaction, optionally with the total the register recorded.
+
+    This is an audit tool and is not part of what is delivered on the POS
+    terminal.
+"""
+import json
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import (Any, Deque, Dict, Iterable, Iterator, List, NamedTuple,
+                    Optional, TextIO, Tuple)
+
+from .receipts import POS, Receipt, Money
+
+Record = Dict[str, Any]
+Transaction = Tuple[str, List[Record]]  # id and its operations in order
+
+
+class ReplayResult(NamedTuple):
+    "The outcome of replaying one transaction"
+    txn: str  # transaction id
+    total: Money  # total of the rebuilt receipt
+    recorded: Optional[Money]  # total the register recorded, if any
+    errors: Tuple[str, ...]  # operations the receipt rejected
+
+    @property
+    def matches(self) -> bool:
+        "True if there is no recorded total or it equals the replayed one"
+        return self.recorded is None or self.recorded == self.total
+
+
+def read_journal(lines: Iterable[str]) -> Iterator[Record]:
+    "parse journal lines, skipping blank ones"
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def transactions(records: Iterable[Record]) -> Iterator[Transaction]:
+    """ Group records by transaction.  A transaction is produced when its
+        close record is read, so only open transactions are held in
+        memory.  Transactions still open at the end of the journal are
+        produced last, in the order they were opened.
+    """
+    open_txns: Dict[str, List[Record]] = {}
+    for record in records:
+        txn = record['txn']
+        ops = open_txns.setdefault(txn, [])
+        ops.append(record)
+        if record['op'] == 'close':
+            yield (txn, open_txns.pop(txn))
+    yield from open_txns.items()
+
+
+def replay_transaction(pos: POS, txn: Transaction) -> ReplayResult:
+    """ Apply a transaction's operations to a new Receipt.  An operation
+        the receipt rejects (an unknown item or a quantity that does not
+        match how the item is sold) is reported and the rest are applied,
+        as the register would have carried on.
+    """
+    txn_id, ops = txn
+    receipt = Receipt(pos)
+    recorded: Optional[Money] = None
+    errors: List[str] = []
+    for record in ops:
+        op = record['op']
+        try:
+            if op == 'scan':
+                receipt.add_scan(record['item'], record['qty'])
+            elif op == 'add':
+                receipt += record['item']
+            elif op == 'remove_last':
+                receipt.remove_last(record['item'])
+            elif op == 'remove':
+                receipt.remove(record['item'], record['qty'])
+            elif op == 'close':
+                if record.get('total') is not None:
+                    recorded = Money(str(record['total']))
+            else:
+                raise NotImplementedError(f"Unknown journal operation {op}")
+        except (KeyError, NotImplementedError) as err:
+            errors.append(f"{op} {record.get('item', '')}: {err!r}")
+    return ReplayResult(txn_id, receipt.total(), recorded, tuple(errors))
+
+
+# the POS of a worker process, set once when the worker starts
+_worker_pos: Optional[POS] = None
+
+
+def _init_worker(pos: POS) -> None:
+    global _worker_pos
+    _worker_pos = pos
+
+
+def _replay_chunk(chunk: List[Transaction]) -> List[ReplayResult]:
+    return [replay_transaction(_worker_pos, txn) for txn in chunk]
+
+
+def _chunks(txns: Iterator[Transaction],
+            size: int) -> Iterator[List[Transaction]]:
+    chunk: List[Transaction] = []
+    for txn in txns:
+        chunk.append(txn)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def replay(lines: Iterable[str], pos: POS, workers: int = 0,
+           chunk_size: int = 64,
+           max_in_flight: int = None) -> Iterator[ReplayResult]:
+    """ Replay a journal and produce a ReplayResult for each transaction,
+        in the order the transactions are closed.
+
+        With workers set, chunks of chunk_size transactions are replayed
+        in that many processes, each of which receives the POS once when
+        it starts.  At most max_in_flight chunks (twice the workers by
+        default) are waiting at a time, so memory use does not grow with
+        the length of the journal.  Results are produced in the same order
+        as without workers.
+    """
+    txns = transactions(read_journal(lines))
+    if not workers:
+        for txn in txns:
+            yield replay_transaction(pos, txn)
+        return
+    max_in_flight = max_in_flight or 2 * workers
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(pos,)) as pool:
+        yield from _ordered(pool, _chunks(txns, chunk_size), max_in_flight)
+
+
+def _ordered(pool: Executor, chunks: Iterator[List[Transaction]],
+             max_in_flight: int) -> Iterator[ReplayResult]:
+    "submit chunks with a bounded number waiting, results in order"
+    in_flight: Deque = deque()
+    for chunk in chunks:
+        if len(in_flight) >= max_in_flight:
+            yield from in_flight.popleft().result()
+        in_flight.append(pool.submit(_replay_chunk, chunk))
+    while in_flight:
+        yield from in_flight.popleft().result()
+
+
+def write_results(results: Iterable[ReplayResult], out: TextIO) -> int:
+    """ Write results as JSON lines, totals as strings so they stay exact.
+        Returns the number of transactions whose total did not match the
+        recorded total.
+    """
+    mismatches = 0
+    for result in results:
+        if not result.matches:
+            mismatches += 1
+        out.write(json.dumps({
+            'txn': result.txn,
+            'total': str(result.total),
+            'recorded': (None if result.recorded is None
+                         else str(result.recorded)),
+            'match': result.matches,
+            'errors': list(result.errors),
+        }) + '\n')
+    return mismatches
@@ -0,0 +1,199 @@
+""" Streaming sales rollups for the Receipt Total Generation Kata.
+
+    A SalesRollup is fed receipts as they are closed and keeps, for each
+    item code sold, the lines sold, the units or weight sold at full price
+    and at a discount, the gross revenue (what the quantity costs at the
+    regular price) and the net revenue (what was charged, before each line
+    is rounded to the cent, so it rounds to the receipts' total).  The split
+    between full price and discounted quantity is the pricing rule's own
+    split(), the arithmetic it prices with, so the rollup agrees with the
+    receipts.  The discounts of promotions across items are kept by
+    promotion name.
+
+    Every total is an integer (weights in thousandths, money in Millicents)
+    so rollups made on separate lanes or in separate processes merge
+    exactly, in any order, and the memory held grows with the number of
+    items sold, not the number of receipts.  A rollup pickles as its
+    totals, so it can be sent from a worker process or saved to a file.
+"""
+import threading
+from typing import Any, Dict, Iterable, List, Tuple
+
+from .receipts import (Receipt, StockType, SaleType, SaleQuantity, Money,
+                       Millicents, MILLI, MILLICENTS_PER_DOLLAR,
+                       FixedStandard, to_money)
+
+
+def _millicents(amount: Money) -> Millicents:
+    "an amount owed as an exact integer number of Millicents"
+    return int(amount * MILLICENTS_PER_DOLLAR)
+
+
+class Totals:
+    """ What was sold of an item, or of a group of items.  Counts are in
+        units and weights in thousandths of a unit.
+    """
+    __slots__ = ('lines', 'full_units', 'disc_units', 'full_weight',
+                 'disc_weight', 'gross', 'net')
+
+    def __init__(self) -> None:
+        self.lines = 0  # receipts the item was on
+        self.full_units = 0
+        self.disc_units = 0
+        self.full_weight = 0
+        self.disc_weight = 0
+        self.gross: Millicents = 0  # at the regular price
+        self.net: Millicents = 0  # charged
+
+    def __getstate__(self) -> Tuple[int, ...]:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state: Tuple[int, ...]) -> None:
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __eq__(self, other: Any) -> bool:
+        return (type(self) is type(other) and
+                self.__getstate__() == other.__getstate__())
+
+    def __repr__(self) -> str:
+        return (f"{type(self).__name__}(" +
+                ", ".join(f"{name}={getattr(self, name)!r}"
+                          for name in self.__slots__) + ")")
+
+    def merge(self, other: 'Totals') -> None:
+        "add other's totals to these"
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    @property
+    def units(self) -> int:
+        return self.full_units + self.disc_units
+
+    @property
+    def weight(self) -> float:
+        "the weight sold in units of weight"
+        return (self.full_weight + self.disc_weight) / MILLI
+
+    @property
+    def discount(self) -> Money:
+        "the discount given by the items' own specials"
+        return to_money(self.gross - self.net)
+
+
+def _totals(totals: Dict[str, Totals], key: str) -> Totals:
+    "the totals kept under a key, made if there are none yet"
+    found = totals.get(key)
+    if found is None:
+        found = totals[key] = Totals()
+    return found
+
+
+class SalesRollup:
+    """ Sales totals of the receipts added to it, by item code, and the
+        discounts of promotions across items, by promotion name, as
+        [times applied, Millicents].
+    """
+
+    def __init__(self) -> None:
+        self.receipts = 0
+        self.items: Dict[str, Totals] = {}
+        # totals of the lines sold under each kind of pricing rule
+        self.rules: Dict[str, Totals] = {}
+        self.promotions: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _line(stock_type: StockType, qty: SaleQuantity
+              ) -> Tuple[int, int, Millicents]:
+        """ The discounted and full price quantities, in fixed-point units,
+            and the gross revenue of a line of a receipt.
+        """
+        fixed = getattr(stock_type.pricing, 'fixed_point', False)
+        if fixed:
+            qty = stock_type.to_fixed_qty(qty)
+            gross = FixedStandard()(stock_type, qty)
+        else:
+            gross = _millicents(StockType.standard(stock_type, qty))
+        split = getattr(stock_type.pricing, 'split', None)
+        disc, full = split(stock_type, qty) if split else (0, qty)
+        if not fixed:
+            disc = stock_type.to_fixed_qty(disc)
+            full = stock_type.to_fixed_qty(full)
+        return disc, full, gross
+
+    def add(self, receipt: Receipt) -> None:
+        "add the lines of a closed receipt to the totals"
+        lines = []
+        for item_desc in receipt.purchases:
+            stock_type = receipt.stock_type(item_desc)
+            qty = receipt.line(item_desc)[0]
+            if qty:
+                lines.append((item_desc, stock_type,
+                              receipt.owed(item_desc)) +
+                             self._line(stock_type, qty))
+        discounts = (receipt.discounts() if hasattr(receipt, 'discounts')
+                     else {})
+        with self._lock:
+            self.receipts += 1
+            for item_desc, stock_type, net, disc, full, gross in lines:
+                by_wt = stock_type.how_sold == SaleType.BY_WT
+                for totals in (_totals(self.items, item_desc),
+                               _totals(self.rules,
+                                       type(stock_type.pricing).__name__)):
+                    totals.lines += 1
+                    if by_wt:
+                        totals.disc_weight += disc
+                        totals.full_weight += full
+                    else:
+                        totals.disc_units += disc
+                        totals.full_units += full
+                    totals.gross += gross
+                    totals.net += net
+            for name, discount in discounts.items():
+                applied = self.promotions.setdefault(name, [0, 0])
+                applied[0] += 1
+                applied[1] += _millicents(discount)
+
+    def add_all(self, receipts: Iterable[Receipt]) -> None:
+        for receipt in receipts:
+            self.add(receipt)
+
+    def merge(self, other: 'SalesRollup') -> 'SalesRollup':
+        "add another rollup's totals to this one and return this one"
+        with self._lock:
+            self.receipts += other.receipts
+            for item_desc, totals in other.items.items():
+                _totals(self.items, item_desc).merge(totals)
+            for name, totals in other.rules.items():
+                _totals(self.rules, name).merge(totals)
+            for name, (count, discount) in other.promotions.items():
+                applied = self.promotions.setdefault(name, [0, 0])
+                applied[0] += count
+                applied[1] += discount
+        return self
+
+    def by_rule(self) -> Dict[str, Totals]:
+        "the totals of the lines sold under each kind of pricing rule"
+        rules: Dict[str, Totals] = {}
+        with self._lock:
+            for name, totals in self.rules.items():
+                _totals(rules, name).merge(totals)
+        return rules
+
+    def total(self) -> Totals:
+        "the totals of every item"
+        grand = Totals()
+        with self._lock:
+            for totals in self.items.values():
+                grand.merge(totals)
+        return grand
@@ -0,0 +1,225 @@
+""" An asyncio lane server for the Receipt Total Generation Kata.
+
+    One process serves every lane in a store.  Clients connect over TCP or
+    a Unix socket and send one request per line.  Each request gets one
+    response line, "OK" followed by a value or "ERR" followed by a reason:
+
+        OPEN                      OK <receipt id>
+        SCAN <id> <item>          OK            (the += operator)
+        ADD <id> <qty> <item>     OK            (add_scan, a count or weight)
+        VOID <id> <item>          OK            (remove_last)
+        REMOVE <id> <qty> <item>  OK            (remove)
+        TOTAL <id>                OK <total>
+        CLOSE <id>                OK <total>    (the receipt is forgotten)
+
+    Item codes are the rest of the line so they may contain spaces.  A
+    quantity with a decimal point is a weight, otherwise it is a count, and
+    it must be more than 0 and at most MAX_QTY.
+
+    Usage:  python -m <package>.server CATALOG [--port N | --unix PATH]
+    where CATALOG is a file written by catalog.compile_catalog().
+"""
+import argparse
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from .receipts import POS, Receipt, SaleQuantity
+from .catalog import MappedCatalog
+
+MAX_LINE = 4096  # longest request line accepted
+READ_SIZE = 65536  # most bytes read from a connection at a time
+MAX_QTY = 10000  # most units or weight accepted in one request
+
+
+def parse_qty(text: str) -> SaleQuantity:
+    """ A count, or a weight if the text has a decimal point or exponent.
+        Raises a ValueError unless the quantity is finite, positive and
+        no more than MAX_QTY.
+    """
+    if '.' in text or 'e' in text.lower():
+        qty: SaleQuantity = float(text)
+    else:
+        qty = int(text)
+    if not (math.isfinite(qty) and 0 < qty <= MAX_QTY):
+        raise ValueError(f"quantity must be more than 0 and at most "
+                         f"{MAX_QTY}: {text}")
+    return qty
+
+
+class ReceiptTable:
+    """ The open receipts, by id, in order of last use.  When more than
+        max_receipts are open, or a receipt has not been used for
+        idle_seconds, the least recently used receipts are evicted so the
+        memory held is bounded.
+    """
+
+    def __init__(self, pos: POS, max_receipts: int = 10000,
+                 idle_seconds: float = 900.0) -> None:
+        self.pos = pos
+        self.max_receipts = max_receipts
+        self.idle_seconds = idle_seconds
+        self.evicted = 0  # receipts evicted since the table was made
+        self._next_id = 1
+        # id -> (receipt, time last used)
+        self._receipts: 'OrderedDict[str, Tuple[Receipt, float]]' = \
+            OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._receipts)
+
+    def open(self) -> str:
+        "open a new receipt and return its id"
+        self.evict()
+        receipt_id = str(self._next_id)
+        self._next_id += 1
+        self._receipts[receipt_id] = (Receipt(self.pos), time.monotonic())
+        if len(self._receipts) > self.max_receipts:
+            self._receipts.popitem(last=False)
+            self.evicted += 1
+        return receipt_id
+
+    def get(self, receipt_id: str) -> Receipt:
+        "the receipt with the id, raises KeyError if it is not open"
+        receipt, _ = self._receipts.pop(receipt_id)
+        self._receipts[receipt_id] = (receipt, time.monotonic())
+        return receipt
+
+    def close(self, receipt_id: str) -> Receipt:
+        "forget the receipt and return it, raises KeyError if not open"
+        return self._receipts.pop(receipt_id)[0]
+
+    def evict(self) -> None:
+        "evict receipts that have been idle too long"
+        oldest = time.monotonic() - self.idle_seconds
+        while self._receipts:
+            _, (_, used) = next(iter(self._receipts.items()))
+            if used >= oldest:
+                break
+            self._receipts.popitem(last=False)
+            self.evicted += 1
+
+
+class LaneServer:
+    """ Serves a ReceiptTable to many connections.  A connection's
+        requests are handled in the order they arrive.  Every complete
+        request line in a read is handled and the responses written
+        together, and nothing more is read from a connection until its
+        responses have drained, so a client that does not read its
+        responses is slowed down instead of filling memory.
+    """
+
+    def __init__(self, pos: POS, max_receipts: int = 10000,
+                 idle_seconds: float = 900.0) -> None:
+        self.table = ReceiptTable(pos, max_receipts, idle_seconds)
+
+    def handle(self, line: str) -> str:
+        "handle one request line and return the response line"
+        words = line.split(None, 2)
+        if not words:
+            return 'ERR empty request'
+        command = words[0].upper()
+        try:
+            if command == 'OPEN':
+                return f'OK {self.table.open()}'
+            if len(words) < 2:
+                return f'ERR {command} needs a receipt id'
+            receipt_id = words[1]
+            if command == 'TOTAL':
+                return f'OK {self.table.get(receipt_id).total()}'
+            if command == 'CLOSE':
+                # the receipt is only forgotten once it has a total
+                total = self.table.get(receipt_id).total()
+                self.table.close(receipt_id)
+                return f'OK {total}'
+            receipt = self.table.get(receipt_id)
+            rest = words[2] if len(words) > 2 else ''
+            if command == 'SCAN':
+                receipt += rest
+            elif command == 'VOID':
+                receipt.remove_last(rest)
+            elif command in ('ADD', 'REMOVE'):
+                qty_text, _, item = rest.partition(' ')
+                qty = parse_qty(qty_text)
+                if command == 'ADD':
+                    receipt.add_scan(item, qty)
+                else:
+                    receipt.remove(item, qty)
+            else:
+                return f'ERR unknown command {command}'
+            return 'OK'
+        except KeyError as err:
+            return f'ERR unknown {err}'
+        except (NotImplementedError, ValueError) as err:
+            return f'ERR {err}'
+        except ArithmeticError as err:
+            # the item that failed is priced again by the next request
+            return f'ERR cannot price: {err!r}'
+
+    async def serve_connection(self, reader: asyncio.StreamReader,
+                               writer: asyncio.StreamWriter) -> None:
+        "handle the requests of one connection until it closes"
+        pending = b''
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                lines = (pending + data).split(b'\n')
+                pending = lines.pop()
+                if len(pending) > MAX_LINE:
+                    writer.write(b'ERR request too long\n')
+                    break
+                responses: List[str] = [
+                    self.handle(line.decode('utf-8', 'replace').rstrip('\r'))
+                    for line in lines]
+                if responses:
+                    writer.write(('\n'.join(responses) + '\n').encode())
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def start(self, port: int = None, host: str = '127.0.0.1',
+                    unix: str = None) -> asyncio.AbstractServer:
+        "start listening on a Unix socket path if given, else TCP"
+        if unix:
+            return await asyncio.start_unix_server(self.serve_connection,
+                                                   unix)
+        return await asyncio.start_server(self.serve_connection, host, port)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    "run a lane server on a compiled catalog until interrupted"
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('catalog', help='compiled catalog file')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='Unix socket path instead of TCP')
+    parser.add_argument('--max-receipts', type=int, default=10000)
+    parser.add_argument('--idle-seconds', type=float, default=900.0)
+    args = parser.parse_args(argv)
+    catalog = MappedCatalog(args.catalog)
+    server = LaneServer(POS(catalog, fixed_point=catalog.fixed_point),
+                        args.max_receipts, args.idle_seconds)
+
+    async def run() -> None:
+        listener = await server.start(args.port, args.host, args.unix)
+        async with listener:
+            await listener.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
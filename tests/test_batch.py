@@ -0,0 +1,129 @@
+""" Test that batch pricing matches Receipt totals """
+import random
+from decimal import Decimal
+from typing import Dict
+import pytest
+np = pytest.importorskip("numpy")
+from ..receipts import POS, StockType, SaleType, Receipt
+from ..batch import BatchPricer
+
+
+@pytest.fixture(scope='module')
+def catalog() -> Dict[str, StockType]:
+    "an inventory using every kind of special, by count and by weight"
+    return {
+        "SOUP": StockType(1.99, SaleType.EACH, StockType.standard),
+        "CHUCK": StockType(1.99, SaleType.BY_WT, StockType.standard),
+        "SAUSAGE": StockType(4.99, SaleType.EACH, StockType.cents_off(.45)),
+        "BANANAS": StockType(0.28, SaleType.BY_WT, StockType.cents_off(.08)),
+        "CATFOOD": StockType(1.25, SaleType.EACH,
+                             StockType.cents_off(.25, limit=6)),
+        "GRAPES": StockType(2.49, SaleType.BY_WT,
+                            StockType.cents_off(.50, limit=2)),
+        "PROGRESSO": StockType(1.25, SaleType.EACH, StockType.cents_off(1.45)),
+        "LETTUCE": StockType(1.99, SaleType.EACH,
+                             StockType.conditional_percent_off(1, 1, 100)),
+        "COKE": StockType(1.29, SaleType.EACH,
+                          StockType.conditional_percent_off(2, 1, 50)),
+        "WATER": StockType(1.00, SaleType.EACH,
+                           StockType.conditional_percent_off(1, 1, 100,
+                                                             limit=6)),
+        "SALMON": StockType(3.00, SaleType.BY_WT,
+                            StockType.conditional_percent_off(1, 1, 50)),
+        "CHEESE": StockType(5.55, SaleType.BY_WT,
+                            StockType.conditional_percent_off(2, 1, 25,
+                                                              limit=7)),
+    }
+
+
+def random_baskets(catalog, count, seed):
+    "columns of scans for count random receipts"
+    rand = random.Random(seed)
+    items = list(catalog)
+    receipt_ids, item_ids, quantities = [], [], []
+    for receipt_id in range(count):
+        for _ in range(rand.randint(1, 15)):
+            item = rand.choice(items)
+            if catalog[item].how_sold == SaleType.BY_WT:
+                qty = rand.choice([0.125, 0.5, 1.1, 2.0, 0.333,
+                                   round(rand.uniform(0.01, 3), 3)])
+            else:
+                qty = rand.randint(1, 9)
+            receipt_ids.append(receipt_id)
+            item_ids.append(item)
+            quantities.append(qty)
+    return receipt_ids, item_ids, quantities
+
+
+def receipt_totals(pos, receipt_ids, item_ids, quantities):
+    "the same scans totalled one Receipt at a time"
+    receipts = {}
+    for receipt_id, item, qty in zip(receipt_ids, item_ids, quantities):
+        receipts.setdefault(receipt_id, Receipt(pos)).add_scan(item, qty)
+    return {receipt_id: receipt.total()
+            for receipt_id, receipt in receipts.items()}
+
+
+@pytest.mark.parametrize("fixed_point", [False, True])
+def test_batch_matches_receipts(catalog, fixed_point) -> None:
+    """ Test that batch totals match Receipt.total() to the cent """
+    pos = POS(catalog, fixed_point=fixed_point)
+    columns = random_baskets(catalog, 500, seed=7)
+    assert (BatchPricer(pos).totals(*columns) ==
+            receipt_totals(pos, *columns))
+
+
+def test_batch_half_cents(catalog) -> None:
+    """ Test amounts that fall on or next to half a cent """
+    pos = POS(catalog)
+    columns = ([0, 1, 1, 2, 3, 3, 4],
+               ["COKE", "BANANAS", "BANANAS", "CHUCK", "GRAPES", "BANANAS",
+                "SAUSAGE"],
+               [4, 0.125, 0.0625, 0.125, 0.5, 0.375, 3])
+    assert (BatchPricer(pos).totals(*columns) ==
+            receipt_totals(pos, *columns))
+
+
+def test_batch_item_positions(catalog) -> None:
+    """ Test that items can be given by position in the catalog and that
+        totals come back in integer cents in receipt id order
+    """
+    pricer = BatchPricer(POS(catalog))
+    items = pricer.item_index(["COKE", "SOUP", "COKE"])
+    receipts, cents = pricer.price(np.array([9, 3, 9]), items, [3, 2, 1])
+    assert receipts.tolist() == [3, 9]
+    assert cents.tolist() == [398, 452]
+
+
+def test_batch_errors(catalog) -> None:
+    """ Test unknown items, bad quantities and unsupported pricing """
+    pricer = BatchPricer(POS(catalog))
+    with pytest.raises(KeyError):
+        pricer.price([0], ["NOT STOCKED"], [1])
+    with pytest.raises(NotImplementedError):
+        pricer.price([0], ["SOUP"], [1.5])
+    with pytest.raises(NotImplementedError):
+        pricer.price([0], ["SOUP"], [2.0])
+    with pytest.raises(NotImplementedError):
+        pricer.price([0], ["CHUCK"], [2])
+    with pytest.raises(NotImplementedError):
+        pricer.price([0], ["SOUP"], np.array([2.0]))
+    with pytest.raises(NotImplementedError):
+        BatchPricer(POS({"ODD": StockType(1.00, SaleType.EACH,
+                                          lambda stock, qty: Decimal(0))}))
+
+
+@pytest.mark.parametrize("fixed_point", [False, True])
+def test_batch_same_specials_on_different_items(fixed_point) -> None:
+    """ Test that items with the same price and special are priced as
+        separate lines, as the receipt prices them
+    """
+    pos = POS({item: StockType(1.99, SaleType.EACH,
+                               StockType.conditional_percent_off(1, 1, 100))
+               for item in ("BIB LETTUCE", "ROMAINE")},
+              fixed_point=fixed_point)
+    columns = ([0, 0, 1, 1], ["BIB LETTUCE", "ROMAINE", "ROMAINE", "ROMAINE"],
+               [1, 1, 1, 1])
+    totals = BatchPricer(pos).totals(*columns)
+    assert totals == {0: Decimal('3.98'), 1: Decimal('1.99')}
+    assert totals == receipt_totals(pos, *columns)
@@ -0,0 +1,59 @@
+""" Test the benchmark suite's generators and baseline comparison """
+import json
+from ..receipts import POS, SaleType, Standard, CentsOff
+from ..bench import (make_catalog, make_baskets, run_baskets, benchmark,
+                     compare, main)
+
+
+def test_catalog_mix() -> None:
+    """ Test that generated catalogs are repeatable and have the mix of
+        rules and weighed items asked for
+    """
+    catalog = make_catalog(2000, rule_mix=(0.5, 0.5, 0.0), by_wt_share=0.25,
+                           seed=3)
+    assert catalog == make_catalog(2000, rule_mix=(0.5, 0.5, 0.0),
+                                   by_wt_share=0.25, seed=3)
+    assert len(catalog) == 2000
+    rules = [type(stock.pricing) for stock in catalog.values()]
+    assert set(rules) == {Standard, CentsOff}
+    assert 800 < rules.count(CentsOff) < 1200
+    weighed = sum(stock.how_sold == SaleType.BY_WT
+                  for stock in catalog.values())
+    assert 400 < weighed < 600
+    # every price is a whole number of cents so it can be fixed point
+    POS(catalog, fixed_point=True)
+
+
+def test_baskets_run() -> None:
+    """ Test that generated baskets are repeatable and time each operation """
+    catalog = make_catalog(500, limit_share=0.5, seed=1)
+    baskets = make_baskets(catalog, 50, void_share=0.2, remove_share=0.2,
+                           seed=1)
+    assert baskets == make_baskets(catalog, 50, void_share=0.2,
+                                   remove_share=0.2, seed=1)
+    latencies = run_baskets(POS(catalog), baskets)
+    assert set(latencies) == {'+=', 'add_scan', 'total', 'remove_last',
+                              'remove'}
+    assert len(latencies['total']) == sum(
+        1 for ops in baskets for op in ops if op[0] == 'total')
+
+
+def test_compare_and_main(tmp_path) -> None:
+    """ Test the comparison with a baseline and the exit status of main """
+    run = benchmark(200, baskets=20, cache_size=64)
+    assert run['total']['count'] > 20 and run['peak_memory_bytes'] > 0
+    results = {'runs': {'200': run}}
+    assert compare(results, results) == []
+    faster = json.loads(json.dumps(results))
+    before = faster['runs']['200']['total']
+    before['per_second'] *= 2
+    assert compare(results, faster) == [
+        f"200 total per_second: {before['per_second']:.0f} -> "
+        f"{run['total']['per_second']:.0f}"]
+    baseline = tmp_path / 'baseline.json'
+    out = tmp_path / 'results.json'
+    baseline.write_text(json.dumps({'runs': {'100': {
+        'POS': {'per_second': 1e12, 'p99_us': 1e-6}}}}))
+    assert main(['--skus', '100', '--baskets', '5', '--out', str(out),
+                 '--baseline', str(baseline)]) == 1
+    assert set(json.loads(out.read_text())['runs']) == {'100'}
@@ -0,0 +1,135 @@
+""" Test compiled, memory-mapped catalogs """
+import pickle
+import threading
+from decimal import Decimal
+from typing import Dict
+import pytest
+from ..receipts import POS, StockType, SaleType, Receipt
+from ..catalog import compile_catalog, MappedCatalog
+
+
+@pytest.fixture(scope='module')
+def stock_items() -> Dict[str, StockType]:
+    "an inventory using every kind of special"
+    return {
+        "CAMP SOUP 10.75z": StockType(1.99, SaleType.EACH, StockType.standard),
+        "BANANAS DELMONTE": StockType(0.28, SaleType.BY_WT,
+                                      StockType.cents_off(.08)),
+        "FNCYFST CATFD 3z": StockType(1.25, SaleType.EACH,
+                                      StockType.cents_off(.25, limit=6)),
+        "COKE CLASIC 1.Ol": StockType(1.29, SaleType.EACH,
+                                      StockType.conditional_percent_off(
+                                          min_items=2, disc_items=1,
+                                          pct_off=50)),
+        "ETERNAL WTR 600M": StockType(1.00, SaleType.EACH,
+                                      StockType.conditional_percent_off(
+                                          min_items=1, disc_items=1,
+                                          pct_off=100, limit=6)),
+        "JALAPEÑO": StockType(2.49, SaleType.BY_WT, StockType.standard),
+    }
+
+
+@pytest.fixture
+def catalog(stock_items, tmp_path):
+    "the inventory compiled and mapped"
+    path = str(tmp_path / 'stock.cat')
+    compile_catalog(stock_items, path)
+    with MappedCatalog(path, cache_size=2) as mapped:
+        yield mapped
+
+
+def test_lookup(stock_items, catalog) -> None:
+    """ Test that every item decodes equal to the item compiled, in and
+        out of the cache, and that unknown items raise KeyError.
+    """
+    assert len(catalog) == len(stock_items)
+    assert list(catalog) == sorted(stock_items,
+                                   key=lambda item: item.encode('utf-8'))
+    for _ in range(2):
+        for item, stock in stock_items.items():
+            assert catalog[item] == stock
+            assert hash(catalog[item]) == hash(stock)
+    assert not catalog.fixed_point
+    assert "NOT STOCKED" not in catalog
+    with pytest.raises(KeyError):
+        catalog["NOT STOCKED"]
+
+
+def test_receipt_on_mapped_catalog(stock_items, catalog) -> None:
+    """ Test that a receipt on a mapped catalog totals the same as on the
+        dictionary it was compiled from.
+    """
+    mapped = Receipt(POS(catalog))
+    plain = Receipt(POS(stock_items))
+    for receipt in (mapped, plain):
+        receipt.add_scan("COKE CLASIC 1.Ol", 4)
+        receipt.add_scan("ETERNAL WTR 600M", 12)
+        receipt.add_scan("BANANAS DELMONTE", 3.5)
+        receipt.add_scan("FNCYFST CATFD 3z", 7)
+        receipt += "CAMP SOUP 10.75z"
+        receipt.remove("COKE CLASIC 1.Ol", 1)
+    assert mapped.total() == plain.total()
+
+
+def test_fixed_point_catalog(stock_items, tmp_path) -> None:
+    """ Test that a fixed-point catalog is marked as fixed point and used
+        by a fixed-point POS without converting it.
+    """
+    path = str(tmp_path / 'fixed.cat')
+    fixed = POS(stock_items, fixed_point=True)
+    compile_catalog(fixed.stock_items, path)
+    with MappedCatalog(path) as catalog:
+        assert catalog.fixed_point
+        pos = POS(catalog, fixed_point=True)
+        assert pos.snapshot().base is catalog
+        assert catalog["COKE CLASIC 1.Ol"] == \
+            fixed.scan("COKE CLASIC 1.Ol")
+        receipt = Receipt(pos)
+        receipt.add_scan("BANANAS DELMONTE", 3.5)
+        assert receipt.total() == Decimal('0.70')
+
+
+def test_pickle_reopens_file(catalog) -> None:
+    """ Test that a pickled catalog maps the same file again """
+    copy = pickle.loads(pickle.dumps(catalog))
+    assert copy.path == catalog.path
+    assert dict(copy) == dict(catalog)
+    copy.close()
+
+
+def test_bad_files(tmp_path) -> None:
+    """ Test that only pricing rules compile and only catalogs open """
+    with pytest.raises(NotImplementedError):
+        compile_catalog({"ODD": StockType(1.00, SaleType.EACH,
+                                          lambda stock, qty: Decimal(0))},
+                        str(tmp_path / 'odd.cat'))
+    path = tmp_path / 'junk.cat'
+    path.write_bytes(b'not a catalog at all, not even close')
+    with pytest.raises(NotImplementedError):
+        MappedCatalog(str(path))
+
+
+def test_cache_shared_by_threads(stock_items, tmp_path) -> None:
+    """ Test that lanes on threads can share a small look-up cache """
+    path = str(tmp_path / 'small.cat')
+    compile_catalog(stock_items, path)
+    catalog = MappedCatalog(path, cache_size=2)
+    codes = list(stock_items)
+    errors = []
+
+    def lane(start: int) -> None:
+        try:
+            for num in range(2000):
+                code = codes[(start + num) % len(codes)]
+                assert catalog[code] == stock_items[code]
+        except Exception as err:
+            errors.append(err)
+
+    threads = [threading.Thread(target=lane, args=(num,))
+               for num in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(catalog._cache) <= 2
@@ -0,0 +1,162 @@
+""" Test the line-item change events of receipts """
+import asyncio
+from decimal import Decimal
+from typing import Dict
+import pytest
+from ..receipts import POS, StockType, SaleType, Receipt
+from ..promotions import MixAndMatch, PromotionIndex, PromotionReceipt
+from ..events import (ReceiptEvents, LineAdded, QtyChanged, LineVoided,
+                      PromotionApplied, PromotionRevoked, Subtotal)
+
+
+@pytest.fixture(scope='module')
+def stock_items() -> Dict[str, StockType]:
+    return {
+        "CAMP SOUP 10.75z": StockType(1.00, SaleType.EACH, StockType.standard),
+        "BANANAS DELMONTE": StockType(0.28, SaleType.BY_WT,
+                                      StockType.cents_off(.08)),
+        "YOGURT PLAIN": StockType(1.49, SaleType.EACH, StockType.standard),
+        "YOGURT GREEK": StockType(1.99, SaleType.EACH, StockType.standard),
+    }
+
+
+@pytest.mark.parametrize('fixed_point', [False, True])
+def test_line_events(stock_items, fixed_point) -> None:
+    """ Test the events of scans, removals and a restored void """
+    receipt = Receipt(POS(stock_items, fixed_point))
+    events = ReceiptEvents(receipt)
+    seen = []
+    events.subscribe(seen.append)
+    receipt += "CAMP SOUP 10.75z"
+    receipt.add_scan("CAMP SOUP 10.75z", 2)
+    receipt.add_scan("BANANAS DELMONTE", 2.5)
+    receipt.remove("CAMP SOUP 10.75z", 1)
+    receipt.remove_last("BANANAS DELMONTE")
+    receipt.remove_last("BANANAS DELMONTE")  # nothing left, nothing changes
+    receipt.restore_void()
+    assert seen == [
+        LineAdded("CAMP SOUP 10.75z", 1, Decimal('1.00')),
+        Subtotal(Decimal('1.00')),
+        QtyChanged("CAMP SOUP 10.75z", 3, 2, Decimal('3.00')),
+        Subtotal(Decimal('3.00')),
+        LineAdded("BANANAS DELMONTE", 2.5, Decimal('0.50')),
+        Subtotal(Decimal('3.50')),
+        QtyChanged("CAMP SOUP 10.75z", 2, -1, Decimal('2.00')),
+        Subtotal(Decimal('2.50')),
+        LineVoided("BANANAS DELMONTE", 2.5),
+        Subtotal(Decimal('2.00')),
+        LineAdded("BANANAS DELMONTE", 2.5, Decimal('0.50')),
+        Subtotal(Decimal('2.50')),
+    ]
+    assert list(events.drain()) == seen
+    assert list(events.drain()) == []
+
+
+def test_batch_and_backlog(stock_items) -> None:
+    """ Test that a batch publishes one subtotal and that the backlog is
+        bounded
+    """
+    receipt = Receipt(POS(stock_items))
+    receipt += "CAMP SOUP 10.75z"
+    # attached to a receipt with lines on it already
+    events = ReceiptEvents(receipt, backlog=3)
+    receipt.add_scans([("CAMP SOUP 10.75z", 1), ("YOGURT PLAIN", 2),
+                       ("BANANAS DELMONTE", 1.0)])
+    # one total for the batch, and only the last 3 events kept
+    assert list(events.drain()) == [
+        LineAdded("YOGURT PLAIN", 2, Decimal('2.98')),
+        LineAdded("BANANAS DELMONTE", 1.0, Decimal('0.20')),
+        Subtotal(Decimal('5.18')),
+    ]
+    events.close()
+    receipt += "YOGURT PLAIN"
+    assert receipt.events is None
+    assert list(events.drain()) == []
+
+
+def test_promotion_events(stock_items) -> None:
+    """ Test the events of promotions applied and revoked """
+    promotions = PromotionIndex([
+        MixAndMatch("2 YOGURTS $3", ["YOGURT PLAIN", "YOGURT GREEK"], qty=2,
+                    price=3.00)])
+    receipt = PromotionReceipt(POS(stock_items), promotions)
+    events = ReceiptEvents(receipt)
+    receipt += "YOGURT PLAIN"
+    receipt += "YOGURT GREEK"
+    receipt.remove_last("YOGURT PLAIN")
+    assert list(events.drain()) == [
+        LineAdded("YOGURT PLAIN", 1, Decimal('1.49')),
+        Subtotal(Decimal('1.49')),
+        LineAdded("YOGURT GREEK", 1, Decimal('1.99')),
+        PromotionApplied("2 YOGURTS $3", Decimal('0.48')),
+        Subtotal(Decimal('3.00')),
+        LineVoided("YOGURT PLAIN", 1),
+        PromotionRevoked("2 YOGURTS $3", Decimal('0.48')),
+        Subtotal(Decimal('1.99')),
+    ]
+    receipt.restore_void()
+    assert list(events.drain()) == [
+        LineAdded("YOGURT PLAIN", 1, Decimal('1.49')),
+        PromotionApplied("2 YOGURTS $3", Decimal('0.48')),
+        Subtotal(Decimal('3.00')),
+    ]
+
+
+def test_only_changed_promotions_compared(stock_items) -> None:
+    """ Test that a change only compares the promotions whose discount it
+        may have changed
+    """
+    promotions = PromotionIndex([
+        MixAndMatch("2 YOGURTS $3", ["YOGURT PLAIN", "YOGURT GREEK"], qty=2,
+                    price=3.00)])
+    receipt = PromotionReceipt(POS(stock_items), promotions)
+    receipt.add_scans([("YOGURT PLAIN", 1), ("YOGURT GREEK", 1)])
+    events = ReceiptEvents(receipt)
+    assert receipt.changed_discounts() == {}
+    receipt += "CAMP SOUP 10.75z"
+    assert receipt.changed_discounts() == {}
+    receipt += "YOGURT GREEK"
+    assert receipt.changed_discounts() == {}  # taken by the publisher
+    assert list(events.drain()) == [
+        LineAdded("CAMP SOUP 10.75z", 1, Decimal('1.00')),
+        Subtotal(Decimal('4.00')),
+        QtyChanged("YOGURT GREEK", 2, 1, Decimal('3.98')),
+        # the two greek now make the deal
+        PromotionApplied("2 YOGURTS $3", Decimal('0.98')),
+        Subtotal(Decimal('5.49')),
+    ]
+
+
+def test_one_publisher_per_receipt(stock_items) -> None:
+    """ Test that a receipt has one publisher until it is closed """
+    receipt = Receipt(POS(stock_items))
+    events = ReceiptEvents(receipt)
+    with pytest.raises(RuntimeError):
+        ReceiptEvents(receipt)
+    assert receipt.events is events
+    events.close()
+    assert ReceiptEvents(receipt).receipt is receipt
+
+
+def test_async_stream(stock_items) -> None:
+    """ Test that events are streamed to an async iterator until close() """
+    receipt = Receipt(POS(stock_items))
+    events = ReceiptEvents(receipt)
+
+    async def display():
+        return [event async for event in events]
+
+    async def lane():
+        task = asyncio.ensure_future(display())
+        await asyncio.sleep(0)
+        receipt.add_scan("CAMP SOUP 10.75z", 1)
+        receipt.remove_last("CAMP SOUP 10.75z")
+        events.close()
+        return await task
+
+    assert asyncio.run(lane()) == [
+        LineAdded("CAMP SOUP 10.75z", 1, Decimal('1.00')),
+        Subtotal(Decimal('1.00')),
+        LineVoided("CAMP SOUP 10.75z", 1),
+        Subtotal(Decimal('0.00')),
+    ]
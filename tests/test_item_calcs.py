@@ -1,10 +1,16 @@
 """ Test for the Receipt Total Generation Kata """
 import os
+import pickle
+import threading
+import timeit
+import weakref
 import sys
 from decimal import Decimal
 from typing import Dict
 import pytest
-from ..receipts import POS, StockType, SaleType, Receipt
+from ..receipts import (POS, StockType, SaleType, Receipt, ScanLedger,
+                        FixedCentsOff, FixedStandard, Scan, ScansRejected,
+                        PriceCache)
 
 def test_bad_stock_types():
     """ Test the various ways creation of a StockType may fail """
@@ -239,3 +245,451 @@ def test_conditional_for_weighed_item(receipt) -> None:
     # buy two pounds of 'buy 1 get 1 half off' product costing 3.00/lb
     receipt.add_scan("A1ALASKAN SALMON", 2.0)
     assert receipt.total() == Decimal(3.00 * 1.5).quantize(Decimal('.01'))
+
+def test_subtotal_per_item(receipt) -> None:
+    """ Test that the price of a single item's scans can be read
+        without totalling the receipt and follows removals.
+    """
+    receipt.add_scan("COKE CLASIC 1.Ol", 3)
+    receipt += "CAMP SOUP 10.75z"
+    assert receipt.subtotal("COKE CLASIC 1.Ol") == \
+        Decimal(1.29 * 2.5).quantize(Decimal('.01'))
+    assert receipt.subtotal("CAMP SOUP 10.75z") == Decimal('1.99')
+    # an item that was never scanned costs nothing
+    assert receipt.subtotal("BIB LETTUCE HDRP") == Decimal('0.00')
+    receipt.remove_last("CAMP SOUP 10.75z")
+    assert receipt.subtotal("CAMP SOUP 10.75z") == Decimal('0.00')
+    assert receipt.total() == Decimal(1.29 * 2.5).quantize(Decimal('.01'))
+
+
+def test_total_reprices_only_changed_items() -> None:
+    """ Test that a total only calls the pricing function of items whose
+        scans changed since the last total.
+    """
+    calls = []
+    def counted(self, qty):
+        calls.append(qty)
+        return StockType.standard(self, qty)
+    receipt = Receipt(POS({
+        "SOUP": StockType(1.99, SaleType.EACH, counted),
+        "BEEF": StockType(2.49, SaleType.BY_WT, counted),
+    }))
+    receipt += "SOUP"
+    receipt.add_scan("BEEF", 1.5)
+    assert receipt.total() == Decimal('1.99') + Decimal('3.74')
+    assert sorted(calls) == [1, 1.5]
+    # nothing changed so nothing is priced again
+    assert receipt.total() == Decimal('5.73')
+    assert len(calls) == 2
+    # only the soup is priced again
+    receipt += "SOUP"
+    assert receipt.total() == Decimal('7.72')
+    assert calls[2:] == [2]
+    # removing every scan of an item prices nothing
+    receipt.remove("BEEF", 1.5)
+    assert receipt.total() == Decimal('3.98')
+    assert calls[2:] == [2]
+
+
+def test_running_total_stays_exact(receipt) -> None:
+    """ Test that the running total comes back to what it was when a line
+        far larger than the rest is added and taken off again.
+    """
+    receipt += "CAMP SOUP 10.75z"
+    receipt.add_scan("BANANAS DELMONTE", 1e30 / 3)
+    with pytest.raises(ArithmeticError):
+        receipt.total()  # too many digits to round to the cent
+    receipt.remove_last("BANANAS DELMONTE")
+    assert receipt.total() == Decimal('1.99')
+
+
+def test_pricing_error_retried() -> None:
+    """ Test that an item whose pricing raised is priced again on the next
+        total rather than left at its old price.
+    """
+    failures = [ArithmeticError("pricing failed")]
+    def flaky(self, qty):
+        if failures:
+            raise failures.pop()
+        return StockType.standard(self, qty)
+    receipt = Receipt(POS({"SOUP": StockType(1.99, SaleType.EACH, flaky)}))
+    receipt.add_scan("SOUP", 2)
+    with pytest.raises(ArithmeticError):
+        receipt.total()
+    assert receipt.total() == Decimal('3.98')
+
+
+def test_partial_remove(receipt) -> None:
+    """ Test that removing less than a scan's quantity reduces that scan
+        and leaves earlier scans alone.
+    """
+    receipt.add_scan("CAMP SOUP 10.75z", 2)
+    receipt.add_scan("CAMP SOUP 10.75z", 5)
+    receipt.remove("CAMP SOUP 10.75z", 1)
+    assert list(receipt.purchases.values()) == [[2, 4]]
+    assert receipt.total() == Decimal('1.99') * 6
+    receipt.remove("CAMP SOUP 10.75z", 5)
+    assert list(receipt.purchases.values()) == [[1]]
+    assert receipt.total() == Decimal('1.99')
+
+
+def test_weight_removals_adjust_quantity(receipt) -> None:
+    """ Test that removing a weight takes it off the item's quantity, and
+        that an item with nothing left is not priced.
+    """
+    receipt.add_scan("BANANAS DELMONTE", 0.1)
+    receipt.add_scan("BANANAS DELMONTE", 0.2)
+    receipt.remove("BANANAS DELMONTE", 0.1)
+    assert receipt.line("BANANAS DELMONTE")[0] == pytest.approx(0.2)
+    receipt.remove("BANANAS DELMONTE", 0.2)
+    assert receipt.line("BANANAS DELMONTE") == (0, Decimal('0.00'))
+    assert receipt.total() == Decimal('0.00')
+
+
+def test_removed_items_leave_no_entry(receipt) -> None:
+    """ Test that items whose scans are all removed, or that were never
+        scanned, do not stay on the receipt.
+    """
+    receipt += "BIB LETTUCE HDRP"
+    receipt.remove_last("BIB LETTUCE HDRP")
+    receipt.remove_last("CAMP SOUP 10.75z")
+    receipt.remove("PROGRESSO TRADI", 2)
+    assert len(receipt.purchases) == 0
+    assert receipt.total() == Decimal('0.00')
+
+
+def test_restore_void(receipt) -> None:
+    """ Test that voided scans can be put back, most recent void first. """
+    receipt.add_scan("COKE CLASIC 1.Ol", 2)
+    receipt.add_scan("COKE CLASIC 1.Ol", 3)
+    receipt.add_scan("BANANAS DELMONTE", 3.5)
+    receipt.remove("COKE CLASIC 1.Ol", 4)
+    receipt.remove_last("BANANAS DELMONTE")
+    assert receipt.total() == Decimal('1.29')
+    assert receipt.restore_void() == receipt.pos.scan("BANANAS DELMONTE")
+    assert receipt.total() == Decimal('1.99')
+    receipt.restore_void()
+    assert list(receipt.purchases.values()) == [[2, 3], [3.5]]
+    # four full price and one half price coke plus the bananas
+    assert receipt.total() == Decimal('5.81') + Decimal('0.70')
+    assert receipt.restore_void() is None
+
+
+def test_ledger_void_history() -> None:
+    """ Test the void records kept by the scan ledger. """
+    ledger = ScanLedger()
+    for qty in (1, 2, 3):
+        ledger.add("SOUP", qty)
+    assert ledger.void("SOUP", 4) == 4
+    assert ledger["SOUP"] == [1, 1]
+    assert ledger.voids[-1] == ("SOUP", [3], 1)
+    assert ledger.void("SOUP", 10) == 2
+    assert "SOUP" not in ledger
+    ledger.restore()
+    ledger.restore()
+    assert ledger["SOUP"] == [1, 2, 3]
+    assert ledger.voids == []
+
+
+def test_same_specials_on_different_items() -> None:
+    """ Test that items with the same price and special are priced, voided
+        and restored as separate lines.
+    """
+    bogo = StockType(1.99, SaleType.EACH,
+                     StockType.conditional_percent_off(1, 1, 100))
+    receipt = Receipt(POS({"A": bogo, "B": bogo._replace()}))
+    receipt += "A"
+    receipt += "B"
+    assert receipt.total() == Decimal('3.98')
+    receipt += "A"
+    assert receipt.total() == Decimal('3.98')
+    receipt.remove_last("A")
+    assert receipt.purchases == {"A": [1], "B": [1]}
+    assert receipt.subtotal("B") == Decimal('1.99')
+    receipt.remove_last("A")
+    receipt.remove_last("A")
+    assert receipt.purchases == {"B": [1]}
+    assert receipt.restore_void() == bogo
+    assert receipt.purchases == {"B": [1], "A": [1]}
+    assert receipt.total() == Decimal('3.98')
+
+
+def test_standard_method_form() -> None:
+    """ Test that standard is still a method of a StockType as well as a
+        pricing rule.
+    """
+    soup = StockType(1.99, SaleType.EACH, StockType.standard)
+    assert soup.standard(3) == Decimal('5.97')
+    assert soup.pricing(soup, 3) == Decimal('5.97')
+    assert StockType.standard(soup, 3) == Decimal('5.97')
+
+
+def test_pricing_rules_compare_by_value() -> None:
+    """ Test that specials made with the same parameters are equal and
+        hash alike, and that they cannot be changed.
+    """
+    assert StockType.cents_off(.25, limit=6) == StockType.cents_off(.25, 6)
+    assert StockType.cents_off(.25) != StockType.cents_off(.25, limit=6)
+    assert (hash(StockType.conditional_percent_off(2, 1, 50)) ==
+            hash(StockType.conditional_percent_off(2, 1, 50)))
+    assert len({StockType(1.29, SaleType.EACH,
+                          StockType.conditional_percent_off(2, 1, 50)),
+                StockType(1.29, SaleType.EACH,
+                          StockType.conditional_percent_off(2, 1, 50))}) == 1
+    with pytest.raises(AttributeError):
+        StockType.cents_off(.25).limit = 2
+
+
+def test_pickle_receipt(receipt) -> None:
+    """ Test that a receipt, with its catalog, survives a pickle round
+        trip and totals the same.
+    """
+    receipt.add_scan("COKE CLASIC 1.Ol", 4)
+    receipt.add_scan("FNCYFST CATFD 3z", 7)
+    receipt.add_scan("BANANAS DELMONTE", 3.5)
+    receipt.remove_last("BANANAS DELMONTE")
+    copy = pickle.loads(pickle.dumps(receipt))
+    assert copy.pos.stock_items == receipt.pos.stock_items
+    assert copy.total() == receipt.total()
+    copy.restore_void()
+    assert copy.total() == receipt.total() + Decimal('0.70')
+
+
+@pytest.fixture
+def fixed_receipt(shop_inventory):
+    """ Provide a new fixed-point receipt for each test """
+    return Receipt(POS(shop_inventory, fixed_point=True))
+
+
+def test_fixed_point_catalog(shop_inventory) -> None:
+    """ Test that a fixed-point POS holds prices and discounts as cents """
+    pos = POS(shop_inventory, fixed_point=True)
+    assert pos.scan("DOZ JNSTN SAUSAG") == StockType(
+        499, SaleType.EACH, FixedCentsOff(45))
+    assert pos.scan("CAMP SOUP 10.75z").pricing == FixedStandard()
+    assert pos.scan("COKE CLASIC 1.Ol").price == 129
+    # converting twice changes nothing
+    assert POS(pos.stock_items, fixed_point=True).stock_items == \
+        pos.stock_items
+    with pytest.raises(NotImplementedError):
+        POS({"HALF CENT": StockType(1.005, SaleType.EACH,
+                                    StockType.standard)}, fixed_point=True)
+    with pytest.raises(NotImplementedError):
+        StockType(1.00, SaleType.EACH,
+                  StockType.conditional_percent_off(1, 1, 33.3)
+                  ).to_fixed_point()
+
+
+@pytest.mark.parametrize("scans", [
+    [("CAMP SOUP 10.75z", 3), ("15%FAT GRD CHUCK", 3.0)],
+    [("15%FAT GRD CHUCK", 0.333), ("15%FAT GRD CHUCK", 1.1)],
+    [("2.0L CANFLD SELZ", 1), ("DOZ JNSTN SAUSAG", 1)],
+    [("BANANAS DELMONTE", 3.5), ("BANANAS DELMONTE", 0.7)],
+    [("BIB LETTUCE HDRP", 3), ("FNCYFST CATFD 3z", 7)],
+    [("ETERNAL WTR 600M", 12), ("PROGRESSO TRADI", 2)],
+    [("A1ALASKAN SALMON", 2.0), ("A1ALASKAN SALMON", 0.75)],
+])
+def test_fixed_point_matches_float(receipt, fixed_receipt, scans) -> None:
+    """ Test that fixed-point totals match the floating point totals """
+    for item_desc, qty in scans:
+        receipt.add_scan(item_desc, qty)
+        fixed_receipt.add_scan(item_desc, qty)
+        assert fixed_receipt.total() == receipt.total()
+        assert (fixed_receipt.subtotal(item_desc) ==
+                receipt.subtotal(item_desc))
+    item_desc, qty = scans[0]
+    receipt.remove(item_desc, qty)
+    fixed_receipt.remove(item_desc, qty)
+    assert fixed_receipt.total() == receipt.total()
+
+
+def test_fixed_point_half_cent(fixed_receipt) -> None:
+    """ Test that a discounted amount of exactly half a cent rounds to
+        the even cent, where the floating point total depends on the
+        binary value of the price.
+    """
+    # three full price and one half price coke: 3.87 + 0.645
+    fixed_receipt.add_scan("COKE CLASIC 1.Ol", 4)
+    assert fixed_receipt.total() == Decimal('4.51')
+    # 1.99 * 0.125 is 0.24875 which standard pricing rounds up
+    fixed_receipt.add_scan("15%FAT GRD CHUCK", 0.125)
+    assert fixed_receipt.subtotal("15%FAT GRD CHUCK") == Decimal('0.25')
+
+
+def test_price_change_pins_open_receipts(shop_inventory) -> None:
+    """ Test that a receipt keeps the catalog version it was opened with
+        while later receipts see the new prices.
+    """
+    pos = POS(shop_inventory)
+    before = Receipt(pos)
+    snapshot = pos.update({
+        "CAMP SOUP 10.75z": StockType(1.49, SaleType.EACH,
+                                      StockType.standard),
+        "NEW ITEM": StockType(0.99, SaleType.EACH, StockType.standard),
+        "PROGRESSO TRADI": None,
+    })
+    assert pos.version == snapshot.version == 1
+    after = Receipt(pos)
+    before += "CAMP SOUP 10.75z"
+    before += "PROGRESSO TRADI"
+    after += "CAMP SOUP 10.75z"
+    after += "NEW ITEM"
+    with pytest.raises(KeyError):
+        after += "PROGRESSO TRADI"
+    with pytest.raises(KeyError):
+        before += "NEW ITEM"
+    assert before.total() == Decimal('1.99')
+    assert after.total() == Decimal('2.48')
+    assert len(before.catalog) == len(shop_inventory)
+    assert len(after.catalog) == len(shop_inventory)
+    assert sorted(after.catalog) == sorted(
+        set(shop_inventory) - {"PROGRESSO TRADI"} | {"NEW ITEM"})
+
+
+def test_snapshots_share_unchanged_shards(shop_inventory) -> None:
+    """ Test that a new version copies only the shards it changes and that
+        old versions are reclaimed once nothing references them.
+    """
+    pos = POS(shop_inventory)
+    first = pos.update({"CAMP SOUP 10.75z": StockType(
+        1.49, SaleType.EACH, StockType.standard)})
+    second = pos.update({"BIB LETTUCE HDRP": StockType(
+        1.79, SaleType.EACH, StockType.standard)})
+    assert second.base is first.base is shop_inventory
+    shared = [old is new for old, new in zip(first._shards, second._shards)]
+    assert shared.count(False) == 1
+    receipt = Receipt(pos)
+    gone = weakref.ref(first)
+    pinned = weakref.ref(second)
+    del first, second
+    pos.update({"NEW ITEM": StockType(0.99, SaleType.EACH,
+                                      StockType.standard)})
+    assert gone() is None
+    assert pinned() is receipt.catalog
+    del receipt
+    assert pinned() is None
+
+
+def test_readers_never_see_partial_updates() -> None:
+    """ Test that a reader on another thread always sees every item of a
+        bulk price change or none of them.
+    """
+    items = [f"ITEM {num}" for num in range(200)]
+    pos = POS({item: StockType(1.00, SaleType.EACH, StockType.standard)
+               for item in items})
+    torn = []
+    done = threading.Event()
+
+    def reader():
+        while not done.is_set():
+            snapshot = pos.snapshot()
+            prices = {pos.scan(item, snapshot).price for item in items}
+            if len(prices) != 1:
+                torn.append(prices)
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    for num in range(2, 60):
+        pos.update({item: StockType(float(num), SaleType.EACH,
+                                    StockType.standard) for item in items})
+    done.set()
+    thread.join()
+    assert torn == []
+    assert pos.scan("ITEM 7").price == 59.0
+
+
+def test_add_scans(receipt) -> None:
+    """ Test that a batch of pairs and Scans adds the same scans as adding
+        them one at a time.
+    """
+    receipt.add_scans([("COKE CLASIC 1.Ol", 2),
+                       Scan("BANANAS DELMONTE", [1.5, 2.0]),
+                       ("COKE CLASIC 1.Ol", 2),
+                       Scan("CAMP SOUP 10.75z")])
+    assert receipt.purchases == {
+        "COKE CLASIC 1.Ol": [2, 2],
+        "BANANAS DELMONTE": [1.5, 2.0],
+    }
+    assert receipt.total() == Decimal('4.52') + Decimal('0.70')
+
+
+def test_add_scans_is_all_or_nothing(receipt) -> None:
+    """ Test that a batch with bad scans adds nothing and reports every bad
+        scan, and that the error is caught as either error add_scan raises.
+    """
+    receipt += "CAMP SOUP 10.75z"
+    batch = [("COKE CLASIC 1.Ol", 3),
+             ("NOT STOCKED", 1),
+             ("CAMP SOUP 10.75z", 1.5),
+             Scan("BANANAS DELMONTE", [1.0, 2]),
+             ("NOT STOCKED EITHER", 1)]
+    with pytest.raises(ScansRejected) as rejected:
+        receipt.add_scans(batch)
+    assert [position for position, _ in rejected.value.errors] == \
+        [1, 2, 3, 4]
+    assert [type(err) for _, err in rejected.value.errors] == \
+        [KeyError, NotImplementedError, NotImplementedError, KeyError]
+    assert list(receipt.purchases.values()) == [[1]]
+    assert receipt.total() == Decimal('1.99')
+    with pytest.raises(KeyError):
+        receipt.add_scans([("NOT STOCKED", 1)])
+    with pytest.raises(NotImplementedError):
+        receipt.add_scans([("CAMP SOUP 10.75z", 1.5)])
+
+
+@pytest.mark.parametrize('fixed_point', [False, True])
+def test_price_cache(shop_inventory, fixed_point) -> None:
+    """ Test that cached prices match uncached ones, that only items sold
+        by count are cached and that a price change drops an item's prices
+    """
+    cache = PriceCache(max_size=3)
+    pos = POS(shop_inventory, fixed_point, price_cache=cache)
+    plain = POS(shop_inventory, fixed_point)
+    for _ in range(2):
+        cached_receipt, plain_receipt = Receipt(pos), Receipt(plain)
+        for receipt in (cached_receipt, plain_receipt):
+            receipt.add_scan("COKE CLASIC 1.Ol", 3)
+            receipt.add_scan("FNCYFST CATFD 3z", 2)
+            receipt.add_scan("BANANAS DELMONTE", 1.5)
+        assert cached_receipt.total() == plain_receipt.total()
+    # weighed items are not cached
+    assert (cache.misses, cache.hits, len(cache)) == (2, 2, 2)
+    receipt = Receipt(pos)
+    receipt.add_scans([("DOZ JNSTN SAUSAG", 1), ("ETERNAL WTR 600M", 2)])
+    receipt.total()
+    assert (cache.evictions, len(cache)) == (1, 3)
+    # a price change drops the old prices of the item
+    pos.update({"DOZ JNSTN SAUSAG": StockType(5.50, SaleType.EACH,
+                                              StockType.cents_off(.45))})
+    assert len(cache) == 2
+    receipt = Receipt(pos)
+    receipt += "DOZ JNSTN SAUSAG"
+    assert receipt.total() == Decimal('5.05')
+    assert pickle.loads(pickle.dumps(pos)).price_cache.hits == 0
+
+
+@pytest.mark.parametrize('stock', [
+    StockType(1.29, SaleType.EACH, StockType.standard),
+    StockType(1.29, SaleType.EACH,
+              StockType.conditional_percent_off(2, 1, 50)),
+    StockType(129, SaleType.EACH,
+              StockType.conditional_percent_off(2, 1, 50).fixed())])
+def test_price_cache_hit_is_faster(stock) -> None:
+    """ Test that a price found in the cache is quicker than working it out,
+        taking the best of many short runs of each, in turns, to steady
+        the timings
+    """
+    cache = PriceCache()
+    cache.price(stock, 3)
+    priced = cached = float('inf')
+    for _ in range(30):
+        priced = min(priced, timeit.timeit(lambda: stock.pricing(stock, 3),
+                                           number=500))
+        cached = min(cached, timeit.timeit(lambda: cache.price(stock, 3),
+                                           number=500))
+    assert cache.misses == 1
+    assert cached < priced
+    # a rule quicker to work out than to look up is not cached
+    fixed = StockType(129, SaleType.EACH, FixedStandard())
+    cache.price(fixed, 3)
+    assert (cache.misses, len(cache)) == (1, 1)
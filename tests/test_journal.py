@@ -0,0 +1,154 @@
+""" Test the binary receipt journal and its crash recovery """
+import os
+from decimal import Decimal
+import pytest
+from ..receipts import POS, StockType, SaleType, Receipt
+from ..journal import ReceiptJournal, HEADER, RECORD, ADD
+
+
+@pytest.fixture(scope='module')
+def pos() -> POS:
+    return POS({
+        "CAMP SOUP 10.75z": StockType(1.99, SaleType.EACH, StockType.standard),
+        "BANANAS DELMONTE": StockType(0.28, SaleType.BY_WT,
+                                      StockType.cents_off(.08)),
+        "COKE CLASIC 1.Ol": StockType(1.29, SaleType.EACH,
+                                      StockType.conditional_percent_off(
+                                          min_items=2, disc_items=1,
+                                          pct_off=50)),
+        "JALAPEÑO": StockType(2.49, SaleType.BY_WT, StockType.standard),
+    }, fixed_point=True)
+
+
+def fill(pos: POS, journal: ReceiptJournal) -> list:
+    "three journaled receipts, the second of them closed"
+    receipts = [Receipt(pos) for _ in range(3)]
+    for receipt in receipts:
+        journal.attach(receipt)
+    first, second, third = receipts
+    first += "CAMP SOUP 10.75z"
+    first.add_scans([("COKE CLASIC 1.Ol", 3), ("BANANAS DELMONTE", 1.5)])
+    first.remove("COKE CLASIC 1.Ol", 1)
+    first.remove_last("CAMP SOUP 10.75z")
+    first.restore_void()
+    second.add_scan("JALAPEÑO", 0.25)
+    assert journal.close_receipt(second) == Decimal('0.63')
+    third.add_scan("JALAPEÑO", 0.5)
+    third.remove_last("CAMP SOUP 10.75z")  # nothing to remove
+    return receipts
+
+
+def test_recover_open_receipts(pos, tmp_path) -> None:
+    """ Test that receipts still open when a lane stops are rebuilt from the
+        journal, and closed ones are not.
+    """
+    path = str(tmp_path / 'lane.jnl')
+    journal = ReceiptJournal(path, sync_every=1)
+    first, _, third = fill(pos, journal)
+    # the process dies without closing the journal
+    recovered = ReceiptJournal(path).recover(pos)
+    assert sorted(recovered) == [first.txn, third.txn]
+    for receipt in (first, third):
+        again = recovered[receipt.txn]
+        assert again.total() == receipt.total()
+        assert again.purchases == receipt.purchases
+        assert again.purchases.voids == receipt.purchases.voids
+
+
+def test_batched_sync_and_torn_record(pos, tmp_path) -> None:
+    """ Test that a record torn by a crash is dropped and the journal goes on
+        after it.
+    """
+    path = str(tmp_path / 'lane.jnl')
+    journal = ReceiptJournal(path, sync_every=64)
+    first, _, third = fill(pos, journal)
+    # nothing past the header is written until a batch is full
+    assert os.path.getsize(path) == HEADER.size
+    journal.sync()
+    synced = os.path.getsize(path)
+    with open(path, 'ab') as torn:
+        torn.write(RECORD.pack(2, 0, 0, 0, first.txn, 1, 0.0)[:20])
+    reopened = ReceiptJournal(path)
+    assert os.path.getsize(path) == synced
+    recovered = reopened.recover(pos)
+    assert recovered[first.txn].total() == first.total()
+    # the reopened journal carries on with new ids and the same item ids
+    receipt = recovered[third.txn]
+    receipt += "CAMP SOUP 10.75z"
+    new = Receipt(pos)
+    assert reopened.attach(new) == third.txn + 1
+    new += "CAMP SOUP 10.75z"
+    reopened.close()
+    recovered = ReceiptJournal(path).recover(pos)
+    assert recovered[third.txn].total() == receipt.total()
+    assert recovered[new.txn].total() == Decimal('1.99')
+
+
+def test_compaction(pos, tmp_path) -> None:
+    """ Test that compaction keeps only the records of open receipts. """
+    path = str(tmp_path / 'lane.jnl')
+    journal = ReceiptJournal(path)
+    first, _, third = fill(pos, journal)
+    journal.close_receipt(third)
+    journal.sync()
+    before = os.path.getsize(path)
+    journal.compact()
+    assert os.path.getsize(path) < before
+    first += "CAMP SOUP 10.75z"
+    journal.close()
+    recovered = ReceiptJournal(path).recover(pos)
+    assert list(recovered) == [first.txn]
+    assert recovered[first.txn].total() == first.total()
+
+
+def test_skips_what_cannot_be_applied(pos, tmp_path) -> None:
+    """ Test that records that no longer apply to the catalog are skipped on
+        recovery.
+    """
+    path = str(tmp_path / 'lane.jnl')
+    with ReceiptJournal(path) as journal:
+        receipt = Receipt(pos)
+        journal.attach(receipt)
+        receipt += "CAMP SOUP 10.75z"
+        receipt += "COKE CLASIC 1.Ol"
+    smaller = POS({"COKE CLASIC 1.Ol": pos.scan("COKE CLASIC 1.Ol")},
+                  fixed_point=True)
+    journal = ReceiptJournal(path)
+    [recovered] = journal.recover(smaller).values()
+    assert journal.skipped == 1
+    assert recovered.total() == Decimal('1.29')
+
+
+def test_batch_journaled_once_in_order(tmp_path) -> None:
+    """ Test that a batch of scans of items priced alike is journaled one
+        record per scan, in the order of the batch.
+    """
+    pos = POS({"A": StockType(1.00, SaleType.EACH, StockType.standard),
+               "B": StockType(1.00, SaleType.EACH, StockType.standard)})
+    path = str(tmp_path / 'lane.jnl')
+    with ReceiptJournal(path) as journal:
+        receipt = Receipt(pos)
+        journal.attach(receipt)
+        receipt.add_scans([("A", 1), ("B", 2), ("A", 3)])
+        assert receipt.total() == Decimal('6.00')
+    journal = ReceiptJournal(path)
+    assert [ops for ops in journal._open.values()] == [
+        [(ADD, 0, 1), (ADD, 1, 2), (ADD, 0, 3)]]
+    [recovered] = journal.recover(pos).values()
+    assert recovered.purchases == receipt.purchases
+    assert recovered.total() == Decimal('6.00')
+
+
+def test_header_torn_on_creation(pos, tmp_path) -> None:
+    """ Test that a journal whose header was cut short when it was made is
+        started again rather than left unreadable.
+    """
+    path = str(tmp_path / 'lane.jnl')
+    with open(path, 'wb') as torn:
+        torn.write(HEADER.pack(b'GSKJRNL\0', 1)[:10])
+    with ReceiptJournal(path) as journal:
+        receipt = Receipt(pos)
+        journal.attach(receipt)
+        receipt += "CAMP SOUP 10.75z"
+    [recovered] = ReceiptJournal(path).recover(pos).values()
+    assert recovered.total() == Decimal('1.99')
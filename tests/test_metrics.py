@@ -0,0 +1,103 @@
+""" Test the opt-in instrumentation and its Prometheus export """
+from decimal import Decimal
+import pytest
+from ..receipts import POS, StockType, SaleType, Receipt, CentsOff
+from ..metrics import Metrics, enable, disable, instrumented
+
+
+@pytest.fixture
+def pos() -> POS:
+    return POS({
+        "CAMP SOUP 10.75z": StockType(1.99, SaleType.EACH, StockType.standard),
+        "BANANAS DELMONTE": StockType(0.28, SaleType.BY_WT,
+                                      StockType.cents_off(.08)),
+    })
+
+
+def test_counts_by_op_rule_and_sku(pos) -> None:
+    """ Test the calls counted by operation, kind of rule and item code,
+        and their export
+    """
+    with instrumented(Metrics(top_n=1)) as metrics:
+        receipt = Receipt(pos)
+        receipt += "CAMP SOUP 10.75z"
+        receipt.add_scan("BANANAS DELMONTE", 2.0)
+        assert receipt.total() == Decimal('2.39')
+        receipt.remove("BANANAS DELMONTE", 1.0)
+        receipt.remove_last("CAMP SOUP 10.75z")
+        assert receipt.total() == Decimal('0.20')
+    counts = {op: histogram.count for op, histogram in metrics.ops.items()}
+    # removals use the StockType the receipt already looked up
+    assert counts == {'pos_scan': 2, 'check_qty': 2, 'price': 3,
+                      'receipt_total': 2, 'receipt_remove': 1,
+                      'receipt_remove_last': 1}
+    assert {rule: histogram.count
+            for rule, histogram in metrics.rules.items()} == {
+                'Standard': 1, 'CentsOff': 2}
+    # a scan, a remove and two prices of the bananas, checks are not put
+    # down to an item
+    assert metrics.skus["BANANAS DELMONTE"][0] == 4
+    assert metrics.skus["CAMP SOUP 10.75z"][0] == 3
+    text = metrics.prometheus()
+    assert 'receipt_op_seconds_count{op="pos_scan"} 2\n' in text
+    assert 'receipt_rule_seconds_bucket{rule="CentsOff",le="+Inf"} 2\n' \
+        in text
+    # only the item with the most time is exported
+    [(sku, calls, _)] = metrics.heaviest()
+    assert f'receipt_sku_calls_total{{sku="{sku}"}} {calls}\n' in text
+    assert text.count('receipt_sku_calls_total{') == 1
+
+
+def test_same_specials_on_different_items() -> None:
+    """ Test that the pricing of items with the same price and special is
+        put down to the item each receipt prices
+    """
+    pos = POS({item: StockType(1.99, SaleType.EACH, StockType.standard)
+               for item in ("SOUP", "CHILI")})
+    with instrumented() as metrics:
+        soup = Receipt(pos)
+        soup += "SOUP"
+        chili = Receipt(pos)
+        chili.add_scan("CHILI", 2)
+        soup.total()
+        chili.total()
+    # a scan and a price of each
+    assert metrics.skus["SOUP"][0] == metrics.skus["CHILI"][0] == 2
+
+
+def test_disabled_is_untouched(pos) -> None:
+    """ Test that disable() puts back every method that was wrapped """
+    originals = (POS.scan, StockType.check_qty, Receipt.total,
+                 CentsOff.__call__)
+    metrics = Metrics()
+    enable(metrics)
+    try:
+        assert POS.scan is not originals[0]
+        with pytest.raises(RuntimeError):
+            enable(metrics)
+    finally:
+        disable()
+    assert (POS.scan, StockType.check_qty, Receipt.total,
+            CentsOff.__call__) == originals
+    receipt = Receipt(pos)
+    receipt += "CAMP SOUP 10.75z"
+    receipt.total()
+    assert metrics.ops == {}
+
+
+def test_dump_and_publish(pos, tmp_path) -> None:
+    """ Test that a snapshot is written whole to a file and passed to a
+        callback
+    """
+    path = tmp_path / 'receipts.prom'
+    published = []
+    with instrumented() as metrics:
+        receipt = Receipt(pos)
+        receipt += "CAMP SOUP 10.75z"
+        receipt.total()
+        metrics.dump(str(path))
+        metrics.publish(published.append)
+    assert path.read_text() == published[0] == metrics.prometheus()
+    assert list(tmp_path.iterdir()) == [path]
+    metrics.reset()
+    assert 'op="pos_scan"' not in metrics.prometheus()
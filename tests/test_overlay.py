@@ -0,0 +1,120 @@
+""" Test per-store overlays of a shared base catalog """
+import pickle
+from decimal import Decimal
+from typing import Dict
+import pytest
+from ..receipts import POS, StockType, SaleType, Receipt
+from ..catalog import compile_catalog, MappedCatalog
+from ..overlay import StoreOverlay
+
+
+@pytest.fixture(scope='module')
+def base() -> Dict[str, StockType]:
+    "the chain's catalog"
+    return {
+        "CAMP SOUP 10.75z": StockType(1.99, SaleType.EACH, StockType.standard),
+        "BANANAS DELMONTE": StockType(0.28, SaleType.BY_WT,
+                                      StockType.cents_off(.08)),
+        "ETERNAL WTR 600M": StockType(1.00, SaleType.EACH,
+                                      StockType.conditional_percent_off(
+                                          min_items=1, disc_items=1,
+                                          pct_off=100, limit=6)),
+        "KALE BUNCH": StockType(2.00, SaleType.EACH, StockType.standard),
+    }
+
+
+def test_overrides(base) -> None:
+    """ Test each kind of override and new items over the base catalog """
+    pool: Dict[StockType, StockType] = {}
+    store = StoreOverlay(
+        base, prices={"CAMP SOUP 10.75z": 1.49},
+        how_sold={"KALE BUNCH": SaleType.BY_WT},
+        pricing={"ETERNAL WTR 600M": StockType.standard},
+        items={"LOCAL HONEY": StockType(8.00, SaleType.EACH,
+                                        StockType.standard)},
+        pool=pool)
+    assert store["CAMP SOUP 10.75z"] == \
+        StockType(1.49, SaleType.EACH, StockType.standard)
+    assert store["KALE BUNCH"].how_sold == SaleType.BY_WT
+    assert store["ETERNAL WTR 600M"] == \
+        StockType(1.00, SaleType.EACH, StockType.standard)
+    # items that are not overridden are the base's own
+    assert store["BANANAS DELMONTE"] is base["BANANAS DELMONTE"]
+    assert store.overrides() == 4
+    assert len(store) == 5
+    assert set(store) == set(base) | {"LOCAL HONEY"}
+    with pytest.raises(KeyError):
+        store["NOT STOCKED"]
+    # the resolved item is kept
+    assert store["CAMP SOUP 10.75z"] is store["CAMP SOUP 10.75z"]
+    assert len(pool) == 3
+
+
+def test_stores_share_base_and_pool(base) -> None:
+    """ Test that stores share the base catalog and equal overridden items """
+    pool: Dict[StockType, StockType] = {}
+    stores = [StoreOverlay(base, prices={"CAMP SOUP 10.75z": 1.49}, pool=pool)
+              for _ in range(3)]
+    stores.append(StoreOverlay(base, prices={"KALE BUNCH": 1.50}, pool=pool))
+    souped = [store["CAMP SOUP 10.75z"] for store in stores]
+    assert souped[0] is souped[1] is souped[2]
+    assert souped[3] is base["CAMP SOUP 10.75z"]
+    assert stores[3]["KALE BUNCH"].price == 1.50
+    assert all(store.base is base for store in stores)
+    assert len(pool) == 2
+
+
+def test_receipts(base) -> None:
+    """ Test receipts on a store's catalog and updates to it """
+    store = StoreOverlay(base, prices={"CAMP SOUP 10.75z": 1.00},
+                         pricing={"KALE BUNCH": StockType.cents_off(.50)})
+    pos = POS(store)
+    assert pos.snapshot().base is store
+    receipt = Receipt(pos)
+    receipt.add_scans([("CAMP SOUP 10.75z", 3), ("KALE BUNCH", 2),
+                       ("ETERNAL WTR 600M", 2)])
+    # 3 soups at 1.00, kale 1.50 each and a pair of water, one free
+    assert receipt.total() == Decimal('7.00')
+    # the chain's prices are unchanged
+    chain = Receipt(POS(base))
+    chain.add_scans([("CAMP SOUP 10.75z", 3), ("KALE BUNCH", 2)])
+    assert chain.total() == Decimal('9.97')
+    # a store's catalog can be updated like any other
+    pos.update({"KALE BUNCH": None})
+    with pytest.raises(KeyError):
+        pos.scan("KALE BUNCH")
+    assert "KALE BUNCH" in store
+
+
+def test_fixed_point_base(base, tmp_path) -> None:
+    """ Test that overrides of a fixed-point base are converted to fixed
+        point, and the store's catalog is used by a fixed-point POS as it
+        is.
+    """
+    path = str(tmp_path / 'fixed.cat')
+    compile_catalog(POS(base, fixed_point=True).stock_items, path)
+    with MappedCatalog(path) as catalog:
+        store = StoreOverlay(
+            catalog, prices={"CAMP SOUP 10.75z": 1.49},
+            pricing={"KALE BUNCH": StockType.cents_off(.25)},
+            items={"LOCAL HONEY": StockType(8.00, SaleType.EACH,
+                                            StockType.standard)})
+        assert store.fixed_point
+        assert store["CAMP SOUP 10.75z"] == \
+            StockType(1.49, SaleType.EACH, StockType.standard).to_fixed_point()
+        pos = POS(store, fixed_point=True)
+        assert pos.snapshot().base is store
+        receipt = Receipt(pos)
+        receipt.add_scans([("CAMP SOUP 10.75z", 2), ("KALE BUNCH", 1),
+                           ("LOCAL HONEY", 1), ("BANANAS DELMONTE", 3.5)])
+        assert receipt.total() == Decimal('13.43')
+
+
+def test_pickle(base) -> None:
+    """ Test that a pickled store resolves the same items with a new pool """
+    pool: Dict[StockType, StockType] = {}
+    store = StoreOverlay(base, prices={"CAMP SOUP 10.75z": 1.49}, pool=pool)
+    store["CAMP SOUP 10.75z"]
+    copy = pickle.loads(pickle.dumps(store))
+    assert dict(copy) == dict(store)
+    assert copy.pool is not pool
@@ -0,0 +1,278 @@
+""" Test promotions across several items """
+from decimal import Decimal
+from typing import Dict
+import pytest
+from ..receipts import POS, StockType, SaleType, Receipt, Scan
+from ..promotions import (MixAndMatch, BuyGetPercentOff, PromotionIndex,
+                          PromotionReceipt, AssignmentSolver)
+
+
+@pytest.fixture(scope='module')
+def stock_items() -> Dict[str, StockType]:
+    "a dairy case and a snack aisle"
+    return {
+        "YOGURT STRAWBRY": StockType(1.99, SaleType.EACH, StockType.standard),
+        "YOGURT PLAIN": StockType(1.49, SaleType.EACH, StockType.standard),
+        "YOGURT GREEK": StockType(2.29, SaleType.EACH,
+                                  StockType.cents_off(.20)),
+        "CHIPS TORTILLA": StockType(3.49, SaleType.EACH, StockType.standard),
+        "SALSA MILD": StockType(2.99, SaleType.EACH, StockType.standard),
+        "SALSA HOT": StockType(3.29, SaleType.EACH, StockType.standard),
+        "BANANAS DELMONTE": StockType(0.28, SaleType.BY_WT,
+                                      StockType.cents_off(.08)),
+    }
+
+
+@pytest.fixture(scope='module')
+def promotions() -> PromotionIndex:
+    return PromotionIndex([
+        MixAndMatch("3 YOGURTS $5", ["YOGURT STRAWBRY", "YOGURT PLAIN",
+                                     "YOGURT GREEK"], qty=3, price=5.00),
+        BuyGetPercentOff("CHIPS AND SALSA", ["CHIPS TORTILLA"],
+                         ["SALSA MILD", "SALSA HOT"], pct_off=50),
+    ])
+
+
+@pytest.mark.parametrize('fixed_point', [False, True])
+def test_mix_and_match(stock_items, promotions, fixed_point) -> None:
+    """ Test any qty of several items for a price """
+    pos = POS(stock_items, fixed_point)
+    receipt = PromotionReceipt(pos, promotions)
+    receipt += "YOGURT STRAWBRY"
+    receipt += "YOGURT PLAIN"
+    assert receipt.total() == Decimal('3.48')
+    assert receipt.discounts() == {}
+    receipt += "YOGURT GREEK"
+    # 1.99 + 1.49 + 2.09 = 5.57, the deal takes off .57
+    assert receipt.discounts() == {"3 YOGURTS $5": Decimal('0.57')}
+    assert receipt.total() == Decimal('5.00')
+    receipt.add_scan("YOGURT PLAIN", 2)
+    # the highest priced three make the deal, two plain are left over
+    assert receipt.total() == Decimal('7.98')
+    receipt.remove("YOGURT PLAIN", 2)
+    assert receipt.total() == Decimal('5.00')
+    receipt.remove_last("YOGURT GREEK")
+    assert receipt.total() == Decimal('3.48')
+    assert receipt.restore_void() is not None
+    assert receipt.total() == Decimal('5.00')
+
+
+def test_buy_get_percent_off(stock_items, promotions) -> None:
+    """ Test buy one item, get another a percentage off """
+    receipt = PromotionReceipt(POS(stock_items, fixed_point=True), promotions)
+    receipt.add_scans([("SALSA MILD", 1), ("SALSA HOT", 1)])
+    assert receipt.total() == Decimal('6.28')
+    receipt += "CHIPS TORTILLA"
+    # the hot salsa is the higher priced, half off 3.29 is 1.645
+    assert receipt.discounts() == {"CHIPS AND SALSA": Decimal('1.64')}
+    assert receipt.total() == Decimal('8.13')
+    receipt.add_scans([Scan("CHIPS TORTILLA", [1]), ("BANANAS DELMONTE", 1.0)])
+    assert receipt.total() == Decimal('10.32')
+    receipt.remove_last("CHIPS TORTILLA")
+    receipt.remove_last("CHIPS TORTILLA")
+    assert receipt.discounts() == {}
+    assert receipt.total() == Decimal('6.48')
+
+
+def test_limits() -> None:
+    """ Test that promotion limits cap the number of deals """
+    stock_items = {
+        "A": StockType(1.00, SaleType.EACH, StockType.standard),
+        "B": StockType(2.00, SaleType.EACH, StockType.standard),
+    }
+    promotions = PromotionIndex([
+        MixAndMatch("2 FOR 1", ["A"], qty=2, price=1.00, limit=5),
+        BuyGetPercentOff("B FREE", ["A"], ["B"], pct_off=100, limit=2),
+    ])
+    receipt = PromotionReceipt(POS(stock_items), promotions)
+    receipt.add_scan("A", 8)
+    receipt.add_scan("B", 3)
+    # the limit of 5 allows 2 deals of 2, and of 2 allows 1 buy one get one
+    assert receipt.discounts() == {"2 FOR 1": Decimal('2.00'),
+                                   "B FREE": Decimal('2.00')}
+    assert receipt.total() == Decimal('10.00')
+
+
+def test_only_touched_promotions_evaluated(stock_items, promotions,
+                                           monkeypatch) -> None:
+    """ Test that a total only evaluates the promotions of items that
+        changed
+    """
+    receipt = PromotionReceipt(POS(stock_items), promotions)
+    receipt += "YOGURT PLAIN"
+    receipt += "SALSA MILD"
+    receipt.total()
+    evaluated = []
+    for promotion in (promotions["YOGURT PLAIN"][0],
+                      promotions["SALSA MILD"][0]):
+        original = type(promotion).discount
+        monkeypatch.setattr(type(promotion), 'discount',
+                            lambda self, units, original=original:
+                            evaluated.append(self.name) or
+                            original(self, units))
+    receipt += "YOGURT GREEK"
+    receipt.total()
+    assert evaluated == ["3 YOGURTS $5"]
+    receipt.total()
+    assert evaluated == ["3 YOGURTS $5"]
+
+
+def test_same_as_receipt_without_promotions(stock_items) -> None:
+    """ Test that a receipt without promotions totals as a Receipt does """
+    plain = Receipt(POS(stock_items))
+    promoted = PromotionReceipt(POS(stock_items), PromotionIndex())
+    for receipt in (plain, promoted):
+        receipt.add_scans([("YOGURT GREEK", 3), ("BANANAS DELMONTE", 2.5)])
+        receipt.remove("YOGURT GREEK", 1)
+    assert promoted.total() == plain.total()
+
+
+def test_bad_promotions() -> None:
+    """ Test the ways creation of a promotion may fail """
+    with pytest.raises(NotImplementedError):
+        MixAndMatch("NONE", ["A"], qty=0, price=1.00)
+    with pytest.raises(NotImplementedError):
+        MixAndMatch("NEGATIVE", ["A"], qty=2, price=-1.00)
+    with pytest.raises(NotImplementedError):
+        MixAndMatch("LIMIT", ["A"], qty=3, price=1.00, limit=2)
+    with pytest.raises(NotImplementedError):
+        BuyGetPercentOff("BOTH", ["A"], ["A", "B"], pct_off=50)
+    with pytest.raises(NotImplementedError):
+        BuyGetPercentOff("PCT", ["A"], ["B"], pct_off=110)
+    with pytest.raises(NotImplementedError):
+        BuyGetPercentOff("LIMIT", ["A"], ["B"], pct_off=50, limit=1)
+
+
+@pytest.fixture
+def competing(stock_items) -> PromotionIndex:
+    "two mix and match deals that both want the greek yogurt"
+    return PromotionIndex([
+        MixAndMatch("3 YOGURTS $5", ["YOGURT STRAWBRY", "YOGURT PLAIN",
+                                     "YOGURT GREEK"], qty=3, price=5.00),
+        MixAndMatch("2 GREEK $3.50", ["YOGURT GREEK"], qty=2, price=3.50),
+    ])
+
+
+def test_solver_picks_best_for_customer(stock_items, competing) -> None:
+    """ Test that each unit counts toward at most one promotion, and that
+        the solver finds the cheapest assignment for the customer
+    """
+    pos = POS(stock_items, fixed_point=True)
+    greedy = PromotionReceipt(pos, competing)
+    solved = PromotionReceipt(pos, competing, AssignmentSolver())
+    for receipt in (greedy, solved):
+        receipt.add_scans([("YOGURT GREEK", 3), ("YOGURT STRAWBRY", 1)])
+    # three greek yogurts for $5 and the strawberry at 1.99, the larger
+    # deal takes the greek yogurts and the other has none left
+    assert greedy.discounts() == {"3 YOGURTS $5": Decimal('1.27')}
+    assert greedy.total() == Decimal('6.99')
+    assert solved.total() == Decimal('6.99')
+    # a discount is what the deal saves against the units' own specials
+    assert solved.discounts() == {"3 YOGURTS $5": Decimal('1.27')}
+    [assignment] = solved.assignments()
+    assert assignment.optimal and assignment.gap == 0
+    assert assignment.units == {competing["YOGURT PLAIN"][0]:
+                                {"YOGURT GREEK": 3}}
+    greedy += "YOGURT GREEK"
+    solved += "YOGURT GREEK"
+    # two deals of two greek take all four, a unit is never in both deals
+    assert greedy.discounts() == {"2 GREEK $3.50": Decimal('1.36')}
+    assert greedy.total() == Decimal('8.99')
+    # two greek and the strawberry for $5 and two greek for $3.50
+    assert solved.discounts() == {"3 YOGURTS $5": Decimal('1.17'),
+                                  "2 GREEK $3.50": Decimal('0.68')}
+    assert solved.total() == Decimal('8.50')
+    [assignment] = solved.assignments()
+    assert sum(assignment.discounts.values()) == assignment.savings
+    solved.remove("YOGURT GREEK", 4)
+    assert solved.discounts() == {}
+    [assignment] = solved.assignments()
+    assert assignment.units == {} and assignment.savings == 0
+    assert solved.total() == Decimal('1.99')
+
+
+def test_solver_own_special_kept() -> None:
+    """ Test that a unit is not given to a deal that costs more than its
+        own special
+    """
+    stock_items = {
+        "WATER": StockType(1.00, SaleType.EACH,
+                           StockType.conditional_percent_off(
+                               min_items=1, disc_items=1, pct_off=100)),
+        "JUICE": StockType(2.00, SaleType.EACH, StockType.standard),
+    }
+    promotions = PromotionIndex([
+        MixAndMatch("2 DRINKS $2.50", ["WATER", "JUICE"], qty=2,
+                    price=2.50)])
+    receipt = PromotionReceipt(POS(stock_items), promotions,
+                               AssignmentSolver())
+    receipt.add_scan("WATER", 2)
+    assert receipt.total() == Decimal('1.00')
+    receipt += "JUICE"
+    # the water is free as a pair, the juice pays full price
+    assert receipt.total() == Decimal('3.00')
+    receipt += "JUICE"
+    assert receipt.total() == Decimal('3.50')
+
+
+def test_solver_time_budget(stock_items, competing) -> None:
+    """ Test the greedy assignment used when the time budget runs out """
+    receipt = PromotionReceipt(POS(stock_items, fixed_point=True), competing,
+                               AssignmentSolver(time_budget=0))
+    receipt.add_scans([("YOGURT GREEK", 3), ("YOGURT STRAWBRY", 1)])
+    [assignment] = receipt.assignments()
+    assert not assignment.optimal
+    # greedy gives the greek yogurts to the larger discount, which is best
+    assert receipt.total() == Decimal('6.99')
+    # at most both deals' discounts with every unit, 1.87 and 1.08, could
+    # be taken off the 8.26 the units cost under their own specials
+    assert assignment.gap == Decimal('1.68')
+
+
+def test_solver_finishes_basket() -> None:
+    """ Test that the default time budget solves a basket of 10 items, 27
+        units and 6 promotions that share them
+    """
+    stock_items = {
+        "YOGURT STRAWBRY": StockType(1.99, SaleType.EACH, StockType.standard),
+        "YOGURT PLAIN": StockType(1.49, SaleType.EACH, StockType.standard),
+        "YOGURT GREEK": StockType(2.29, SaleType.EACH,
+                                  StockType.cents_off(.20)),
+        "CHIPS TORTILLA": StockType(3.49, SaleType.EACH, StockType.standard),
+        "SALSA MILD": StockType(2.99, SaleType.EACH, StockType.standard),
+        "SALSA HOT": StockType(3.29, SaleType.EACH,
+                               StockType.conditional_percent_off(
+                                   min_items=2, disc_items=1, pct_off=50)),
+        "LIMES": StockType(0.99, SaleType.EACH, StockType.standard),
+        "GUACAMOLE": StockType(4.49, SaleType.EACH, StockType.cents_off(.50)),
+        "SODA LEMON": StockType(1.79, SaleType.EACH, StockType.standard),
+        "SODA COLA": StockType(2.59, SaleType.EACH, StockType.standard),
+    }
+    promotions = PromotionIndex([
+        MixAndMatch("3 YOGURTS $5", ["YOGURT STRAWBRY", "YOGURT PLAIN",
+                                     "YOGURT GREEK"], qty=3, price=5.00),
+        MixAndMatch("2 GREEK $3.50", ["YOGURT GREEK"], qty=2, price=3.50),
+        BuyGetPercentOff("CHIPS AND SALSA", ["CHIPS TORTILLA"],
+                         ["SALSA MILD", "SALSA HOT"], pct_off=50),
+        MixAndMatch("4 MIXERS $6", ["YOGURT PLAIN", "LIMES", "SODA LEMON",
+                                    "SODA COLA"], qty=4, price=6.00),
+        BuyGetPercentOff("GUAC AND SODA", ["GUACAMOLE"],
+                         ["SODA COLA", "SODA LEMON"], pct_off=30),
+        MixAndMatch("2 PARTY $6", ["CHIPS TORTILLA", "SALSA MILD",
+                                   "SALSA HOT", "GUACAMOLE"], qty=2,
+                    price=6.00),
+    ])
+    scans = [("YOGURT STRAWBRY", 3), ("YOGURT PLAIN", 4), ("YOGURT GREEK", 5),
+             ("CHIPS TORTILLA", 2), ("SALSA MILD", 3), ("SALSA HOT", 2),
+             ("LIMES", 3), ("GUACAMOLE", 2), ("SODA LEMON", 1),
+             ("SODA COLA", 2)]
+    pos = POS(stock_items, fixed_point=True)
+    greedy = PromotionReceipt(pos, promotions)
+    solved = PromotionReceipt(pos, promotions, AssignmentSolver())
+    for receipt in (greedy, solved):
+        receipt.add_scans(scans)
+    [assignment] = solved.assignments()
+    assert assignment.optimal
+    assert greedy.total() == Decimal('54.42')
+    assert solved.total() == Decimal('51.90')
+    assert sum(solved.discounts().values()) == assignment.savings
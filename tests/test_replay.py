@@ -0,0 +1,95 @@
+""" Test replay of scan journals """
+import io
+import json
+from decimal import Decimal
+import pytest
+from ..receipts import POS, StockType, SaleType
+from ..replay import replay, transactions, write_results
+
+
+@pytest.fixture(scope='module')
+def pos() -> POS:
+    "a small store"
+    return POS({
+        "SOUP": StockType(1.99, SaleType.EACH, StockType.standard),
+        "BANANAS": StockType(0.28, SaleType.BY_WT, StockType.cents_off(.08)),
+        "COKE": StockType(1.29, SaleType.EACH,
+                          StockType.conditional_percent_off(2, 1, 50)),
+    })
+
+
+def journal(*records) -> list:
+    "journal lines from records"
+    return [json.dumps(record) + '\n' for record in records]
+
+
+def test_interleaved_transactions(pos) -> None:
+    """ Test that interleaved transactions are rebuilt separately and
+        produced in the order they are closed.
+    """
+    lines = journal(
+        {"txn": "A", "op": "scan", "item": "COKE", "qty": 3},
+        {"txn": "B", "op": "add", "item": "SOUP"},
+        {"txn": "A", "op": "add", "item": "COKE"},
+        {"txn": "B", "op": "scan", "item": "BANANAS", "qty": 3.5},
+        {"txn": "A", "op": "remove_last", "item": "COKE"},
+        {"txn": "B", "op": "remove", "item": "SOUP", "qty": 1},
+        {"txn": "B", "op": "close", "total": "0.70"},
+        {"txn": "A", "op": "close", "total": "9.99"},
+    )
+    results = list(replay(lines, pos))
+    assert [result.txn for result in results] == ["B", "A"]
+    assert results[0].total == Decimal('0.70')
+    assert results[0].matches
+    assert results[1].total == Decimal('3.23')
+    assert results[1].recorded == Decimal('9.99')
+    assert not results[1].matches
+
+
+def test_open_transactions_at_end() -> None:
+    """ Test that transactions without a close come out at the end in the
+        order they were opened.
+    """
+    records = [{"txn": txn, "op": "add", "item": "SOUP"}
+               for txn in ("X", "Y", "Z")]
+    records.append({"txn": "Y", "op": "close"})
+    assert [txn for txn, _ in transactions(records)] == ["Y", "X", "Z"]
+
+
+def test_rejected_operations(pos) -> None:
+    """ Test that operations the receipt rejects are reported and the rest
+        of the transaction is still replayed.
+    """
+    lines = journal(
+        {"txn": "A", "op": "add", "item": "NOT STOCKED"},
+        {"txn": "A", "op": "scan", "item": "SOUP", "qty": 1.5},
+        {"txn": "A", "op": "add", "item": "SOUP"},
+    )
+    (result,) = replay(lines, pos)
+    assert result.total == Decimal('1.99')
+    assert len(result.errors) == 2
+
+
+def test_process_pool_matches_serial(pos) -> None:
+    """ Test that replaying in worker processes gives the same results in
+        the same order as replaying in this process.
+    """
+    records = []
+    for num in range(200):
+        txn = f"T{num}"
+        records.append({"txn": txn, "op": "scan", "item": "COKE",
+                        "qty": num % 7 + 1})
+        records.append({"txn": txn, "op": "scan", "item": "BANANAS",
+                        "qty": num / 8})
+        if num % 3:
+            records.append({"txn": txn, "op": "remove", "item": "COKE",
+                            "qty": 2})
+        records.append({"txn": txn, "op": "close"})
+    lines = journal(*records)
+    serial = list(replay(lines, pos))
+    pooled = list(replay(lines, pos, workers=2, chunk_size=16,
+                         max_in_flight=3))
+    assert pooled == serial
+    out = io.StringIO()
+    assert write_results(pooled, out) == 0
+    assert len(out.getvalue().splitlines()) == 200
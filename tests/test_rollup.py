@@ -0,0 +1,150 @@
+""" Test streaming sales rollups """
+import pickle
+from decimal import Decimal
+from typing import Dict
+import pytest
+from ..receipts import POS, StockType, SaleType, Receipt, to_money
+from ..promotions import MixAndMatch, PromotionIndex, PromotionReceipt
+from ..rollup import SalesRollup, Totals
+
+
+@pytest.fixture(scope='module')
+def stock_items() -> Dict[str, StockType]:
+    "an inventory with prices that are not exact in binary"
+    return {
+        "CAMP SOUP 10.75z": StockType(1.99, SaleType.EACH, StockType.standard),
+        "BANANAS DELMONTE": StockType(0.28, SaleType.BY_WT,
+                                      StockType.cents_off(.08)),
+        "FNCYFST CATFD 3z": StockType(1.25, SaleType.EACH,
+                                      StockType.cents_off(.25, limit=6)),
+        "SMOKED SAUSAGE": StockType(4.99, SaleType.EACH,
+                                    StockType.cents_off(.45)),
+        "CHUCK ROAST": StockType(1.99, SaleType.BY_WT, StockType.standard),
+        "COKE CLASIC 1.Ol": StockType(1.29, SaleType.EACH,
+                                      StockType.conditional_percent_off(
+                                          min_items=2, disc_items=1,
+                                          pct_off=50, limit=6)),
+    }
+
+
+def basket(pos: POS) -> Receipt:
+    "a receipt with a void on it"
+    receipt = Receipt(pos)
+    receipt.add_scans([("CAMP SOUP 10.75z", 3), ("COKE CLASIC 1.Ol", 10),
+                       ("FNCYFST CATFD 3z", 8), ("BANANAS DELMONTE", 2.5),
+                       ("BANANAS DELMONTE", 1.0)])
+    receipt.remove_last("BANANAS DELMONTE")
+    return receipt
+
+
+@pytest.mark.parametrize('fixed_point', [False, True])
+def test_rollup(stock_items, fixed_point) -> None:
+    """ Test the quantities and revenue kept for each item """
+    pos = POS(stock_items, fixed_point)
+    rollup = SalesRollup()
+    receipt = basket(pos)
+    rollup.add(receipt)
+    coke = rollup.items["COKE CLASIC 1.Ol"]
+    # buy 2 get 1 half off, limit 6: 2 of 10 at the discount
+    assert (coke.full_units, coke.disc_units) == (8, 2)
+    catfood = rollup.items["FNCYFST CATFD 3z"]
+    assert (catfood.full_units, catfood.disc_units) == (2, 6)
+    assert catfood.discount == Decimal('1.50')
+    bananas = rollup.items["BANANAS DELMONTE"]
+    assert (bananas.full_weight, bananas.disc_weight) == (0, 2500)
+    assert bananas.weight == 2.5
+    total = rollup.total()
+    assert total.units == 21 and total.lines == 4
+    assert to_money(total.net) == receipt.total() == Decimal('26.58')
+    # the regular price of the float rules rounds each line up
+    assert total.discount == Decimal('2.99' if fixed_point else '3.01')
+    prefix = 'Fixed' if fixed_point else ''
+    assert rollup.by_rule()[f'{prefix}CentsOff'].units == 8
+    assert rollup.by_rule()[f'{prefix}CentsOff'].weight == 2.5
+
+
+def test_merge_is_exact(stock_items) -> None:
+    """ Test that rollups merged from lanes equal one rollup of them all """
+    pos = POS(stock_items)
+    whole = SalesRollup()
+    lanes = [SalesRollup() for _ in range(3)]
+    for num in range(9):
+        receipt = basket(pos)
+        receipt.add_scan("BANANAS DELMONTE", 0.1 * num)
+        whole.add(receipt)
+        lanes[num % 3].add(receipt)
+    # as a worker process would send them
+    store = SalesRollup()
+    for lane in lanes:
+        store.merge(pickle.loads(pickle.dumps(lane)))
+    assert store.receipts == whole.receipts == 9
+    assert store.items == whole.items
+    assert store.total() == whole.total()
+    assert store.total() != Totals()
+
+
+def test_promotions(stock_items) -> None:
+    """ Test that the discounts of promotions are kept by name """
+    promotions = PromotionIndex([
+        MixAndMatch("SOUP AND CAT", ["CAMP SOUP 10.75z", "FNCYFST CATFD 3z"],
+                    qty=2, price=1.50)])
+    rollup = SalesRollup()
+    for _ in range(2):
+        receipt = PromotionReceipt(POS(stock_items), promotions)
+        receipt.add_scans([("CAMP SOUP 10.75z", 1), ("FNCYFST CATFD 3z", 1)])
+        rollup.add(receipt)
+    # the catfood is 1.00 after its own special, soup and catfood 2.99
+    assert rollup.promotions == {"SOUP AND CAT": [2, 298000]}
+
+
+@pytest.mark.parametrize('fixed_point', [False, True])
+def test_net_reconciles_with_total(stock_items, fixed_point) -> None:
+    """ Test that the net revenue rounds to the receipt's total when the
+        lines rounded one by one do not add up to it
+    """
+    pos = POS(stock_items, fixed_point)
+    receipt = Receipt(pos)
+    receipt.add_scans([("BANANAS DELMONTE", 0.625), ("SMOKED SAUSAGE", 3),
+                       ("CHUCK ROAST", 0.125)])
+    assert sum(receipt.line(item)[1]
+               for item in receipt.purchases) == Decimal('13.99')
+    rollup = SalesRollup()
+    rollup.add(receipt)
+    assert to_money(rollup.total().net) == receipt.total() == Decimal('14.00')
+
+
+def test_same_specials_on_different_items() -> None:
+    """ Test that items with the same price and special are kept apart """
+    rollup = SalesRollup()
+    receipt = Receipt(POS({item: StockType(1.99, SaleType.EACH,
+                                           StockType.standard)
+                           for item in ("SOUP", "CHILI")}))
+    receipt.add_scans([("SOUP", 1), ("CHILI", 2)])
+    rollup.add(receipt)
+    assert rollup.items["SOUP"].units == 1
+    assert rollup.items["CHILI"].units == 2
+    assert rollup.by_rule()['Standard'].units == 3
+
+
+def test_rules_merge_in_any_order() -> None:
+    """ Test that the totals of an item sold under two rules are kept under
+        each rule, the same whichever order rollups are merged in
+    """
+    rollups = []
+    for pricing in (StockType.standard, StockType.cents_off(.50)):
+        rollup = SalesRollup()
+        receipt = Receipt(POS({"SOUP": StockType(1.99, SaleType.EACH,
+                                                 pricing)}))
+        receipt.add_scan("SOUP", 2)
+        rollup.add(receipt)
+        rollups.append(rollup)
+    first, second = (pickle.loads(pickle.dumps(rollup))
+                     for rollup in rollups)
+    merged = [SalesRollup().merge(first).merge(second),
+              SalesRollup().merge(second).merge(first)]
+    assert merged[0].by_rule() == merged[1].by_rule()
+    assert merged[0].items == merged[1].items
+    rules = merged[0].by_rule()
+    assert rules['Standard'].units == rules['CentsOff'].units == 2
+    assert rules['CentsOff'].discount == Decimal('1.00')
+    assert merged[0].items["SOUP"].units == 4
@@ -0,0 +1,121 @@
+""" Test the asyncio lane server and its load generator """
+import asyncio
+import pytest
+from ..receipts import POS, StockType, SaleType
+from ..server import LaneServer, ReceiptTable
+from ..loadgen import LaneClient, load, summarize
+
+
+@pytest.fixture(scope='module')
+def pos() -> POS:
+    "a small store"
+    return POS({
+        "CAMP SOUP 10.75z": StockType(1.99, SaleType.EACH, StockType.standard),
+        "BANANAS DELMONTE": StockType(0.28, SaleType.BY_WT,
+                                      StockType.cents_off(.08)),
+        "COKE CLASIC 1.Ol": StockType(1.29, SaleType.EACH,
+                                      StockType.conditional_percent_off(
+                                          min_items=2, disc_items=1,
+                                          pct_off=50)),
+    })
+
+
+def test_requests(pos) -> None:
+    """ Test each request against a LaneServer without a connection """
+    server = LaneServer(pos)
+    receipt_id = server.handle('OPEN')[3:]
+    assert server.handle(f'SCAN {receipt_id} CAMP SOUP 10.75z') == 'OK'
+    assert server.handle(f'ADD {receipt_id} 3.5 BANANAS DELMONTE') == 'OK'
+    assert server.handle(f'ADD {receipt_id} 4 COKE CLASIC 1.Ol') == 'OK'
+    assert server.handle(f'REMOVE {receipt_id} 1 COKE CLASIC 1.Ol') == 'OK'
+    assert server.handle(f'VOID {receipt_id} CAMP SOUP 10.75z') == 'OK'
+    assert server.handle(f'TOTAL {receipt_id}') == 'OK 3.93'
+    assert server.handle(f'CLOSE {receipt_id}') == 'OK 3.93'
+    assert server.handle(f'TOTAL {receipt_id}').startswith('ERR')
+    opened = server.handle('OPEN')[3:]
+    for bad in ('', 'FROB 1', 'TOTAL', f'SCAN {opened} NOT STOCKED',
+                f'ADD {opened} 1.5 CAMP SOUP 10.75z',
+                f'ADD {opened} lots CAMP SOUP 10.75z',
+                f'ADD {opened} 1e999 BANANAS DELMONTE',
+                f'ADD {opened} nan BANANAS DELMONTE',
+                f'ADD {opened} -2 CAMP SOUP 10.75z',
+                f'REMOVE {opened} 0 CAMP SOUP 10.75z'):
+        assert server.handle(bad).startswith('ERR')
+    assert server.handle(f'TOTAL {opened}') == 'OK 0.00'
+
+
+def test_unpriceable_amount(pos) -> None:
+    """ Test that quantities too large are refused, and that a receipt that
+        cannot be priced gets an ERR response and is kept open rather than
+        dropping the connection or the receipt
+    """
+    server = LaneServer(pos)
+    receipt_id = server.handle('OPEN')[3:]
+    assert server.handle(f'ADD {receipt_id} 1e308 BANANAS DELMONTE') \
+        .startswith('ERR')
+    assert server.handle(f'ADD {receipt_id} 10001 CAMP SOUP 10.75z') \
+        .startswith('ERR')
+    failures = [ArithmeticError("cannot price")]
+
+    def flaky(stock, qty):
+        if failures:
+            raise failures.pop()
+        return StockType.standard(stock, qty)
+
+    server = LaneServer(POS({"SOUP": StockType(1.99, SaleType.EACH, flaky)}))
+    receipt_id = server.handle('OPEN')[3:]
+    assert server.handle(f'SCAN {receipt_id} SOUP') == 'OK'
+    assert server.handle(f'CLOSE {receipt_id}').startswith('ERR')
+    assert server.handle(f'CLOSE {receipt_id}') == 'OK 1.99'
+
+
+def test_idle_and_excess_receipts_evicted(pos) -> None:
+    """ Test that the receipt table stays within its limits """
+    table = ReceiptTable(pos, max_receipts=3)
+    ids = [table.open() for _ in range(5)]
+    assert len(table) == 3
+    assert table.evicted == 2
+    with pytest.raises(KeyError):
+        table.get(ids[0])
+    # using a receipt keeps it from being evicted first
+    table.get(ids[2])
+    table.open()
+    table.get(ids[2])
+    with pytest.raises(KeyError):
+        table.get(ids[3])
+    table.idle_seconds = 0
+    table.open()
+    assert len(table) == 1
+
+
+def test_load_over_tcp(pos) -> None:
+    """ Test many concurrent connections, pipelined requests and the load
+        generator's latency report
+    """
+    items = [(item, stock.how_sold == SaleType.BY_WT)
+             for item, stock in pos.stock_items.items()]
+
+    async def run():
+        server = LaneServer(pos)
+        listener = await server.start(0)
+        port = listener.sockets[0].getsockname()[1]
+        latencies = await load(items, connections=20, receipts=3, scans=10,
+                               port=port)
+        # several requests sent at once are answered in order
+        client = await LaneClient.connect(port)
+        client.writer.write(b'OPEN\nSCAN 999999 CAMP SOUP 10.75z\nOPEN\n')
+        responses = [await client.reader.readline() for _ in range(3)]
+        await client.close()
+        listener.close()
+        await listener.wait_closed()
+        return server, latencies, responses
+
+    server, latencies, responses = asyncio.run(run())
+    assert len(server.table) == 2
+    assert responses[1].startswith(b'ERR')
+    assert int(responses[2][3:]) == int(responses[0][3:]) + 1
+    summary = summarize(latencies)
+    assert summary['OPEN'][0] == summary['CLOSE'][0] == 60
+    assert summary['SCAN'][0] + summary['ADD'][0] == 600
+    for count, p50, p99 in summary.values():
+        assert 0 < p50 <= p99